@@ -0,0 +1,186 @@
+from DockerBuildSystem import DockerImageTools
+import os
+import re
+import json
+import stat
+import hashlib
+import logging
+
+log = logging.getLogger(__name__)
+
+CONTENT_HASH_LABEL = 'com.dockerbuildsystem.content-hash'
+DEFAULT_INDEX_FILE = '.dbs-build-index.json'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def GetServiceContentHash(context, dockerfile = 'Dockerfile', args = None, platforms = None, dependencyHashes = None):
+    """Returns a sha256 content hash of a build: every file in the `context`
+    folder which is not excluded by the .dockerignore file, the Dockerfile,
+    the build args, the target `platforms` and the `dependencyHashes` of
+    the services the build depends on, like the services it builds FROM.
+    `dockerfile` is a path relative to the working directory, like the one
+    given to DockerImageTools.BuildImage.
+    """
+    contentHash = hashlib.sha256()
+    HashBuildContext(contentHash, context, GetDockerignorePatterns(context, dockerfile))
+    contentHash.update(b'\0dockerfile\0')
+    HashFile(contentHash, dockerfile)
+    contentHash.update(b'\0args\0')
+    for arg in sorted(GetBuildArgs(args)):
+        contentHash.update(arg.encode('utf-8') + b'\0')
+    contentHash.update(b'\0platforms\0')
+    for platform in sorted(set(platforms or [])):
+        contentHash.update(platform.encode('utf-8') + b'\0')
+    contentHash.update(b'\0dependencies\0')
+    for dependencyHash in sorted(dependencyHashes or []):
+        contentHash.update(dependencyHash.encode('utf-8') + b'\0')
+    return 'sha256:' + contentHash.hexdigest()
+
+
+def GetBuildArgs(args):
+    if args is None:
+        return []
+    if isinstance(args, dict):
+        return ['{0}={1}'.format(key, '' if value is None else value) for key, value in args.items()]
+    return list(args)
+
+
+def HashBuildContext(contentHash, context, ignorePatterns):
+    """Add the relative path, executable bit and content of every included
+    file in `context` to `contentHash`, in a stable order. Ignored folders
+    are not walked unless an exception pattern (`!pattern`) may re-include
+    something within them.
+    """
+    hasExceptions = any(exclude is False for _, exclude in ignorePatterns)
+    for root, folders, files in os.walk(context):
+        relativeRoot = os.path.relpath(root, context).replace(os.sep, '/')
+        relativeRoot = '' if relativeRoot == '.' else relativeRoot + '/'
+        folders.sort()
+        if not hasExceptions:
+            folders[:] = [folder for folder in folders
+                          if not IsPathIgnored(relativeRoot + folder, ignorePatterns)]
+        for fileName in sorted(files):
+            relativePath = relativeRoot + fileName
+            if IsPathIgnored(relativePath, ignorePatterns):
+                continue
+            filePath = os.path.join(root, fileName)
+            fileStat = os.lstat(filePath)
+            contentHash.update(relativePath.encode('utf-8') + b'\0')
+            if stat.S_ISLNK(fileStat.st_mode):
+                contentHash.update(b'link\0' + os.readlink(filePath).encode('utf-8') + b'\0')
+                continue
+            contentHash.update(b'x\0' if fileStat.st_mode & stat.S_IXUSR else b'-\0')
+            HashFile(contentHash, filePath)
+
+
+def HashFile(contentHash, filePath):
+    with open(filePath, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            contentHash.update(chunk)
+    contentHash.update(b'\0')
+
+
+def GetDockerignorePatterns(context, dockerfile = 'Dockerfile'):
+    """Returns the compiled patterns of the `<dockerfile>.dockerignore` file
+    next to the Dockerfile, or else of the .dockerignore file in the
+    context, as a list of `(regex, exclude)` tuples.
+    """
+    dockerignoreFile = dockerfile + '.dockerignore'
+    if not os.path.isfile(dockerignoreFile):
+        dockerignoreFile = os.path.join(context, '.dockerignore')
+    if not os.path.isfile(dockerignoreFile):
+        return []
+    with open(dockerignoreFile, 'r') as f:
+        return ParseDockerignorePatterns(f.read().splitlines())
+
+
+def ParseDockerignorePatterns(lines):
+    patterns = []
+    for line in lines:
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        exclude = not line.startswith('!')
+        if not exclude:
+            line = line[1:].strip()
+        line = os.path.normpath(line).replace(os.sep, '/').lstrip('/')
+        if line == '.':
+            continue
+        patterns.append((re.compile(TranslateDockerignorePattern(line)), exclude))
+    return patterns
+
+
+def TranslateDockerignorePattern(pattern):
+    """Translate a .dockerignore pattern to a regex. `**` matches any number
+    of folders, `*` and `?` do not match a path separator, and a pattern
+    matching a folder also matches everything within it.
+    """
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**', i):
+            i += 2
+            if pattern.startswith('/', i):
+                i += 1
+                regex += '(.*/)?'
+            else:
+                regex += '.*'
+            continue
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                characterClass = pattern[i + 1:end]
+                if characterClass.startswith('^'):
+                    characterClass = '^' + characterClass[1:].replace('\\', '\\\\')
+                else:
+                    characterClass = characterClass.replace('\\', '\\\\')
+                regex += '[' + characterClass + ']'
+                i = end
+        elif char == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(char)
+        i += 1
+    return '^' + regex + '(/.*)?$'
+
+
+def IsPathIgnored(relativePath, ignorePatterns):
+    ignored = False
+    for regex, exclude in ignorePatterns:
+        if ignored != exclude and regex.match(relativePath):
+            ignored = exclude
+    return ignored
+
+
+def LoadBuildIndex(indexFile = DEFAULT_INDEX_FILE):
+    if not os.path.isfile(indexFile):
+        return {}
+    with open(indexFile, 'r') as f:
+        return json.load(f)
+
+
+def SaveBuildIndex(index, indexFile = DEFAULT_INDEX_FILE):
+    tmpFile = indexFile + '.tmp'
+    with open(tmpFile, 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmpFile, indexFile)
+
+
+def IsImageUpToDate(imageName, contentHash, index):
+    """Returns True if the index and the content hash label of the local
+    image both match `contentHash`.
+    """
+    if index.get(imageName) != contentHash:
+        return False
+    try:
+        return DockerImageTools.GetImageLabel(imageName, CONTENT_HASH_LABEL) == contentHash
+    except Exception:
+        return False
@@ -0,0 +1,152 @@
+from DockerBuildSystem import TerminalTools
+import threading
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUILDER_NAME = 'dockerbuildsystem'
+BUILD_STEP_PATTERN = re.compile(r'^#(\d+) (?:(\[(?:[^\]]* )?(?:internal|auth)\])|(CACHED)|\[)')
+
+_ensuredBuilders = set()
+_ensuredBuildersLock = threading.Lock()
+
+
+def BuilderExists(builderName):
+    try:
+        TerminalTools.ExecuteTerminalCommandAndGetOutput('docker buildx inspect ' + builderName)
+    except Exception:
+        return False
+    return True
+
+
+def CreateBuilder(builderName, driver = 'docker-container', driverOptions = None, use = False):
+    log.info("Creating buildx builder: " + builderName)
+    dockerCommand = 'docker buildx create --name ' + builderName + ' --driver ' + driver
+    for driverOption in driverOptions or []:
+        dockerCommand += ' --driver-opt ' + driverOption
+    if use:
+        dockerCommand += ' --use'
+    TerminalTools.ExecuteTerminalCommands([dockerCommand], True)
+
+
+def BootstrapBuilder(builderName):
+    dockerCommand = 'docker buildx inspect --bootstrap ' + builderName
+    TerminalTools.ExecuteTerminalCommands([dockerCommand], True)
+
+
+def EnsureBuilder(builderName = DEFAULT_BUILDER_NAME, driver = 'docker-container', driverOptions = None, bootstrap = True):
+    """Create the named buildx builder unless it already exists, and
+    bootstrap it. This is only done once per builder in this process, so
+    every build can call it and keep reusing the same BuildKit container,
+    and with it the BuildKit layer cache.
+    """
+    with _ensuredBuildersLock:
+        if builderName in _ensuredBuilders:
+            return builderName
+        if BuilderExists(builderName):
+            log.info("Reusing buildx builder: " + builderName)
+        else:
+            CreateBuilder(builderName, driver, driverOptions)
+        if bootstrap:
+            BootstrapBuilder(builderName)
+        _ensuredBuilders.add(builderName)
+    return builderName
+
+
+def PruneBuilder(builderName = DEFAULT_BUILDER_NAME, pruneAll = False, keepStorage = None):
+    log.info("Pruning build cache of buildx builder: " + builderName)
+    dockerCommand = 'docker buildx prune --force --builder ' + builderName
+    if pruneAll:
+        dockerCommand += ' --all'
+    if not(keepStorage is None):
+        dockerCommand += ' --keep-storage ' + str(keepStorage)
+    TerminalTools.ExecuteTerminalCommands([dockerCommand], True)
+
+
+def RemoveBuilder(builderName = DEFAULT_BUILDER_NAME, keepState = False):
+    log.info("Removing buildx builder: " + builderName)
+    dockerCommand = 'docker buildx rm'
+    if keepState:
+        dockerCommand += ' --keep-state'
+    dockerCommand += ' ' + builderName
+    with _ensuredBuildersLock:
+        _ensuredBuilders.discard(builderName)
+        TerminalTools.ExecuteTerminalCommands([dockerCommand])
+
+
+def RegistryCache(ref, mode = None):
+    return {'type': 'registry', 'ref': ref, 'mode': mode}
+
+
+def LocalCache(directory, mode = None):
+    return {'type': 'local', 'directory': directory, 'mode': mode}
+
+
+def InlineCache():
+    return {'type': 'inline'}
+
+
+def GhaCache(scope = None, mode = None):
+    return {'type': 'gha', 'scope': scope, 'mode': mode}
+
+
+def GetCacheCommand(cacheFrom = None, cacheTo = None):
+    """Returns the `--cache-from` and `--cache-to` arguments for a buildx
+    build. Each cache is either a string passed on as is, like
+    'type=registry,ref=my_repo/my.service:cache', or a dict as returned by
+    RegistryCache, LocalCache, InlineCache or GhaCache.
+    """
+    cacheCommand = ''
+    for cache in cacheFrom or []:
+        cacheOption = GetCacheOption(cache, export=False)
+        if not(cacheOption is None):
+            cacheCommand += ' --cache-from ' + cacheOption
+    for cache in cacheTo or []:
+        cacheCommand += ' --cache-to ' + GetCacheOption(cache, export=True)
+    return cacheCommand
+
+
+def GetCacheOption(cache, export):
+    if isinstance(cache, str):
+        return cache
+    cache = {key: value for key, value in cache.items() if not(value is None)}
+    if cache['type'] == 'inline' and not export:
+        return None
+    if cache['type'] == 'local':
+        cache['dest' if export else 'src'] = cache.pop('directory')
+    if not export:
+        cache.pop('mode', None)
+    return ','.join(['{0}={1}'.format(key, value) for key, value in cache.items()])
+
+
+def ParseBuildCacheStatistics(outputLines):
+    """Count the build steps, and the steps which were cached, in the plain
+    progress output of a BuildKit build. `[internal]` and `[auth]` steps,
+    like loading the build definition and metadata, are never cached and
+    are not counted, also when they are prefixed with the platform, like
+    `[linux/amd64 internal]`.
+    """
+    steps = set()
+    cachedSteps = set()
+    internalSteps = set()
+    for line in outputLines:
+        match = BUILD_STEP_PATTERN.match(line)
+        if match is None:
+            continue
+        if not(match.group(3) is None):
+            cachedSteps.add(match.group(1))
+        elif not(match.group(2) is None):
+            internalSteps.add(match.group(1))
+        else:
+            steps.add(match.group(1))
+    steps.update(cachedSteps)
+    steps.difference_update(internalSteps)
+    cachedSteps.difference_update(internalSteps)
+    hitRate = float(len(cachedSteps)) / len(steps) if len(steps) > 0 else 0.0
+    return {'steps': len(steps), 'cached': len(cachedSteps), 'hitRate': hitRate}
+
+
+def LogBuildCacheStatistics(cacheStatistics, outputPrefix = ''):
+    log.info("{0}Build cache: {1} of {2} steps cached ({3:.0%})".format(
+        outputPrefix, cacheStatistics['cached'], cacheStatistics['steps'], cacheStatistics['hitRate']))
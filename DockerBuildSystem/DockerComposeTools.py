@@ -1,28 +1,176 @@
 import os
+import re
+import uuid
 import random
+import shutil
 import logging
-from DockerBuildSystem import TerminalTools, DockerImageTools, YamlTools
+import functools
+import time
+import tempfile
+from dotenv import dotenv_values
+from DockerBuildSystem import TerminalTools, DockerImageTools, YamlTools, ParallelTools, MultiArchTools, EngineApiTools, BuildHashTools, ImageArchiveTools, JUnitTools, InstrumentationTools
 
 log = logging.getLogger(__name__)
 
 
-def MergeComposeFiles(composeFiles, outputComposeFile):
-    terminalCommand = "docker compose"
-    terminalCommand += MergeComposeFileToTerminalCommand(composeFiles)
-    terminalCommand += " config > " + outputComposeFile
-    TerminalTools.ExecuteTerminalCommands([terminalCommand], True)
-
+def MergeComposeFiles(composeFiles, outputComposeFile, useDockerCompose = False):
+    """Merge compose files into `outputComposeFile`, in process with
+    GetMergedComposeData, or with `docker compose config` if
+    `useDockerCompose` is True.
+    """
+    if useDockerCompose:
+        terminalCommand = "docker compose"
+        terminalCommand += MergeComposeFileToTerminalCommand(composeFiles)
+        terminalCommand += " config > " + outputComposeFile
+        TerminalTools.ExecuteTerminalCommands([terminalCommand], True)
+        return
+    YamlTools.DumpYamlDataToFile(EscapeComposeValues(GetMergedComposeData(composeFiles)), outputComposeFile)
+
+
+def GetMergedComposeData(composeFiles):
+    """Merge and normalize compose files like `docker compose config`,
+    without docker: values are interpolated with the environment and the
+    .env file of the project folder (the folder of the first compose file),
+    files are merged with the compose override rules, relative build
+    contexts, bind mounts, env files and secret and config files are
+    resolved against the project folder, and environment and build args lists become dicts.
+    """
+    projectFolder = os.path.abspath(os.path.dirname(composeFiles[0]))
+    environment = {}
+    projectEnvFile = os.path.join(projectFolder, '.env')
+    if os.path.isfile(projectEnvFile):
+        environment.update({key: value for key, value in dotenv_values(projectEnvFile).items() if not(value is None)})
+    environment.update(os.environ)
+
+    yamlData = {}
+    for composeFile in composeFiles:
+        newYamlData = YamlTools.GetSingleYamlData(composeFile, replaceEnvironmentVariablesMatches=False)
+        newYamlData = YamlTools.InterpolateYamlData(newYamlData, environment)
+        for service in newYamlData.get('services', {}):
+            NormalizeComposeServiceMappings(newYamlData['services'][service], environment)
+        yamlData = YamlTools.MergeYamlData(yamlData, newYamlData, YamlTools.COMPOSE_MERGE_STRATEGIES)
+    yamlData.pop('version', None)
+    for service in yamlData.get('services', {}):
+        NormalizeComposeServicePaths(yamlData['services'][service], projectFolder)
+    for key in ['secrets', 'configs']:
+        for objectMap in (yamlData.get(key) or {}).values():
+            if isinstance(objectMap, dict) and 'file' in objectMap:
+                objectMap['file'] = GetComposeAbsolutePath(objectMap['file'], projectFolder)
+    return yamlData
+
+
+def NormalizeComposeServiceMappings(serviceMap, environment):
+    if 'build' in serviceMap:
+        if not isinstance(serviceMap['build'], dict):
+            serviceMap['build'] = {'context': serviceMap['build']}
+        if isinstance(serviceMap['build'].get('args'), list):
+            serviceMap['build']['args'] = GetComposeMapping(serviceMap['build']['args'], environment)
+    for key in ['environment', 'labels']:
+        if isinstance(serviceMap.get(key), list):
+            serviceMap[key] = GetComposeMapping(serviceMap[key], environment if key == 'environment' else {})
+
+
+def NormalizeComposeServicePaths(serviceMap, projectFolder):
+    if 'build' in serviceMap:
+        context = serviceMap['build'].get('context', '.')
+        if not('://' in context or context.startswith('git@')):
+            serviceMap['build']['context'] = GetComposeAbsolutePath(context, projectFolder)
+        serviceMap['build'].setdefault('dockerfile', 'Dockerfile')
+    if 'env_file' in serviceMap:
+        envFiles = serviceMap['env_file'] if isinstance(serviceMap['env_file'], list) else [serviceMap['env_file']]
+        for index, envFile in enumerate(envFiles):
+            if isinstance(envFile, dict):
+                envFile['path'] = GetComposeAbsolutePath(envFile['path'], projectFolder)
+            else:
+                envFiles[index] = GetComposeAbsolutePath(envFile, projectFolder)
+        serviceMap['env_file'] = envFiles
+    for index, volume in enumerate(serviceMap.get('volumes', [])):
+        if isinstance(volume, str) and volume.startswith(('.', '~')) and ':' in volume:
+            source, target = volume.split(':', 1)
+            serviceMap['volumes'][index] = GetComposeAbsolutePath(source, projectFolder) + ':' + target
+        elif isinstance(volume, dict) and volume.get('type') == 'bind' and 'source' in volume:
+            volume['source'] = GetComposeAbsolutePath(volume['source'], projectFolder)
+
+
+def EscapeComposeValues(yamlData):
+    """Escape `$` as `$$` in all string values, like `docker compose config`
+    does, so the merged file is not interpolated a second time. The values
+    must already be interpolated, see GetMergedComposeData.
+    """
+    if isinstance(yamlData, dict):
+        return {key: EscapeComposeValues(value) for key, value in yamlData.items()}
+    if isinstance(yamlData, list):
+        return [EscapeComposeValues(value) for value in yamlData]
+    if isinstance(yamlData, str):
+        return yamlData.replace('$', '$$')
+    return yamlData
+
+
+def GetComposeAbsolutePath(path, projectFolder):
+    return os.path.normpath(os.path.join(projectFolder, os.path.expanduser(path)))
+
+
+def GetComposeMapping(keyValues, environment):
+    mapping = {}
+    for keyValue in keyValues:
+        if '=' in keyValue:
+            key, value = keyValue.split('=', 1)
+            mapping[key] = value
+        else:
+            mapping[keyValue] = environment.get(keyValue)
+    return mapping
+
+
+def DockerComposeBuild(composeFiles, incremental = False, indexFile = BuildHashTools.DEFAULT_INDEX_FILE, projectName = None):
+    """Build all services with `docker compose build`. With `incremental`,
+    only the services whose content hash (see BuildHashTools) differs from
+    the local index file and the label of the existing image are built.
+    """
+    if not incremental:
+        terminalCommand = "docker compose"
+        terminalCommand += MergeComposeFileToTerminalCommand(composeFiles, projectName)
+        terminalCommand += " build"
+        TerminalTools.ExecuteTerminalCommands([terminalCommand], True)
+        return
+
+    dockerComposeMap = YamlTools.GetYamlData(composeFiles)
+    composeFolder = os.path.dirname(composeFiles[0])
+    index = BuildHashTools.LoadBuildIndex(indexFile)
+    contentHashes = GetServiceContentHashes(dockerComposeMap, composeFolder=composeFolder)
+    changedServices = {}
+    for service, contentHash in contentHashes.items():
+        serviceMap = dockerComposeMap['services'][service]
+        imageName = serviceMap.get('image')
+        if not(imageName is None) and BuildHashTools.IsImageUpToDate(imageName, contentHash, index):
+            log.info('Skipping build of unchanged service {0}'.format(service))
+            continue
+        changedServices[service] = (imageName, contentHash)
+    if len(changedServices) == 0:
+        return
+
+    labelsFile, labelsComposeFile = tempfile.mkstemp(suffix='.yml')
+    os.close(labelsFile)
+    try:
+        labelsYamlData = {'services': {service: {'build': {'labels': {BuildHashTools.CONTENT_HASH_LABEL: contentHash}}}
+                                       for service, (_, contentHash) in changedServices.items()}}
+        YamlTools.DumpYamlDataToFile(labelsYamlData, labelsComposeFile)
+        terminalCommand = "docker compose"
+        terminalCommand += MergeComposeFileToTerminalCommand(composeFiles + [labelsComposeFile], projectName)
+        terminalCommand += " build " + " ".join(changedServices)
+        TerminalTools.ExecuteTerminalCommands([terminalCommand], True)
+    finally:
+        os.remove(labelsComposeFile)
 
-def DockerComposeBuild(composeFiles):
-    terminalCommand = "docker compose"
-    terminalCommand += MergeComposeFileToTerminalCommand(composeFiles)
-    terminalCommand += " build"
-    TerminalTools.ExecuteTerminalCommands([terminalCommand], True)
+    for imageName, contentHash in changedServices.values():
+        if not(imageName is None):
+            index[imageName] = contentHash
+    DockerImageTools.InvalidateInspectCache([imageName for imageName, _ in changedServices.values() if not(imageName is None)])
+    BuildHashTools.SaveBuildIndex(index, indexFile)
 
 
-def DockerComposeUp(composeFiles, abortOnContainerExit = True, detached = False):
+def DockerComposeUp(composeFiles, abortOnContainerExit = True, detached = False, projectName = None):
     terminalCommand = "docker compose"
-    terminalCommand += MergeComposeFileToTerminalCommand(composeFiles)
+    terminalCommand += MergeComposeFileToTerminalCommand(composeFiles, projectName)
     terminalCommand += " up"
     if detached:
         terminalCommand += " -d"
@@ -31,16 +179,16 @@ def DockerComposeUp(composeFiles, abortOnContainerExit = True, detached = False)
     TerminalTools.ExecuteTerminalCommands([terminalCommand], False)
 
 
-def DockerComposeDown(composeFiles):
+def DockerComposeDown(composeFiles, projectName = None):
     terminalCommand = "docker compose"
-    terminalCommand += MergeComposeFileToTerminalCommand(composeFiles)
+    terminalCommand += MergeComposeFileToTerminalCommand(composeFiles, projectName)
     terminalCommand += " down"
     TerminalTools.ExecuteTerminalCommands([terminalCommand])
 
 
-def DockerComposeRemove(composeFiles, force = True):
+def DockerComposeRemove(composeFiles, force = True, projectName = None):
     terminalCommand = "docker compose"
-    terminalCommand += MergeComposeFileToTerminalCommand(composeFiles)
+    terminalCommand += MergeComposeFileToTerminalCommand(composeFiles, projectName)
     terminalCommand += " rm"
     if force:
         terminalCommand += " -f"
@@ -54,14 +202,21 @@ def DockerComposePush(composeFiles):
     TerminalTools.ExecuteTerminalCommands([terminalCommand], True)
 
 
-def DockerComposePull(composeFiles, dryRun=False):
+def DockerComposePull(composeFiles, dryRun=False, retryPolicy=None):
     terminalCommand = "docker compose"
     terminalCommand += MergeComposeFileToTerminalCommand(composeFiles)
     terminalCommand += " pull"
     if dryRun:
         log.info("would have called {}".format(terminalCommand))
     else:
-        TerminalTools.ExecuteTerminalCommands([terminalCommand], True)
+        TerminalTools.ExecuteTerminalCommands([terminalCommand], True, retryPolicy=retryPolicy)
+
+
+async def DockerComposePullAsync(composeFiles, timeoutInSeconds = None):
+    terminalCommand = "docker compose"
+    terminalCommand += MergeComposeFileToTerminalCommand(composeFiles)
+    terminalCommand += " pull"
+    await TerminalTools.ExecuteTerminalCommandsAsync([terminalCommand], True, timeoutInSeconds=timeoutInSeconds)
 
 
 def TagImages(composeFile, newTag, dryRun = False):
@@ -75,15 +230,35 @@ def TagImages(composeFile, newTag, dryRun = False):
             log.info('Would have tagged image {} as {}'.format(sourceImage, targetImage))
 
 
-def SaveImages(composeFile, outputFolder):
+def SaveImages(composeFile, outputFolder, maxParallel = 1, compression = None, combinedArchiveName = None, skipUnchanged = True):
+    """Save the image of each service to its own archive in `outputFolder`,
+    running up to `maxParallel` saves at the same time, or all images to one
+    `combinedArchiveName` archive, which stores shared layers once. Archives
+    can be compressed with 'gzip' or 'zstd', and archives whose images are
+    unchanged since the previous save are skipped (see
+    ImageArchiveTools.SaveImageArchive). Returns the result of each save.
+    """
     dockerComposeMap = YamlTools.GetYamlData([composeFile])
     if not(os.path.isdir(outputFolder)):
         os.makedirs(outputFolder)
+    imageNamesByArchive = {}
     for service in dockerComposeMap['services']:
         sourceImage = dockerComposeMap['services'][service]['image']
-        imageName = sourceImage[sourceImage.rfind('/')+1:].replace(':', '-') + '.tar'
-        outputPath = os.path.join(outputFolder, imageName)
-        DockerImageTools.SaveImage(sourceImage, outputPath)
+        archiveName = combinedArchiveName
+        if archiveName is None:
+            archiveName = sourceImage[sourceImage.rfind('/')+1:].replace(':', '-')
+        archivePath = ImageArchiveTools.GetArchivePath(outputFolder, archiveName, compression)
+        imageNamesByArchive.setdefault(archivePath, []).append(sourceImage)
+    return ImageArchiveTools.SaveImageArchives(imageNamesByArchive, compression, maxParallel, skipUnchanged)
+
+
+def LoadImages(inputPath, maxParallel = 1, skipExisting = True):
+    """Load the archives written by SaveImages from the `inputPath` folder,
+    or a single combined archive, with up to `maxParallel` loads at the same
+    time. Archives whose images all exist already are skipped, and the load
+    throughput is logged. Returns the result of each load.
+    """
+    return ImageArchiveTools.LoadImageArchives(inputPath, maxParallel, skipExisting)
 
 
 def PublishDockerImages(composeFile, dryRun = False):
@@ -96,8 +271,29 @@ def PublishDockerImages(composeFile, dryRun = False):
             log.info('Would have pushed {}'.format(sourceImage))
 
 
-def MultiBuildDockerImages(composeFile, platforms, tags = None, push = False, dryRun = False):
+def MultiBuildDockerImages(composeFile, platforms, tags = None, push = False, dryRun = False, maxParallel = 1, cacheFrom = None, cacheTo = None,
+                           incremental = False, indexFile = BuildHashTools.DEFAULT_INDEX_FILE):
+    """Build the services with `build.cache_from` and `build.cache_to` from
+    the compose file, plus `cacheFrom` and `cacheTo` for all services, as
+    build cache import/export. Returns the cache statistics of each service.
+
+    With `incremental`, each image is labeled with the content hash of its
+    build (see BuildHashTools), and services whose hash matches both the
+    local index file and the label of the existing image are only tagged
+    (and pushed) instead of built. Multi-platform images which are only
+    pushed never exist locally, and are always built.
+
+    Services are built after the services they depend on, through
+    `depends_on` or by building FROM their images, with up to `maxParallel`
+    builds running at once. The critical path of the build is logged.
+    """
     dockerComposeMap = YamlTools.GetYamlData([composeFile])
+    dependencies = GetServiceBuildDependencies(dockerComposeMap, tags)
+    log.info('Build order: ' + ' | '.join([', '.join(wave) for wave in ParallelTools.GetTopologicalWaves(dependencies)]))
+    index = BuildHashTools.LoadBuildIndex(indexFile) if incremental else {}
+    contentHashes = GetServiceContentHashes(dockerComposeMap, platforms, tags) if incremental else {}
+    builtContentHashes = {}
+    buildTasks = []
     for service in dockerComposeMap['services']:
         sourceImage = dockerComposeMap['services'][service]['image']
         if 'build' not in dockerComposeMap['services'][service]:
@@ -105,43 +301,223 @@ def MultiBuildDockerImages(composeFile, platforms, tags = None, push = False, dr
         dockerfile = dockerComposeMap['services'][service]['build'].get('dockerfile', 'Dockerfile')
         context = dockerComposeMap['services'][service]['build'].get('context', '.')
         args = dockerComposeMap['services'][service]['build'].get('args', [])
+        serviceCacheFrom = dockerComposeMap['services'][service]['build'].get('cache_from', []) + list(cacheFrom or [])
+        serviceCacheTo = dockerComposeMap['services'][service]['build'].get('cache_to', []) + list(cacheTo or [])
         fullPathDockerfile = os.path.join(context, dockerfile)
+        labels = None
+        if incremental:
+            contentHash = contentHashes[service]
+            if BuildHashTools.IsImageUpToDate(sourceImage, contentHash, index):
+                log.info('Skipping build of unchanged service {0}'.format(service))
+                if not dryRun:
+                    buildTasks.append((service, functools.partial(TagUnchangedImage, sourceImage, tags, push)))
+                continue
+            labels = {BuildHashTools.CONTENT_HASH_LABEL: contentHash}
+            builtContentHashes[sourceImage] = contentHash
         if not dryRun:
-            DockerImageTools.BuildImage(sourceImage, fullPathDockerfile, context, args, tags, platforms, push)
+            outputPrefix = '[{0}] '.format(service) if not(maxParallel is None) and maxParallel > 1 else ''
+            buildTasks.append((service, functools.partial(
+                DockerImageTools.BuildImage, sourceImage, fullPathDockerfile, context, args, tags, platforms, push, outputPrefix,
+                cacheFrom=serviceCacheFrom, cacheTo=serviceCacheTo, labels=labels)))
         else:
             log.info('Would have multi built {}'.format(sourceImage))
-
-
-def PromoteDockerImages(composeFile, targetTags, sourceFeed = None, targetFeed = None, user = None, password = None, logoutFromFeeds = False, dryRun = False):
+    durations = {}
+    results = ParallelTools.ExecuteGraphInParallel(buildTasks, dependencies, maxParallel, durations)
+    if len(durations) > 0:
+        PrintCriticalPath(dependencies, durations)
+    if incremental and not dryRun:
+        index.update(builtContentHashes)
+        BuildHashTools.SaveBuildIndex(index, indexFile)
+    return results
+
+
+def GetServiceContentHashes(dockerComposeMap, platforms = None, tags = None, composeFolder = ''):
+    """Returns the content hash (see BuildHashTools) of each built service.
+    The hash of a service includes the `platforms`, or else the
+    `build.platforms` of the service, and the hashes of the services it
+    depends on (see GetServiceBuildDependencies), so a service is rebuilt
+    when a service it builds FROM is. Build contexts are relative to
+    `composeFolder`.
+    """
+    services = dockerComposeMap.get('services', {})
+    dependencies = GetServiceBuildDependencies(dockerComposeMap, tags, composeFolder)
+    contentHashes = {}
+    for wave in ParallelTools.GetTopologicalWaves(dependencies):
+        for service in wave:
+            buildMap = services[service]['build'] if isinstance(services[service]['build'], dict) else {'context': services[service]['build']}
+            context = os.path.join(composeFolder, buildMap.get('context', '.'))
+            dockerfile = os.path.join(context, buildMap.get('dockerfile', 'Dockerfile'))
+            contentHashes[service] = BuildHashTools.GetServiceContentHash(
+                context, dockerfile, buildMap.get('args'), platforms or buildMap.get('platforms'),
+                [contentHashes[dependency] for dependency in dependencies[service]])
+    return {service: contentHashes[service] for service in dependencies}
+
+
+def GetServiceBuildDependencies(dockerComposeMap, tags = None, composeFolder = ''):
+    """Returns a dict with the services each built service depends on,
+    either through `depends_on` or by building FROM the image (or one of the
+    `tags`) of another built service. Build contexts are relative to
+    `composeFolder`.
+    """
+    services = dockerComposeMap.get('services', {})
+    builtServices = [service for service in services if 'build' in services[service]]
+    serviceByImage = {}
+    for service in builtServices:
+        if not('image' in services[service]):
+            continue
+        sourceImage = services[service]['image']
+        for image in [sourceImage] + [DockerImageTools.GetTargetImage(sourceImage, tag) for tag in tags or []]:
+            repo, tag = DockerImageTools.SplitImageRepoAndTag(image)
+            serviceByImage[repo + ':' + tag] = service
+
+    dependencies = {}
+    for service in builtServices:
+        serviceDependencies = list(services[service].get('depends_on', []))
+        buildMap = services[service]['build']
+        if isinstance(buildMap, dict):
+            fullPathDockerfile = os.path.join(composeFolder, buildMap.get('context', '.'), buildMap.get('dockerfile', 'Dockerfile'))
+            if os.path.isfile(fullPathDockerfile):
+                for baseImage in DockerImageTools.GetDockerfileBaseImages(fullPathDockerfile, buildMap.get('args')):
+                    if baseImage in serviceByImage:
+                        serviceDependencies.append(serviceByImage[baseImage])
+        dependencies[service] = [dependency for dependency in dict.fromkeys(serviceDependencies)
+                                 if dependency in builtServices and dependency != service]
+    return dependencies
+
+
+def PrintCriticalPath(dependencies, durations):
+    path, seconds = ParallelTools.GetCriticalPath(dependencies, durations)
+    log.info("Critical build path ({0:.1f}s): {1}".format(
+        seconds, ' -> '.join(['{0} ({1:.1f}s)'.format(service, durations.get(service, 0.0)) for service in path])))
+
+
+def TagUnchangedImage(sourceImage, tags = None, push = False):
+    targetImages = [DockerImageTools.GetTargetImage(sourceImage, tag) for tag in tags or []]
+    for targetImage in targetImages:
+        DockerImageTools.TagImage(sourceImage, targetImage)
+    if push:
+        for image in [sourceImage] + targetImages:
+            DockerImageTools.PushImage(image)
+    return None
+
+
+def PromoteDockerImages(composeFile, targetTags, sourceFeed = None, targetFeed = None, user = None, password = None, logoutFromFeeds = False, dryRun = False, maxParallel = 1, pushRetries = 0, registrySideCopy = False, retryPolicy = None):
     userAndPasswordIsGiven = not(user is None or password is None)
+    if registrySideCopy:
+        if userAndPasswordIsGiven and not(sourceFeed is None):
+            DockerImageTools.DockerLogin(sourceFeed, user, password, dryRun)
+        if userAndPasswordIsGiven and not(targetFeed is None) and targetFeed != sourceFeed:
+            DockerImageTools.DockerLogin(targetFeed, user, password, dryRun)
+        CopyDockerImagesWithNewTags(composeFile, targetTags, sourceFeed, targetFeed, dryRun, maxParallel)
+        if userAndPasswordIsGiven and logoutFromFeeds and not(sourceFeed is None):
+            DockerImageTools.DockerLogout(sourceFeed, dryRun)
+        if userAndPasswordIsGiven and logoutFromFeeds and not(targetFeed is None) and targetFeed != sourceFeed:
+            DockerImageTools.DockerLogout(targetFeed, dryRun)
+        return
+
     if userAndPasswordIsGiven and not(sourceFeed is None):
         DockerImageTools.DockerLogin(sourceFeed, user, password, dryRun)
-    DockerComposePull([composeFile], dryRun)
+    DockerComposePull([composeFile], dryRun, retryPolicy)
     if userAndPasswordIsGiven and logoutFromFeeds and not(sourceFeed is None):
         DockerImageTools.DockerLogout(sourceFeed, dryRun)
 
     if userAndPasswordIsGiven and not(targetFeed is None):
         DockerImageTools.DockerLogin(targetFeed, user, password, dryRun)
-    for tag in targetTags:
-        PublishDockerImagesWithNewTag(composeFile, tag, sourceFeed, targetFeed, dryRun)
+    PublishDockerImagesWithNewTags(composeFile, targetTags, sourceFeed, targetFeed, dryRun, maxParallel, pushRetries, retryPolicy)
     if userAndPasswordIsGiven and logoutFromFeeds and not(targetFeed is None):
         DockerImageTools.DockerLogout(targetFeed, dryRun)
 
 
-def PublishDockerImagesWithNewTag(composeFile, newTag, sourceRepository = None, targetRepository = None, dryRun = False):
+def CopyDockerImagesWithNewTags(composeFile, newTags, sourceRepository = None, targetRepository = None, dryRun = False, maxParallel = 1):
+    """Copy the image of each service to all `newTags` on the registry side
+    with `docker buildx imagetools create`, so no layers are pulled or pushed
+    through the local daemon. The source images must already be pushed.
+    """
     dockerComposeMap = YamlTools.GetYamlData([composeFile])
+    targetImagesBySource = {}
     for service in dockerComposeMap['services']:
         sourceImage = dockerComposeMap['services'][service]['image']
-        tagIndex = sourceImage.rfind(':')
-        targetImage = sourceImage[:tagIndex+1] + str(newTag)
-        if not(sourceRepository is None or targetRepository is None):
-            targetImage = targetImage.replace(sourceRepository, targetRepository, 1)
-        if dryRun:
-            log.info("Would have tagged image {} as {}".format(sourceImage, targetImage))
+        targetImages = targetImagesBySource.setdefault(sourceImage, [])
+        for newTag in newTags:
+            targetImage = GetPublishTargetImage(sourceImage, newTag, sourceRepository, targetRepository)
+            if not(targetImage in targetImages):
+                targetImages.append(targetImage)
+
+    copyTasks = []
+    for sourceImage in targetImagesBySource:
+        copyTasks.append((sourceImage, functools.partial(
+            MultiArchTools.CopyImageOnRegistry, sourceImage, targetImagesBySource[sourceImage], dryRun)))
+    ParallelTools.ExecuteInParallel(copyTasks, maxParallel)
+
+
+def PublishDockerImagesWithNewTag(composeFile, newTag, sourceRepository = None, targetRepository = None, dryRun = False, maxParallel = 1, pushRetries = 0, retryPolicy = None):
+    return PublishDockerImagesWithNewTags(composeFile, [newTag], sourceRepository, targetRepository, dryRun, maxParallel, pushRetries, retryPolicy)
+
+
+def PublishDockerImagesWithNewTags(composeFile, newTags, sourceRepository = None, targetRepository = None, dryRun = False, maxParallel = 1, pushRetries = 0, retryPolicy = None):
+    """Tag the image of each service with every tag in `newTags`, and then
+    push all target images through a pool of `maxParallel` workers.
+
+    All images are tagged locally before the first push starts. Each push is
+    retried up to `pushRetries` times on its own, and a summary with the
+    push timings of each image is logged when done. Returns the timings as
+    a dict keyed by target image.
+
+    A `retryPolicy` replaces `pushRetries`, so only one of them may be
+    given. Note that a RetryPolicy only retries on transient errors unless
+    it has `retryOnErrorCode=True`, while `pushRetries` retries any failure.
+    """
+    if pushRetries > 0 and not(retryPolicy is None):
+        raise Exception("Give either pushRetries or retryPolicy, not both.")
+    dockerComposeMap = YamlTools.GetYamlData([composeFile])
+    targetImages = []
+    for newTag in newTags:
+        for service in dockerComposeMap['services']:
+            sourceImage = dockerComposeMap['services'][service]['image']
+            targetImage = GetPublishTargetImage(sourceImage, newTag, sourceRepository, targetRepository)
+            if targetImage in targetImages:
+                continue
+            if dryRun:
+                log.info("Would have tagged image {} as {}".format(sourceImage, targetImage))
+            else:
+                DockerImageTools.TagImage(sourceImage, targetImage)
+            targetImages.append(targetImage)
+
+    if dryRun:
+        for targetImage in targetImages:
             log.info("Would have pushed image {}".format(targetImage))
-        else:
-            DockerImageTools.TagImage(sourceImage, targetImage)
-            DockerImageTools.PushImage(targetImage)
+        return {}
+
+    if retryPolicy is None:
+        retryPolicy = TerminalTools.RetryPolicy(maxAttempts=pushRetries + 1, retryOnErrorCode=True)
+    pushTasks = []
+    for targetImage in targetImages:
+        pushTasks.append((targetImage, functools.partial(PushImageAndMeasure, targetImage, retryPolicy)))
+    timings = ParallelTools.ExecuteInParallel(pushTasks, maxParallel)
+    PrintPushTimings(timings)
+    return timings
+
+
+def GetPublishTargetImage(sourceImage, newTag, sourceRepository = None, targetRepository = None):
+    targetImage = DockerImageTools.GetTargetImage(sourceImage, newTag)
+    if not(sourceRepository is None or targetRepository is None):
+        targetImage = targetImage.replace(sourceRepository, targetRepository, 1)
+    return targetImage
+
+
+def PushImageAndMeasure(imageName, retryPolicy = None):
+    startTime = time.time()
+    with InstrumentationTools.RecordSpans(currentContextOnly=True) as spans:
+        DockerImageTools.PushImage(imageName, retryPolicy)
+    attempts = sum([span['retries'] + 1 for span in spans])
+    return {'seconds': time.time() - startTime, 'attempts': attempts}
+
+
+def PrintPushTimings(timings):
+    log.info("Pushed {0} images:".format(len(timings)))
+    for imageName in sorted(timings, key=lambda image: timings[image]['seconds'], reverse=True):
+        timing = timings[imageName]
+        log.info("  {0:8.1f}s  {1} attempt(s)  {2}".format(timing['seconds'], timing['attempts'], imageName))
 
 
 def ExecuteComposeTests(composeFiles, testContainerNames = None, removeTestContainers = True, buildCompose = True, downCompose = True):
@@ -162,39 +538,165 @@ def ExecuteComposeTests(composeFiles, testContainerNames = None, removeTestConta
         raise Exception(sumErrorMsgs)
 
 
+def ExecuteComposeTestSuites(testSuites, maxParallel = 1, removeTestContainers = True, buildCompose = True, downCompose = True, junitFile = None, assertSuites = True):
+    """Run independent compose test suites with up to `maxParallel` suites at
+    the same time. `testSuites` is a dict with the compose files of each
+    suite. Every suite runs as its own compose project with unique container,
+    network and volume names (see PrepareComposeTestSuite), so suites do not
+    collide. Fixed host ports are not changed, and must differ between suites
+    running at the same time.
+
+    Prints a combined report, writes it as JUnit XML to `junitFile` if
+    given, and returns the result of ExecuteComposeTestSuite for each suite.
+    Raises an exception listing the failed suites if `assertSuites` is True.
+    """
+    outputFolder = tempfile.mkdtemp(prefix='compose-test-suites-')
+    try:
+        suiteTasks = []
+        for suiteName, composeFiles in testSuites.items():
+            suiteTasks.append((suiteName, functools.partial(
+                ExecuteComposeTestSuite, suiteName, composeFiles, outputFolder, removeTestContainers, buildCompose, downCompose)))
+        results = ParallelTools.ExecuteInParallel(suiteTasks, maxParallel)
+    finally:
+        shutil.rmtree(outputFolder, ignore_errors=True)
+
+    JUnitTools.PrintTestReport(results)
+    if not(junitFile is None):
+        JUnitTools.WriteJUnitReport(results, junitFile)
+    failedSuites = [suiteName for suiteName, result in results.items() if not result['passed']]
+    if assertSuites and len(failedSuites) > 0:
+        raise Exception("Failed test suites: " + ", ".join(failedSuites))
+    return results
+
+
+def ExecuteComposeTestSuite(suiteName, composeFiles, outputFolder, removeTestContainers = True, buildCompose = True, downCompose = True):
+    """Run one suite of ExecuteComposeTestSuites, with the merged compose
+    file written to `outputFolder`. Failures are recorded in the result
+    instead of raised, so one failing suite does not stop the others.
+
+    Returns a dict with the compose `projectName`, the total `seconds` and
+    the `timings` of each phase, the exit code of each test container in
+    `containers`, whether the suite `passed`, and the `error` message if
+    the suite failed to run.
+    """
+    projectName = GetComposeProjectName(suiteName)
+    result = {'projectName': projectName, 'seconds': 0.0, 'timings': {}, 'containers': {}, 'passed': False, 'error': None}
+    startTime = time.monotonic()
+    suiteComposeFiles = []
+    try:
+        yamlData = GetMergedComposeData(composeFiles)
+        testContainerNames = PrepareComposeTestSuite(yamlData, projectName)
+        suiteComposeFile = os.path.join(outputFolder, 'docker-compose.' + projectName + '.yml')
+        YamlTools.DumpYamlDataToFile(EscapeComposeValues(yamlData), suiteComposeFile)
+        suiteComposeFiles = [suiteComposeFile]
+
+        if buildCompose:
+            ExecuteAndMeasure(result['timings'], 'build', functools.partial(DockerComposeBuild, suiteComposeFiles, projectName=projectName))
+        ExecuteAndMeasure(result['timings'], 'up', functools.partial(DockerComposeUp, suiteComposeFiles, projectName=projectName))
+        containersInfo = DockerImageTools.GetContainersInfo(testContainerNames)
+        for containerName in testContainerNames:
+            result['containers'][containerName] = int(containersInfo[containerName]['State']['ExitCode'])
+        result['passed'] = all(exitCode == 0 for exitCode in result['containers'].values())
+    except Exception as e:
+        result['error'] = str(e)
+        log.info("Test suite {0} failed: {1}".format(suiteName, e))
+
+    try:
+        if downCompose and len(suiteComposeFiles) > 0:
+            ExecuteAndMeasure(result['timings'], 'down', functools.partial(DockerComposeDown, suiteComposeFiles, projectName=projectName))
+        if removeTestContainers and len(suiteComposeFiles) > 0:
+            DockerComposeRemove(suiteComposeFiles, projectName=projectName)
+    except Exception as e:
+        log.info("Failed to clean up test suite {0}: {1}".format(suiteName, e))
+    result['seconds'] = time.monotonic() - startTime
+    return result
+
+
+def ExecuteAndMeasure(timings, phase, task):
+    startTime = time.monotonic()
+    try:
+        return task()
+    finally:
+        timings[phase] = time.monotonic() - startTime
+
+
+def GetComposeProjectName(suiteName):
+    """Returns a unique compose project name for a test suite, made of the
+    lowercase suite name and a random id.
+    """
+    projectName = re.sub('[^a-z0-9_-]+', '-', suiteName.lower()).strip('-_')
+    return '{0}_{1}'.format(projectName or 'suite', uuid.uuid4().hex[:8])
+
+
+def PrepareComposeTestSuite(yamlData, projectName):
+    """Isolate merged compose data of a test suite from other suites: the
+    project name is added as subfix to every container name with
+    AddContainerNames, and to the explicit names of networks and volumes
+    which are not external. Networks and volumes without an explicit name
+    are isolated by the compose project name already.
+
+    Returns the new names of the containers which had a container name
+    before, which are the test containers like in ExecuteComposeTests.
+    """
+    testContainerNames = [containerName + '_' + projectName for containerName in GetContainerNames(yamlData)]
+    AddContainerNames(yamlData, subfix='_' + projectName, renameExisting=True)
+    for key in ['networks', 'volumes']:
+        for objectMap in (yamlData.get(key) or {}).values():
+            if isinstance(objectMap, dict) and 'name' in objectMap and not objectMap.get('external', False):
+                objectMap['name'] = objectMap['name'] + '_' + projectName
+    return testContainerNames
+
+
 def CreateLocalNetwork(networkName):
     log.info("Creating local network: " + networkName)
+    if EngineApiTools.IsEngineApiAvailable():
+        try:
+            EngineApiTools.CreateNetwork(networkName, driver='bridge', attachable=True)
+        except Exception as e:
+            log.info(str(e))
+        return
     dockerCommand = "docker network create --attachable --driver=bridge "
     dockerCommand += networkName
     TerminalTools.ExecuteTerminalCommands([dockerCommand])
 
 
-def MergeComposeFileToTerminalCommand(composeFiles):
+def MergeComposeFileToTerminalCommand(composeFiles, projectName = None):
     terminalCommand = ""
+    if not(projectName is None):
+        terminalCommand += " -p " + projectName
     for composeFile in composeFiles:
         terminalCommand += " -f " + composeFile
     return terminalCommand
 
 
 def AddDigestsToImageTags(yamlData):
+    imageNames = {}
     for service in yamlData.get('services', []):
         if not('image' in yamlData['services'][service]):
             continue
-
         imageName = yamlData['services'][service]['image']
-        imageName = YamlTools.ReplaceEnvironmentVariablesMatches(imageName)
-        repoDigests = DockerImageTools.GetImageInfo(imageName)['RepoDigests']
+        imageNames[service] = YamlTools.InterpolateString(imageName)
+
+    imagesInfo = DockerImageTools.GetImagesInfo(imageNames.values())
+    for service in imageNames:
+        imageName = imageNames[service]
+        repoDigests = imagesInfo[imageName]['RepoDigests']
         if len(repoDigests) > 0:
             yamlData['services'][service]['image'] = str(repoDigests[0])
         else:
             yamlData['services'][service]['image'] = imageName
 
 
-def AddContainerNames(yamlData, prefix = None, subfix = None):
+def AddContainerNames(yamlData, prefix = None, subfix = None, renameExisting = False):
+    """Give every service without a container name one made of the service
+    name, `prefix` and `subfix` (or a random number if `subfix` is None).
+    With `renameExisting`, existing container names get the prefix and
+    subfix as well.
+    """
     services = yamlData.get('services', [])
     for service in services:
-        if not ('container_name' in yamlData['services'][service]):
-            containerName = service
+        if renameExisting or not ('container_name' in yamlData['services'][service]):
+            containerName = yamlData['services'][service].get('container_name', service)
             if not(prefix is None):
                 containerName = prefix + containerName
             if not(subfix is None):
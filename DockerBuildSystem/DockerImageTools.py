@@ -1,10 +1,21 @@
-from DockerBuildSystem import TerminalTools
+from DockerBuildSystem import TerminalTools, EngineApiTools, BuildxTools, InstrumentationTools
 import re
+import copy
+import tempfile
 import json
+import time
 import logging
+import threading
+import collections
 
 log = logging.getLogger(__name__)
 
+DOCKERFILE_VARIABLE_PATTERN = re.compile(r'\$\{([A-Za-z_][A-Za-z0-9_]*)[^}]*\}|\$([A-Za-z_][A-Za-z0-9_]*)')
+_inspectCacheLock = threading.Lock()
+_inspectCache = None
+_inspectCacheSettings = {'ttlInSeconds': None, 'maxEntries': 256}
+_inspectCacheStatistics = {'hits': 0, 'misses': 0}
+
 
 def SplitImageRepoAndTag(image):
     lastColon = image.rfind(':')
@@ -20,8 +31,55 @@ def GetTargetImage(sourceImage, newTag):
     return targetImage
 
 
+def GetDockerfileBaseImages(dockerfile, args = None):
+    """Returns the images a Dockerfile builds FROM, as `repo:tag` strings
+    without any digest, leaving out references to its own build stages.
+    `${VAR}` and `$VAR` are replaced with the build `args` (a list of
+    `KEY=value` strings or a dict) or the defaults of the ARG instructions.
+    """
+    if isinstance(args, dict):
+        args = ['{0}={1}'.format(key, value) for key, value in args.items() if not(value is None)]
+    buildArgs = dict([arg.split('=', 1) for arg in args or [] if '=' in arg])
+    argDefaults = {}
+    stageNames = set()
+    baseImages = []
+    with open(dockerfile, 'r') as f:
+        lines = f.read().replace('\\\n', ' ').splitlines()
+    for line in lines:
+        words = line.split()
+        if len(words) < 2 or words[0].startswith('#'):
+            continue
+        instruction = words[0].upper()
+        if instruction == 'ARG':
+            key, _, value = words[1].partition('=')
+            argDefaults[key] = value.strip('"\'')
+        elif instruction == 'FROM':
+            words = [word for word in words[1:] if not word.startswith('--')]
+            if len(words) == 0:
+                continue
+            variables = dict(argDefaults, **buildArgs)
+            image = DOCKERFILE_VARIABLE_PATTERN.sub(lambda match: variables.get(match.group(1) or match.group(2), ''), words[0])
+            if len(words) >= 3 and words[1].upper() == 'AS':
+                stageNames.add(words[2].lower())
+            if image.lower() in stageNames or image == 'scratch':
+                continue
+            repo, tag = SplitImageRepoAndTag(image.split('@')[0])
+            baseImages.append(repo + ':' + tag)
+    return list(dict.fromkeys(baseImages))
+
+
 def BuildImage(imageName, dockerfile = 'Dockerfile', context = '.',
-               args = None, tags = None, platforms = None, push = False):
+               args = None, tags = None, platforms = None, push = False, outputPrefix = '',
+               builderName = BuildxTools.DEFAULT_BUILDER_NAME, cacheFrom = None, cacheTo = None, labels = None, load = None):
+    """Build an image, with `docker buildx build` if `platforms` or any
+    cache import/export (`cacheFrom`/`cacheTo`, see BuildxTools.GetCacheCommand)
+    is given. Returns the BuildKit cache statistics of buildx builds.
+
+    Buildx builds with a docker-container builder leave the image in the
+    build cache only, so `--load` is added to load it into the local images
+    like a plain `docker build` does, unless the build is pushed, has more
+    than one platform, or `load` is False.
+    """
     if args is None:
         args = []
     if tags is None:
@@ -31,6 +89,8 @@ def BuildImage(imageName, dockerfile = 'Dockerfile', context = '.',
     argsCommand = ''
     for arg in args:
         argsCommand += ' --build-arg ' + arg
+    for labelKey, labelValue in (labels or {}).items():
+        argsCommand += ' --label ' + labelKey + '=' + labelValue
     tagsCommand = ' -t ' + imageName
     for tag in tags:
         tagsCommand += ' -t ' + GetTargetImage(imageName, tag)
@@ -39,13 +99,27 @@ def BuildImage(imageName, dockerfile = 'Dockerfile', context = '.',
     pushCommand = ''
     if push:
         pushCommand = ' --push'
-    if len(platforms) > 0:
-        createBuildDriverCommand = 'docker buildx create --use'
-        TerminalTools.ExecuteTerminalCommands([createBuildDriverCommand], True)
-        platformsCommand = '--platform ' + ','.join(platforms) + ' '
+    useBuildx = len(platforms) > 0 or bool(cacheFrom) or bool(cacheTo)
+    if useBuildx:
+        BuildxTools.EnsureBuilder(builderName)
+        platformsCommand = '--builder ' + builderName + ' --progress=plain '
+        if len(platforms) > 0:
+            platformsCommand += '--platform ' + ','.join(platforms) + ' '
         buildxCommand = 'buildx '
+        if not push and len(platforms) <= 1 and not(load is False):
+            pushCommand = ' --load'
+        pushCommand += BuildxTools.GetCacheCommand(cacheFrom, cacheTo)
     dockerCommand = "docker " + buildxCommand + "build " + platformsCommand + "-f " + dockerfile + argsCommand + tagsCommand + pushCommand + " " + context
-    TerminalTools.ExecuteTerminalCommands([dockerCommand], True)
+    outputLines = []
+    with InstrumentationTools.Operation('build', imageName):
+        TerminalTools.ExecuteTerminalCommands([dockerCommand], True, outputPrefix=outputPrefix,
+                                              outputLineCallback=outputLines.append if useBuildx else None)
+    InvalidateInspectCache([imageName] + [GetTargetImage(imageName, tag) for tag in tags])
+    if not useBuildx:
+        return None
+    cacheStatistics = BuildxTools.ParseBuildCacheStatistics(outputLines)
+    BuildxTools.LogBuildCacheStatistics(cacheStatistics, outputPrefix)
+    return cacheStatistics
 
 
 def RunImage(imageName, properties = ""):
@@ -53,19 +127,47 @@ def RunImage(imageName, properties = ""):
     TerminalTools.ExecuteTerminalCommands([dockerCommand], True)
 
 
-def PullImage(imageName):
-    dockerCommand = "docker pull " + imageName
-    TerminalTools.ExecuteTerminalCommands([dockerCommand], True)
+def PullImage(imageName, retryPolicy = None):
+    dockerCommand = GetPullImageCommand(imageName)
+    with InstrumentationTools.Operation('pull', imageName):
+        TerminalTools.ExecuteTerminalCommands([dockerCommand], True, retryPolicy=retryPolicy)
+    InvalidateInspectCache([imageName])
 
 
-def PushImage(imageName):
-    dockerCommand = "docker push " + imageName
-    TerminalTools.ExecuteTerminalCommands([dockerCommand], True)
+def PushImage(imageName, retryPolicy = None):
+    dockerCommand = GetPushImageCommand(imageName)
+    with InstrumentationTools.Operation('push', imageName):
+        TerminalTools.ExecuteTerminalCommands([dockerCommand], True, retryPolicy=retryPolicy)
+    InvalidateInspectCache([imageName])
+
+
+def GetPullImageCommand(imageName):
+    return "docker pull " + imageName
+
+
+def GetPushImageCommand(imageName):
+    return "docker push " + imageName
+
+
+async def PullImageAsync(imageName, timeoutInSeconds = None):
+    dockerCommand = GetPullImageCommand(imageName)
+    await TerminalTools.ExecuteTerminalCommandsAsync([dockerCommand], True, timeoutInSeconds=timeoutInSeconds)
+    InvalidateInspectCache([imageName])
+
+
+async def PushImageAsync(imageName, timeoutInSeconds = None):
+    dockerCommand = GetPushImageCommand(imageName)
+    await TerminalTools.ExecuteTerminalCommandsAsync([dockerCommand], True, timeoutInSeconds=timeoutInSeconds)
+    InvalidateInspectCache([imageName])
 
 
 def TagImage(sourceImage, targetImage):
-    dockerCommand = "docker tag " + sourceImage + " " + targetImage
-    TerminalTools.ExecuteTerminalCommands([dockerCommand], True)
+    if EngineApiTools.IsEngineApiAvailable():
+        EngineApiTools.TagImage(sourceImage, targetImage)
+    else:
+        dockerCommand = "docker tag " + sourceImage + " " + targetImage
+        TerminalTools.ExecuteTerminalCommands([dockerCommand], True)
+    InvalidateInspectCache([sourceImage, targetImage])
 
 
 def SaveImage(imageName, outputPath):
@@ -95,57 +197,207 @@ def CopyFromContainerToHost(containerName, containerSrc, hostDest):
 
 
 def GetImageRepoDigest(imageName):
-    terminalCommand = "docker inspect --format=\"{{index .RepoDigests 0}}\" " + imageName
-    repoDigest = str(TerminalTools.ExecuteTerminalCommandAndGetOutput(terminalCommand).decode("utf-8")).replace('\n', '')
-    return repoDigest
+    repoDigests = GetImageInfo(imageName)['RepoDigests']
+    if len(repoDigests) == 0:
+        raise Exception("Image '{0}' has no repo digests.".format(imageName))
+    return repoDigests[0]
 
 
 def GetImageLabels(imageName):
-    jsonInfo = GetImageInfo(imageName)
-    labels = jsonInfo['Config']['Labels']
-    return labels
+    return GetImagesLabels([imageName])[imageName]
+
+
+def GetImagesLabels(imageNames):
+    labelsByImage = {}
+    imagesInfo = GetImagesInfo(imageNames)
+    for imageName in imagesInfo:
+        labelsByImage[imageName] = imagesInfo[imageName]['Config'].get('Labels') or {}
+    return labelsByImage
 
 
 def GetImageLabel(imageName, labelKey):
-    labels = GetImageLabels(imageName)
-    if labelKey in labels:
-        return labels[labelKey]
-    return '<no value>'
+    return GetImagesLabel([imageName], labelKey)[imageName]
+
+
+def GetImagesLabel(imageNames, labelKey):
+    labelValues = {}
+    labelsByImage = GetImagesLabels(imageNames)
+    for imageName in labelsByImage:
+        labelValues[imageName] = labelsByImage[imageName].get(labelKey, '<no value>')
+    return labelValues
 
 
 def CheckImageLabelExists(imageName, labelKey):
-    labelValue = GetImageLabel(imageName, labelKey)
-    return not(labelValue == '<no value>')
+    return CheckImagesLabelExists([imageName], labelKey)[imageName]
+
+
+def CheckImagesLabelExists(imageNames, labelKey):
+    labelValues = GetImagesLabel(imageNames, labelKey)
+    return {imageName: not(labelValues[imageName] == '<no value>') for imageName in labelValues}
 
 
 def GetImageId(imageName):
-    terminalCommand = "docker inspect --format=\"{{.Id}}\" " + imageName
-    imageId = str(TerminalTools.ExecuteTerminalCommandAndGetOutput(terminalCommand).decode("utf-8")).replace('\n', '')
-    return imageId
+    return GetImageInfo(imageName)['Id']
 
 
 def GetImageInfo(imageName):
-    terminalCommand = "docker inspect " + imageName
-    info = str(TerminalTools.ExecuteTerminalCommandAndGetOutput(terminalCommand).decode("utf-8"))
-    jsonInfo = json.loads(info)[0]
-    return jsonInfo
+    return GetImagesInfo([imageName])[imageName]
+
+
+def GetImagesInfo(imageNames):
+    imageNames = list(dict.fromkeys(imageNames))
+    if _inspectCache is None:
+        return InspectObjects(imageNames, 'image')
+
+    imagesInfo = {}
+    missingImageNames = []
+    with _inspectCacheLock:
+        for imageName in imageNames:
+            info = None if _inspectCache is None else _GetCachedImageInfo(imageName)
+            if info is None:
+                missingImageNames.append(imageName)
+            else:
+                imagesInfo[imageName] = info
+    missingImagesInfo = InspectObjects(missingImageNames, 'image')
+    with _inspectCacheLock:
+        for imageName in missingImagesInfo:
+            if _inspectCache is None:
+                break
+            _SetCachedImageInfo(imageName, missingImagesInfo[imageName])
+    imagesInfo.update(missingImagesInfo)
+    return {imageName: imagesInfo[imageName] for imageName in imageNames}
+
+
+def EnableInspectCache(ttlInSeconds = None, maxEntries = 256):
+    """Cache the inspect info of images within this process, keyed by image
+    reference. Entries expire after `ttlInSeconds` (never if None), the least
+    recently used entries are evicted above `maxEntries`, and entries are
+    invalidated when BuildImage, TagImage, PullImage or PushImage touch the
+    image.
+    """
+    global _inspectCache
+    with _inspectCacheLock:
+        _inspectCacheSettings['ttlInSeconds'] = ttlInSeconds
+        _inspectCacheSettings['maxEntries'] = maxEntries
+        if _inspectCache is None:
+            _inspectCache = collections.OrderedDict()
+
+
+def DisableInspectCache():
+    global _inspectCache
+    with _inspectCacheLock:
+        _inspectCache = None
+
+
+def InvalidateInspectCache(imageNames = None):
+    with _inspectCacheLock:
+        if _inspectCache is None:
+            return
+        if imageNames is None:
+            _inspectCache.clear()
+            return
+        for imageName in imageNames:
+            _inspectCache.pop(GetImageCacheKey(imageName), None)
+
+
+def GetInspectCacheStatistics():
+    with _inspectCacheLock:
+        statistics = dict(_inspectCacheStatistics)
+        statistics['entries'] = 0 if _inspectCache is None else len(_inspectCache)
+    return statistics
+
+
+def ResetInspectCacheStatistics():
+    with _inspectCacheLock:
+        _inspectCacheStatistics['hits'] = 0
+        _inspectCacheStatistics['misses'] = 0
+
+
+def GetImageCacheKey(imageName):
+    if '@' in imageName:
+        return imageName
+    repo, tag = SplitImageRepoAndTag(imageName)
+    return repo + ':' + tag
+
+
+def _GetCachedImageInfo(imageName):
+    cacheKey = GetImageCacheKey(imageName)
+    entry = _inspectCache.get(cacheKey)
+    ttlInSeconds = _inspectCacheSettings['ttlInSeconds']
+    if not(entry is None) and not(ttlInSeconds is None) and time.time() - entry[0] > ttlInSeconds:
+        del _inspectCache[cacheKey]
+        entry = None
+    if entry is None:
+        _inspectCacheStatistics['misses'] += 1
+        return None
+    _inspectCache.move_to_end(cacheKey)
+    _inspectCacheStatistics['hits'] += 1
+    return copy.deepcopy(entry[1])
+
+
+def _SetCachedImageInfo(imageName, info):
+    cacheKey = GetImageCacheKey(imageName)
+    _inspectCache[cacheKey] = (time.time(), copy.deepcopy(info))
+    _inspectCache.move_to_end(cacheKey)
+    while len(_inspectCache) > _inspectCacheSettings['maxEntries']:
+        _inspectCache.popitem(last=False)
 
 
 def GetContainerInfo(containerName):
-    return GetImageInfo(containerName)
-
-
-def GetLogsFromContainer(containerName):
+    return GetContainersInfo([containerName])[containerName]
+
+
+def GetContainersInfo(containerNames):
+    return InspectObjects(containerNames)
+
+
+def InspectObjects(names, objectType = None):
+    """Inspect many images or containers with a single `docker inspect`
+    call, and return the inspect info of each of them in a dict keyed by
+    the given names. `objectType` may restrict the lookup to 'image' or
+    'container'. Raises an exception if any of the objects does not exist.
+    """
+    uniqueNames = list(dict.fromkeys(names))
+    if len(uniqueNames) == 0:
+        return {}
+    if EngineApiTools.IsEngineApiAvailable():
+        return {name: EngineApiTools.Inspect(name, objectType) for name in uniqueNames}
+    terminalCommand = "docker inspect"
+    if not(objectType is None):
+        terminalCommand += " --type=" + objectType
+    terminalCommand += " " + " ".join(uniqueNames)
+    info = str(TerminalTools.ExecuteTerminalCommandAndGetOutput(terminalCommand).decode("utf-8"))
+    jsonInfos = json.loads(info)
+    if len(jsonInfos) != len(uniqueNames):
+        raise Exception("Expected inspect info of {0} objects, but got {1}.".format(len(uniqueNames), len(jsonInfos)))
+    return dict(zip(uniqueNames, jsonInfos))
+
+
+def GetLogsFromContainer(containerName, asFile = False):
+    """Returns the logs of a container as a string, or as a binary file
+    handle if `asFile` is True. The file spills to disk for large logs, so
+    the logs are never held in memory twice.
+    """
+    if EngineApiTools.IsEngineApiAvailable():
+        if asFile:
+            logsFile = tempfile.SpooledTemporaryFile(max_size=TerminalTools.OUTPUT_SPILL_SIZE)
+            EngineApiTools.WriteContainerLogs(containerName, logsFile)
+            logsFile.seek(0)
+            return logsFile
+        return EngineApiTools.GetContainerLogs(containerName).decode("utf-8")
     terminalCommand = 'docker logs {0}'.format(containerName)
-    logs = str(TerminalTools.ExecuteTerminalCommandAndGetOutput(terminalCommand, includeErrorOutput=True).decode("utf-8"))
-    return logs
+    if asFile:
+        return TerminalTools.ExecuteTerminalCommandAndGetOutput(terminalCommand, includeErrorOutput=True, outputType='file')
+    logs = TerminalTools.ExecuteTerminalCommandAndGetOutput(terminalCommand, includeErrorOutput=True, outputType='memoryview')
+    return str(logs, "utf-8")
 
 
 def VerifyContainerExitCode(containerNames, assertExitCodes = False):
     sumExitCodes = 0
     sumErrorMsgs = ""
+    containersInfo = GetContainersInfo(containerNames)
     for containerName in containerNames:
-        exitCode = GetContainerExitCode(containerName)
+        exitCode = int(containersInfo[containerName]['State']['ExitCode'])
         sumExitCodes += exitCode
         if exitCode > 0:
             errorMsg = "Container '" + containerName + "' FAILED!\r\n"
@@ -1,9 +1,11 @@
 import subprocess
+import threading
+import queue
 import json
 import time
 import logging
 
-from DockerBuildSystem import TerminalTools
+from DockerBuildSystem import TerminalTools, EngineApiTools
 
 log = logging.getLogger(__name__)
 
@@ -28,6 +30,9 @@ def RemoveStack(stackName):
 
 def CreateSwarmNetwork(networkName, encrypted = False, driver = 'overlay', attachable = True, options = []):
     log.info("Creating network: " + networkName)
+    if len(options) == 0 and EngineApiTools.IsEngineApiAvailable():
+        ExecuteEngineApiOperation(EngineApiTools.CreateNetwork, networkName, driver, attachable, encrypted)
+        return
     dockerCommand = "docker network create "
     dockerCommand += "--driver {0} ".format(driver)
     if attachable:
@@ -42,18 +47,29 @@ def CreateSwarmNetwork(networkName, encrypted = False, driver = 'overlay', attac
 
 def RemoveSwarmNetwork(networkName):
     log.info("Removing network: " + networkName)
+    if EngineApiTools.IsEngineApiAvailable():
+        ExecuteEngineApiOperation(EngineApiTools.RemoveNetwork, networkName)
+        return
     dockerCommand = "docker network rm " + networkName
     TerminalTools.ExecuteTerminalCommands([dockerCommand])
 
 
 def CreateSwarmSecret(secretFile, secretName):
     log.info("Creating secret: " + secretName)
+    if EngineApiTools.IsEngineApiAvailable():
+        with open(secretFile, 'rb') as f:
+            secretData = f.read()
+        ExecuteEngineApiOperation(EngineApiTools.CreateSecret, secretName, secretData)
+        return
     dockerCommand = "docker secret create " + secretName + " " + secretFile
     TerminalTools.ExecuteTerminalCommands([dockerCommand])
 
 
 def RemoveSwarmSecret(secretName):
     log.info("Removing secret: " + secretName)
+    if EngineApiTools.IsEngineApiAvailable():
+        ExecuteEngineApiOperation(EngineApiTools.RemoveSecret, secretName)
+        return
     dockerCommand = "docker secret rm " + secretName
     TerminalTools.ExecuteTerminalCommands([dockerCommand])
 
@@ -72,6 +88,13 @@ def RemoveSwarmConfig(configName):
 
 def CreateSwarmVolume(volumeName, driver = 'local', driverOptions = []):
     log.info("Creating volume: {0}, with driver: {1} and driver options: {2}".format(volumeName, driver, driverOptions))
+    if EngineApiTools.IsEngineApiAvailable():
+        driverOptionsMap = {}
+        for driverOption in driverOptions:
+            key, _, value = driverOption.partition('=')
+            driverOptionsMap[key] = value
+        ExecuteEngineApiOperation(EngineApiTools.CreateVolume, volumeName, driver, driverOptionsMap)
+        return
     dockerCommand = "docker volume create --driver {0}".format(driver)
     for driverOption in driverOptions:
         dockerCommand += " --opt {0}".format(driverOption)
@@ -81,18 +104,15 @@ def CreateSwarmVolume(volumeName, driver = 'local', driverOptions = []):
 
 def RemoveSwarmVolume(volumeName):
     log.info("Removing volume: " + volumeName)
+    if EngineApiTools.IsEngineApiAvailable():
+        ExecuteEngineApiOperation(EngineApiTools.RemoveVolume, volumeName)
+        return
     dockerCommand = "docker volume rm " + volumeName
     TerminalTools.ExecuteTerminalCommands([dockerCommand])
 
 
 def CheckIfSwarmServiceIsRunning(serviceNames = None):
-    terminalCommand = "docker service ls --format=json"
-    servicesRaw = str(TerminalTools.ExecuteTerminalCommandAndGetOutput(terminalCommand).decode("utf-8"))
-    servicesRaw = servicesRaw.splitlines()
-    for serviceRaw in servicesRaw:
-        if serviceRaw.strip() == "":
-            continue
-        service = json.loads(serviceRaw)
+    for service in GetSwarmServices():
         if serviceNames == None or service['Name'] in serviceNames:
             replicas = service['Replicas'].split('/')
             currentReplicas = int(replicas[0])
@@ -103,13 +123,35 @@ def CheckIfSwarmServiceIsRunning(serviceNames = None):
     return True
 
 
+def GetSwarmServices():
+    if EngineApiTools.IsEngineApiAvailable():
+        return EngineApiTools.ListServices()
+    terminalCommand = "docker service ls --format=json"
+    servicesRaw = str(TerminalTools.ExecuteTerminalCommandAndGetOutput(terminalCommand).decode("utf-8"))
+    services = []
+    for serviceRaw in servicesRaw.splitlines():
+        if serviceRaw.strip() == "":
+            continue
+        services.append(json.loads(serviceRaw))
+    return services
+
+
+def ExecuteEngineApiOperation(operation, *args):
+    try:
+        operation(*args)
+    except Exception as e:
+        log.info(str(e))
+
+
 def SwarmIsInitiated():
     terminalCommand = "docker node inspect self --pretty"
     returnCode = subprocess.Popen(terminalCommand, shell=True).wait()
     return returnCode == 0
 
 
-def WaitUntilSwarmServicesAreRunning(timeoutInSeconds = 60, intervalInSeconds = 1, serviceNames = None):
+def WaitUntilSwarmServicesAreRunning(timeoutInSeconds = 60, intervalInSeconds = 1, serviceNames = None, useEvents = False, maxIntervalInSeconds = 10):
+    if useEvents:
+        return WaitUntilSwarmServicesAreRunningWithEvents(timeoutInSeconds, intervalInSeconds, serviceNames, maxIntervalInSeconds)
     timeOut = time.time() + timeoutInSeconds
     while time.time() < timeOut:
         log.info("Waiting for services to start. Seconds left: " + str(int(timeOut - time.time())))
@@ -120,6 +162,110 @@ def WaitUntilSwarmServicesAreRunning(timeoutInSeconds = 60, intervalInSeconds =
     raise Exception("Services did not start in time.")
 
 
+def WaitUntilSwarmServicesAreRunningWithEvents(timeoutInSeconds = 60, intervalInSeconds = 1, serviceNames = None, maxIntervalInSeconds = 10):
+    """Wait until all services have reached their replica targets, and
+    return the number of seconds each service took to converge.
+
+    The service states are checked again whenever `docker events` reports a
+    service or container event. Without events, or if the events stream is
+    not available, the states are polled with an exponential backoff from
+    `intervalInSeconds` up to `maxIntervalInSeconds`.
+    """
+    if isinstance(serviceNames, str):
+        serviceNames = [serviceNames]
+    startTime = time.time()
+    timeOut = startTime + timeoutInSeconds
+    convergenceTimes = {}
+    events = queue.Queue()
+    eventsProcess = StartSwarmEventsListener(events)
+    interval = intervalInSeconds
+    try:
+        while True:
+            pendingServices = GetPendingSwarmServices(serviceNames, convergenceTimes, startTime)
+            if len(pendingServices) == 0:
+                log.info("Services started.")
+                for serviceName in sorted(convergenceTimes, key=convergenceTimes.get):
+                    log.info("  {0:8.1f}s  {1}".format(convergenceTimes[serviceName], serviceName))
+                return convergenceTimes
+            secondsLeft = timeOut - time.time()
+            if secondsLeft <= 0:
+                raise Exception("Services did not start in time: " + ', '.join(pendingServices))
+            log.info("Waiting for services to start: {0}. Seconds left: {1}".format(', '.join(pendingServices), int(secondsLeft)))
+            if WaitForSwarmEvent(events, min(interval, secondsLeft)):
+                interval = intervalInSeconds
+            else:
+                interval = min(interval * 2, maxIntervalInSeconds)
+    finally:
+        if not(eventsProcess is None):
+            eventsProcess.terminate()
+            eventsProcess.wait()
+
+
+def GetSwarmServicesReplicas(serviceNames = None):
+    replicasByService = {}
+    for service in GetSwarmServices():
+        if serviceNames == None or service['Name'] in serviceNames:
+            replicas = TerminalTools.GetNumbersFromString(service['Replicas'])
+            replicasByService[service['Name']] = (replicas[0], replicas[1])
+    return replicasByService
+
+
+def GetPendingSwarmServices(serviceNames, convergenceTimes, startTime):
+    replicasByService = GetSwarmServicesReplicas(serviceNames)
+    pendingServices = []
+    for serviceName in (serviceNames if not(serviceNames is None) else replicasByService):
+        if serviceName in convergenceTimes:
+            continue
+        currentReplicas, totalReplicas = replicasByService.get(serviceName, (0, 1))
+        if currentReplicas < totalReplicas:
+            pendingServices.append(serviceName)
+        else:
+            convergenceTimes[serviceName] = time.time() - startTime
+    return pendingServices
+
+
+def StartSwarmEventsListener(events):
+    terminalCommand = ['docker', 'events', '--filter', 'type=service', '--filter', 'type=container', '--format', '{{json .}}']
+    try:
+        eventsProcess = subprocess.Popen(terminalCommand, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError as e:
+        log.info("Could not listen to docker events, polling service states instead: " + str(e))
+        return None
+
+    def ReadEvents():
+        for line in eventsProcess.stdout:
+            events.put(line)
+        log.info("Docker events stream ended, polling service states instead.")
+        events.put(None)
+
+    threading.Thread(target=ReadEvents, daemon=True).start()
+    return eventsProcess
+
+
+def WaitForSwarmEvent(events, timeoutInSeconds):
+    """Returns True if a docker event arrived within `timeoutInSeconds`.
+    Events already queued are drained, so a burst of events only triggers
+    one check of the service states. Once the events stream has ended, this
+    just sleeps for `timeoutInSeconds`.
+    """
+    try:
+        event = events.get(timeout=timeoutInSeconds)
+    except queue.Empty:
+        return False
+    if event is None:
+        events.put(None)
+        time.sleep(timeoutInSeconds)
+        return False
+    while True:
+        try:
+            event = events.get_nowait()
+        except queue.Empty:
+            return True
+        if event is None:
+            events.put(None)
+            return True
+
+
 def StartSwarm():
     if SwarmIsInitiated():
         log.info("Swarm is already initiated.")
@@ -0,0 +1,304 @@
+import http.client
+import socket
+import threading
+import base64
+import struct
+import json
+import logging
+import urllib.parse
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = '/var/run/docker.sock'
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+_engineApiSettings = {'socketPath': None, 'apiVersion': None, 'timeoutInSeconds': None, 'available': None}
+_engineApiConnections = threading.local()
+_engineApiLock = threading.Lock()
+
+
+class UnixSocketHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection to the docker Engine API over a unix socket."""
+
+    def __init__(self, socketPath, timeout = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socketPath = socketPath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if not(self.timeout is None):
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketPath)
+
+
+def EnableEngineApi(socketPath = DEFAULT_SOCKET_PATH, apiVersion = None, timeoutInSeconds = None):
+    """Talk to the docker Engine API over `socketPath` with a persistent
+    connection per thread, instead of forking the docker CLI, for the
+    operations which support it. The CLI is used as a fallback if the
+    socket cannot be reached.
+    """
+    with _engineApiLock:
+        _engineApiSettings['socketPath'] = socketPath
+        _engineApiSettings['apiVersion'] = apiVersion
+        _engineApiSettings['timeoutInSeconds'] = timeoutInSeconds
+        _engineApiSettings['available'] = None
+    CloseConnection()
+
+
+def DisableEngineApi():
+    with _engineApiLock:
+        _engineApiSettings['socketPath'] = None
+        _engineApiSettings['available'] = None
+    CloseConnection()
+
+
+def IsEngineApiEnabled():
+    return not(_engineApiSettings['socketPath'] is None)
+
+
+def IsEngineApiAvailable():
+    """Returns True if the Engine API is enabled and answers a ping. The
+    result of the first check is remembered until the API is enabled again.
+    """
+    if not IsEngineApiEnabled():
+        return False
+    if _engineApiSettings['available'] is None:
+        try:
+            Request('GET', '/_ping')
+            available = True
+        except (OSError, http.client.HTTPException) as e:
+            log.info("Docker Engine API is not available at {0}, falling back to the docker CLI: {1}".format(
+                _engineApiSettings['socketPath'], e))
+            available = False
+        _engineApiSettings['available'] = available
+    return _engineApiSettings['available']
+
+
+def GetConnection():
+    connection = getattr(_engineApiConnections, 'connection', None)
+    if connection is None:
+        connection = UnixSocketHTTPConnection(_engineApiSettings['socketPath'], _engineApiSettings['timeoutInSeconds'])
+        _engineApiConnections.connection = connection
+    return connection
+
+
+def CloseConnection():
+    connection = getattr(_engineApiConnections, 'connection', None)
+    if not(connection is None):
+        connection.close()
+        _engineApiConnections.connection = None
+
+
+def Request(method, path, query = None, body = None, expectedStatus = (200, 201, 204), outputFile = None):
+    """Send a request to the Engine API and return the response body as
+    bytes, or write it in chunks to `outputFile` if given. A stale persistent connection is reopened once, and the
+    connection is closed on any other error, like a timeout, so the next
+    request starts on a fresh one. Raises an exception with the message
+    from the daemon on unexpected status codes.
+    """
+    url = path
+    if not(_engineApiSettings['apiVersion'] is None):
+        url = '/v' + str(_engineApiSettings['apiVersion']) + url
+    if query:
+        url += '?' + urllib.parse.urlencode(query)
+    headers = {}
+    if not(body is None):
+        body = json.dumps(body).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+
+    for attempt in range(2):
+        connection = GetConnection()
+        try:
+            connection.request(method, url, body=body, headers=headers)
+            response = connection.getresponse()
+            if outputFile is None or not(response.status in expectedStatus):
+                data = response.read()
+            else:
+                for chunk in iter(lambda: response.read(RESPONSE_CHUNK_SIZE), b''):
+                    outputFile.write(chunk)
+                data = b''
+            break
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            CloseConnection()
+            if attempt > 0:
+                raise
+        except BaseException:
+            CloseConnection()
+            raise
+
+    if not(response.status in expectedStatus):
+        message = data.decode('utf-8', errors='replace')
+        try:
+            message = json.loads(message)['message']
+        except (ValueError, KeyError, TypeError):
+            pass
+        raise Exception("Docker Engine API {0} {1} failed with status {2}: {3}".format(method, path, response.status, message))
+    return data
+
+
+def RequestJson(method, path, query = None, body = None):
+    data = Request(method, path, query, body)
+    if len(data) == 0:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def QuoteName(name):
+    return urllib.parse.quote(name, safe='/:@')
+
+
+def InspectImage(imageName):
+    return RequestJson('GET', '/images/' + QuoteName(imageName) + '/json')
+
+
+def InspectContainer(containerName):
+    return RequestJson('GET', '/containers/' + QuoteName(containerName) + '/json')
+
+
+def Inspect(name, objectType = None):
+    if objectType == 'image':
+        return InspectImage(name)
+    if objectType == 'container':
+        return InspectContainer(name)
+    try:
+        return InspectContainer(name)
+    except Exception:
+        return InspectImage(name)
+
+
+def ListImageIds():
+    return [image['Id'] for image in RequestJson('GET', '/images/json', {'all': 'true'})]
+
+
+def ListImageTags():
+    """Returns the image ID of every tag, like 'my_repo/my.service:1.0.0'."""
+    imageTags = {}
+    for image in RequestJson('GET', '/images/json'):
+        for repoTag in image.get('RepoTags') or []:
+            if repoTag != '<none>:<none>':
+                imageTags[repoTag] = image['Id']
+    return imageTags
+
+
+def TagImage(sourceImage, targetImage):
+    lastColon = targetImage.rfind(':')
+    if lastColon == -1 or lastColon < targetImage.rfind('/'):
+        repo, tag = targetImage, 'latest'
+    else:
+        repo, tag = targetImage[:lastColon], targetImage[lastColon + 1:]
+    Request('POST', '/images/' + QuoteName(sourceImage) + '/tag', {'repo': repo, 'tag': tag})
+
+
+def GetContainerLogs(containerName):
+    data = Request('GET', '/containers/' + QuoteName(containerName) + '/logs', {'stdout': 1, 'stderr': 1})
+    return DemultiplexStream(data)
+
+
+def WriteContainerLogs(containerName, outputFile):
+    """Stream the logs of a container to the binary `outputFile`, without
+    holding them in memory.
+    """
+    writer = DemultiplexingWriter(outputFile)
+    Request('GET', '/containers/' + QuoteName(containerName) + '/logs', {'stdout': 1, 'stderr': 1}, outputFile=writer)
+    writer.Finish()
+
+
+class DemultiplexingWriter(object):
+    """Writer which joins the frames of a multiplexed log stream written
+    to it in chunks into `outputFile`, like DemultiplexStream.
+    """
+
+    def __init__(self, outputFile):
+        self.outputFile = outputFile
+        self.pending = b''
+        self.frameRemaining = 0
+        self.multiplexed = None
+
+    def write(self, chunk):
+        data = memoryview(self.pending + chunk) if len(self.pending) > 0 else memoryview(chunk)
+        self.pending = b''
+        while len(data) > 0:
+            if self.multiplexed is None:
+                if len(data) < 8:
+                    self.pending = bytes(data)
+                    return
+                self.multiplexed = IsMultiplexedStream(data)
+            if not self.multiplexed:
+                self.outputFile.write(data)
+                return
+            if self.frameRemaining > 0:
+                frameData = data[:self.frameRemaining]
+                self.outputFile.write(frameData)
+                self.frameRemaining -= len(frameData)
+                data = data[len(frameData):]
+                continue
+            if len(data) < 8:
+                self.pending = bytes(data)
+                return
+            self.frameRemaining = struct.unpack('>I', data[4:8])[0]
+            data = data[8:]
+
+    def Finish(self):
+        if self.multiplexed is None and len(self.pending) > 0:
+            self.outputFile.write(self.pending)
+        self.pending = b''
+
+
+def IsMultiplexedStream(data):
+    return len(data) >= 8 and data[0] in (0, 1, 2) and bytes(data[1:4]) == b'\x00\x00\x00'
+
+
+def DemultiplexStream(data):
+    """Join the stdout and stderr frames of a multiplexed log stream. Logs
+    of containers with a TTY are not multiplexed and are returned as is.
+    """
+    if not IsMultiplexedStream(data):
+        return data
+    output = bytearray()
+    offset = 0
+    while offset + 8 <= len(data):
+        frameSize = struct.unpack('>I', data[offset + 4:offset + 8])[0]
+        output += data[offset + 8:offset + 8 + frameSize]
+        offset += 8 + frameSize
+    return bytes(output)
+
+
+def ListServices():
+    """Returns the swarm services as a list of dicts with the `Name` and
+    `Replicas` keys, formatted like `docker service ls --format=json`.
+    """
+    services = []
+    for service in RequestJson('GET', '/services', {'status': 'true'}):
+        status = service.get('ServiceStatus', {})
+        replicas = '{0}/{1}'.format(status.get('RunningTasks', 0), status.get('DesiredTasks', 0))
+        services.append({'Name': service['Spec']['Name'], 'Replicas': replicas})
+    return services
+
+
+def CreateNetwork(networkName, driver = 'overlay', attachable = True, encrypted = False):
+    body = {'Name': networkName, 'Driver': driver, 'Attachable': attachable, 'CheckDuplicate': True}
+    if encrypted:
+        body['Options'] = {'encrypted': ''}
+    RequestJson('POST', '/networks/create', body=body)
+
+
+def RemoveNetwork(networkName):
+    Request('DELETE', '/networks/' + QuoteName(networkName))
+
+
+def CreateVolume(volumeName, driver = 'local', driverOptions = None):
+    body = {'Name': volumeName, 'Driver': driver, 'DriverOpts': driverOptions or {}}
+    RequestJson('POST', '/volumes/create', body=body)
+
+
+def RemoveVolume(volumeName):
+    Request('DELETE', '/volumes/' + QuoteName(volumeName))
+
+
+def CreateSecret(secretName, secretData):
+    body = {'Name': secretName, 'Data': base64.b64encode(secretData).decode('ascii')}
+    RequestJson('POST', '/secrets/create', body=body)
+
+
+def RemoveSecret(secretName):
+    Request('DELETE', '/secrets/' + QuoteName(secretName))
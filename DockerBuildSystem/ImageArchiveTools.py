@@ -0,0 +1,211 @@
+from DockerBuildSystem import TerminalTools, DockerImageTools, ParallelTools, EngineApiTools, InstrumentationTools
+import os
+import gzip
+import functools
+import json
+import time
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = {None: '.tar', 'gzip': '.tar.gz', 'zstd': '.tar.zst'}
+MANIFEST_EXTENSION = '.manifest.json'
+DEFAULT_COMPRESSION_LEVELS = {'gzip': 6, 'zstd': 3}
+
+
+def GetArchivePath(outputFolder, archiveName, compression = None):
+    return os.path.join(outputFolder, archiveName + ARCHIVE_EXTENSIONS[compression])
+
+
+def GetCompressionFromPath(archivePath):
+    for compression, extension in ARCHIVE_EXTENSIONS.items():
+        if not(compression is None) and archivePath.endswith(extension):
+            return compression
+    return None
+
+
+def OpenCompressedFile(path, mode, compression = None, compressionLevel = None):
+    """Open a binary file for streaming reads ('rb') or writes ('wb'),
+    compressed with 'gzip', 'zstd' (requires the zstandard package) or not
+    at all if `compression` is None.
+    """
+    if not(compression in ARCHIVE_EXTENSIONS):
+        raise Exception("Unknown compression: {0}".format(compression))
+    if compression is None:
+        return open(path, mode)
+    if compressionLevel is None:
+        compressionLevel = DEFAULT_COMPRESSION_LEVELS[compression]
+    if compression == 'gzip':
+        return gzip.open(path, mode, compresslevel=compressionLevel)
+    if zstandard is None:
+        raise Exception("zstd compression requires the zstandard package: pip install zstandard")
+    if mode == 'rb':
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return zstandard.ZstdCompressor(level=compressionLevel, threads=-1).stream_writer(open(path, 'wb'), closefd=True)
+
+
+def ReadManifest(archivePath):
+    manifestPath = archivePath + MANIFEST_EXTENSION
+    if not os.path.isfile(manifestPath):
+        return None
+    with open(manifestPath, 'r') as f:
+        return json.load(f)
+
+
+def WriteManifest(archivePath, manifest):
+    manifestPath = archivePath + MANIFEST_EXTENSION
+    tmpFile = manifestPath + '.tmp'
+    with open(tmpFile, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmpFile, manifestPath)
+
+
+def SaveImageArchive(imageNames, archivePath, compression = None, skipUnchanged = True, compressionLevel = None):
+    """Save images to one archive with `docker save`, so layers shared by
+    the images are stored once. Compressed archives are streamed through
+    the compressor without an intermediate file. A sidecar manifest with the
+    image IDs is written next to the archive, and the save is skipped if
+    the archive exists and its manifest has the same image IDs. A failed
+    save leaves any existing archive untouched.
+
+    Returns a dict with the `path`, `bytes` and `seconds` of the save, and
+    whether it was `skipped`.
+    """
+    imageNames = list(dict.fromkeys(imageNames))
+    imagesInfo = DockerImageTools.GetImagesInfo(imageNames)
+    imageIds = {imageName: imagesInfo[imageName]['Id'] for imageName in imageNames}
+    manifest = ReadManifest(archivePath)
+    if skipUnchanged and os.path.isfile(archivePath) and not(manifest is None) and manifest.get('images') == imageIds:
+        log.info("Skipping save of unchanged images to {0}".format(archivePath))
+        return {'path': archivePath, 'bytes': os.path.getsize(archivePath), 'seconds': 0.0, 'skipped': True}
+
+    startTime = time.monotonic()
+    tmpPath = archivePath + '.tmp'
+    try:
+        with InstrumentationTools.Operation('save', archivePath):
+            if compression is None:
+                TerminalTools.ExecuteTerminalCommands(["docker save -o " + tmpPath + " " + " ".join(imageNames)], True)
+            else:
+                with OpenCompressedFile(tmpPath, 'wb', compression, compressionLevel) as f:
+                    TerminalTools.ExecuteTerminalCommandAndWriteOutput("docker save " + " ".join(imageNames), f)
+        os.replace(tmpPath, archivePath)
+    except BaseException:
+        if os.path.isfile(tmpPath):
+            os.remove(tmpPath)
+        raise
+    WriteManifest(archivePath, {'images': imageIds, 'compression': compression})
+    seconds = time.monotonic() - startTime
+    archiveBytes = os.path.getsize(archivePath)
+    log.info("Saved {0} image(s) to {1} ({2:.1f} MB) in {3:.1f}s".format(
+        len(imageNames), archivePath, archiveBytes / 1e6, seconds))
+    return {'path': archivePath, 'bytes': archiveBytes, 'seconds': seconds, 'skipped': False}
+
+
+def SaveImageArchives(imageNamesByArchive, compression = None, maxParallel = 1, skipUnchanged = True, compressionLevel = None):
+    """Save many archives with up to `maxParallel` saves at the same time.
+    `imageNamesByArchive` is a dict with the images to save to each archive
+    path. Returns the result of SaveImageArchive for each archive.
+    """
+    saveTasks = []
+    for archivePath, imageNames in imageNamesByArchive.items():
+        saveTasks.append((archivePath, functools.partial(
+            SaveImageArchive, imageNames, archivePath, compression, skipUnchanged, compressionLevel)))
+    return ParallelTools.ExecuteInParallel(saveTasks, maxParallel)
+
+
+def GetArchivePaths(inputPath):
+    """Returns `inputPath` if it is an archive file, or else the archives
+    in the `inputPath` folder.
+    """
+    if os.path.isfile(inputPath):
+        return [inputPath]
+    archivePaths = []
+    for fileName in sorted(os.listdir(inputPath)):
+        if any(fileName.endswith(extension) for extension in ARCHIVE_EXTENSIONS.values()):
+            archivePaths.append(os.path.join(inputPath, fileName))
+    return archivePaths
+
+
+def GetExistingImageTags():
+    """Returns the image ID each local image tag points to."""
+    if EngineApiTools.IsEngineApiAvailable():
+        return EngineApiTools.ListImageTags()
+    output = TerminalTools.ExecuteTerminalCommandAndGetOutput("docker images --no-trunc --format \"{{.Repository}}:{{.Tag}} {{.ID}}\"")
+    imageTags = {}
+    for line in output.decode('utf-8').splitlines():
+        words = line.split()
+        if len(words) == 2 and words[0] != '<none>:<none>':
+            imageTags[words[0]] = words[1]
+    return imageTags
+
+
+def IsArchiveLoaded(manifest, existingImageTags):
+    """Returns True if every image name in the manifest is tagged locally
+    with the image ID it had when the archive was saved.
+    """
+    for imageName, imageId in manifest['images'].items():
+        repo, tag = DockerImageTools.SplitImageRepoAndTag(imageName)
+        if existingImageTags.get(repo + ':' + tag) != imageId:
+            return False
+    return True
+
+
+def LoadImageArchive(archivePath, existingImageTags = None, skipExisting = True):
+    """Load an archive written by SaveImageArchive, or any `docker save`
+    archive, with `docker load`. zstd archives are streamed through the
+    decompressor. The load is skipped if all image names in the manifest
+    next to the archive still point to the same image IDs in
+    `existingImageTags` (see GetExistingImageTags), so moved or removed
+    tags are restored.
+
+    Returns a dict with the `path`, `bytes`, `seconds` and throughput in
+    `megabytesPerSecond` of the load, and whether it was `skipped`.
+    """
+    archiveBytes = os.path.getsize(archivePath)
+    manifest = ReadManifest(archivePath)
+    if skipExisting and not(manifest is None) and not(existingImageTags is None) \
+            and IsArchiveLoaded(manifest, existingImageTags):
+        log.info("Skipping load of {0}, all images are already tagged".format(archivePath))
+        return {'path': archivePath, 'bytes': archiveBytes, 'seconds': 0.0, 'megabytesPerSecond': 0.0, 'skipped': True}
+
+    startTime = time.monotonic()
+    compression = GetCompressionFromPath(archivePath)
+    with InstrumentationTools.Operation('load', archivePath):
+        if compression == 'zstd':
+            with OpenCompressedFile(archivePath, 'rb', compression) as f:
+                log.info(TerminalTools.ExecuteTerminalCommandWithInput("docker load", f).strip())
+        else:
+            TerminalTools.ExecuteTerminalCommands(["docker load -i " + archivePath], True)
+    seconds = time.monotonic() - startTime
+    megabytesPerSecond = archiveBytes / 1e6 / seconds if seconds > 0 else 0.0
+    log.info("Loaded {0} ({1:.1f} MB) in {2:.1f}s, {3:.1f} MB/s".format(
+        archivePath, archiveBytes / 1e6, seconds, megabytesPerSecond))
+    if not(manifest is None):
+        DockerImageTools.InvalidateInspectCache(list(manifest['images']))
+    return {'path': archivePath, 'bytes': archiveBytes, 'seconds': seconds, 'megabytesPerSecond': megabytesPerSecond, 'skipped': False}
+
+
+def LoadImageArchives(inputPath, maxParallel = 1, skipExisting = True):
+    """Load the archives in the `inputPath` folder, or the `inputPath`
+    archive, with up to `maxParallel` loads at the same time. Archives whose
+    images are all tagged locally already are skipped, see
+    LoadImageArchive. Returns the result of LoadImageArchive for each
+    archive.
+    """
+    existingImageTags = GetExistingImageTags() if skipExisting else None
+    loadTasks = []
+    for archivePath in GetArchivePaths(inputPath):
+        loadTasks.append((archivePath, functools.partial(LoadImageArchive, archivePath, existingImageTags, skipExisting)))
+    startTime = time.monotonic()
+    results = ParallelTools.ExecuteInParallel(loadTasks, maxParallel)
+    seconds = time.monotonic() - startTime
+    loadedBytes = sum([result['bytes'] for result in results.values() if not result['skipped']])
+    log.info("Loaded {0} of {1} archive(s), {2:.1f} MB in {3:.1f}s, {4:.1f} MB/s".format(
+        len([result for result in results.values() if not result['skipped']]), len(results),
+        loadedBytes / 1e6, seconds, loadedBytes / 1e6 / seconds if seconds > 0 else 0.0))
+    return results
@@ -0,0 +1,204 @@
+import contextlib
+import contextvars
+import threading
+import json
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+COMMAND_GROUPS = ['compose', 'buildx', 'image', 'container', 'service', 'stack', 'network',
+                  'volume', 'secret', 'swarm', 'manifest', 'system']
+
+_spanCallbacks = []
+_spanCallbacksLock = threading.Lock()
+_currentOperation = contextvars.ContextVar('currentOperation', default=None)
+_contextSpanLists = contextvars.ContextVar('contextSpanLists', default=())
+
+
+def AddSpanCallback(callback):
+    """Register a callback which is called with a span dict for every
+    command run through TerminalTools. A span has the keys:
+        operation    operation type, like 'build', 'push' or 'compose up'
+        target       the image or service of the operation, or None
+        command      the terminal command
+        start        start time in seconds since the epoch
+        seconds      duration in seconds, including retries
+        returnCode   return code of the last attempt, or None
+        outputBytes  bytes of output
+        retries      number of retries
+        failed       True if the command failed
+    """
+    with _spanCallbacksLock:
+        _spanCallbacks.append(callback)
+
+
+def RemoveSpanCallback(callback):
+    with _spanCallbacksLock:
+        if callback in _spanCallbacks:
+            _spanCallbacks.remove(callback)
+
+
+def IsInstrumentationEnabled():
+    return len(_spanCallbacks) > 0
+
+
+def EmitSpan(span):
+    with _spanCallbacksLock:
+        callbacks = list(_spanCallbacks)
+    for callback in callbacks:
+        try:
+            callback(span)
+        except Exception as e:
+            log.info("Span callback failed: {0}".format(e))
+
+
+@contextlib.contextmanager
+def Operation(operation, target = None):
+    """Attribute the spans of all commands run within the context to an
+    operation type and an image or service.
+    """
+    token = _currentOperation.set((operation, target))
+    try:
+        yield
+    finally:
+        _currentOperation.reset(token)
+
+
+@contextlib.contextmanager
+def RecordSpans(currentContextOnly = False):
+    """Collect the spans emitted within the context in a list. With
+    `currentContextOnly`, only the spans of commands run by the current
+    thread or asyncio task are collected.
+    """
+    spans = []
+    if currentContextOnly:
+        token = _contextSpanLists.set(_contextSpanLists.get() + (spans,))
+        try:
+            yield spans
+        finally:
+            _contextSpanLists.reset(token)
+        return
+    AddSpanCallback(spans.append)
+    try:
+        yield spans
+    finally:
+        RemoveSpanCallback(spans.append)
+
+
+def GetOperationFromCommand(terminalCommand):
+    """Returns the docker sub command of a terminal command as operation
+    type, like 'push' for `docker push` or 'compose up' for
+    `docker compose -f x.yml up`.
+    """
+    words = terminalCommand.split()
+    if len(words) == 0 or words[0] != 'docker':
+        return words[0] if len(words) > 0 else ''
+    operationWords = []
+    index = 1
+    while index < len(words) and len(operationWords) < 2:
+        word = words[index]
+        index += 1
+        if word.startswith('-'):
+            if word in ['-f', '--file', '-p', '--project-name', '--builder', '--context', '-c', '-H', '--host']:
+                index += 1
+            continue
+        operationWords.append(word)
+        if not(word in COMMAND_GROUPS):
+            break
+    return ' '.join(operationWords)
+
+
+class CommandSpan(object):
+    """Measures one command and emits its span when the context exits. The
+    return code is taken from a raised exception with a `returnCode`.
+    """
+
+    def __init__(self, terminalCommand):
+        operation, target = _currentOperation.get() or (None, None)
+        self.span = {
+            'operation': operation or GetOperationFromCommand(terminalCommand),
+            'target': target,
+            'command': terminalCommand,
+            'start': None,
+            'seconds': 0.0,
+            'returnCode': None,
+            'outputBytes': 0,
+            'retries': 0,
+            'failed': False,
+        }
+
+    def __enter__(self):
+        self.span['start'] = time.time()
+        self.startTime = time.monotonic()
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        self.span['seconds'] = time.monotonic() - self.startTime
+        if not(exception is None):
+            self.span['failed'] = True
+            self.span['returnCode'] = getattr(exception, 'returnCode', self.span['returnCode'])
+        for spans in _contextSpanLists.get():
+            spans.append(self.span)
+        if IsInstrumentationEnabled():
+            EmitSpan(self.span)
+        return False
+
+    def AddOutputBytes(self, outputBytes):
+        self.span['outputBytes'] += outputBytes
+
+    def SetResult(self, returnCode, retries = 0, failed = None):
+        self.span['returnCode'] = returnCode
+        self.span['retries'] = retries
+        self.span['failed'] = not(returnCode in [0, None]) if failed is None else failed
+
+
+class JsonLinesExporter(object):
+    """Span callback writing each span as one JSON line to a file."""
+
+    def __init__(self, outputFile):
+        self.outputFile = outputFile
+        self.lock = threading.Lock()
+        self.file = open(outputFile, 'a')
+
+    def __call__(self, span):
+        line = json.dumps(span, sort_keys=True) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def Close(self):
+        with self.lock:
+            self.file.close()
+
+
+def GetSpanSummary(spans, groupBy = ('operation', 'target')):
+    """Aggregate spans by the `groupBy` keys, returning a list of dicts with
+    the group keys and the `count`, total and max `seconds`, `outputBytes`,
+    `retries` and `failures` of each group, slowest first.
+    """
+    summaries = {}
+    for span in spans:
+        groupKey = tuple(span[key] for key in groupBy)
+        summary = summaries.get(groupKey)
+        if summary is None:
+            summary = dict(zip(groupBy, groupKey))
+            summary.update({'count': 0, 'seconds': 0.0, 'maxSeconds': 0.0, 'outputBytes': 0, 'retries': 0, 'failures': 0})
+            summaries[groupKey] = summary
+        summary['count'] += 1
+        summary['seconds'] += span['seconds']
+        summary['maxSeconds'] = max(summary['maxSeconds'], span['seconds'])
+        summary['outputBytes'] += span['outputBytes']
+        summary['retries'] += span['retries']
+        summary['failures'] += 1 if span['failed'] else 0
+    return sorted(summaries.values(), key=lambda summary: summary['seconds'], reverse=True)
+
+
+def PrintSpanSummary(spans, groupBy = ('operation', 'target'), maxRows = None):
+    summaries = GetSpanSummary(spans, groupBy)
+    log.info("{0:>10} {1:>10} {2:>6} {3:>10} {4:>7} {5:>8}  {6}".format(
+        'total', 'max', 'count', 'output', 'retries', 'failures', ' / '.join(groupBy)))
+    for summary in summaries[:maxRows]:
+        log.info("{0:>9.1f}s {1:>9.1f}s {2:>6} {3:>8.1f}MB {4:>7} {5:>8}  {6}".format(
+            summary['seconds'], summary['maxSeconds'], summary['count'], summary['outputBytes'] / 1e6,
+            summary['retries'], summary['failures'], ' / '.join([str(summary[key]) for key in groupBy])))
@@ -0,0 +1,62 @@
+import xml.etree.ElementTree as ElementTree
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def GetJUnitXml(results):
+    """Returns the results of DockerComposeTools.ExecuteComposeTestSuites as
+    a JUnit XML element tree: a testsuite per suite, with a testcase per test
+    container which fails if the container exited with a non-zero exit
+    code, and an errored 'compose' testcase if the suite failed to run.
+    """
+    testSuitesElement = ElementTree.Element('testsuites')
+    totals = {'tests': 0, 'failures': 0, 'errors': 0, 'time': 0.0}
+    for suiteName, result in results.items():
+        testSuiteElement = ElementTree.SubElement(testSuitesElement, 'testsuite', name=suiteName)
+        propertiesElement = ElementTree.SubElement(testSuiteElement, 'properties')
+        ElementTree.SubElement(propertiesElement, 'property', name='projectName', value=str(result['projectName']))
+        for phase, seconds in result['timings'].items():
+            ElementTree.SubElement(propertiesElement, 'property', name=phase + 'Seconds', value='{0:.3f}'.format(seconds))
+
+        counts = {'tests': 0, 'failures': 0, 'errors': 0}
+        for containerName, exitCode in result['containers'].items():
+            testCaseElement = ElementTree.SubElement(testSuiteElement, 'testcase', classname=suiteName, name=containerName)
+            counts['tests'] += 1
+            if exitCode != 0:
+                message = "Container '{0}' exited with code {1}".format(containerName, exitCode)
+                ElementTree.SubElement(testCaseElement, 'failure', message=message)
+                counts['failures'] += 1
+        if not(result['error'] is None):
+            testCaseElement = ElementTree.SubElement(testSuiteElement, 'testcase', classname=suiteName, name='compose')
+            errorElement = ElementTree.SubElement(testCaseElement, 'error', message=result['error'].splitlines()[0] if result['error'] else '')
+            errorElement.text = result['error']
+            counts['tests'] += 1
+            counts['errors'] += 1
+
+        for key, count in counts.items():
+            testSuiteElement.set(key, str(count))
+            totals[key] += count
+        testSuiteElement.set('time', '{0:.3f}'.format(result['seconds']))
+        totals['time'] += result['seconds']
+
+    for key in ['tests', 'failures', 'errors']:
+        testSuitesElement.set(key, str(totals[key]))
+    testSuitesElement.set('time', '{0:.3f}'.format(totals['time']))
+    return ElementTree.ElementTree(testSuitesElement)
+
+
+def WriteJUnitReport(results, outputFile):
+    GetJUnitXml(results).write(outputFile, encoding='utf-8', xml_declaration=True)
+    log.info("Wrote JUnit report to {0}".format(outputFile))
+
+
+def PrintTestReport(results):
+    log.info("{0:<8} {1:>9} {2:>9} {3:>9} {4:>9}  {5}".format('result', 'total', 'build', 'up', 'down', 'suite'))
+    for suiteName, result in sorted(results.items(), key=lambda item: item[1]['seconds'], reverse=True):
+        timings = ['{0:>8.1f}s'.format(result['timings'][phase]) if phase in result['timings'] else '{0:>9}'.format('-')
+                   for phase in ['build', 'up', 'down']]
+        log.info("{0:<8} {1:>8.1f}s {2}  {3} ({4})".format(
+            'PASSED' if result['passed'] else 'FAILED', result['seconds'], ' '.join(timings), suiteName, result['projectName']))
+    failedSuites = [result for result in results.values() if not result['passed']]
+    log.info("{0} of {1} test suite(s) passed".format(len(results) - len(failedSuites), len(results)))
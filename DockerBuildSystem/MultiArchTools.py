@@ -1,17 +1,26 @@
-from DockerBuildSystem import TerminalTools, YamlTools, DockerImageTools
+from DockerBuildSystem import TerminalTools, YamlTools, DockerImageTools, ParallelTools, BuildxTools, InstrumentationTools
 import os
 import json
+import functools
 import logging
 
 log = logging.getLogger(__name__)
 
 
-def MultiBuildPushByDigest(composeFile, platforms, digestsFile):
+def MultiBuildPushByDigest(composeFile, platforms, digestsFile, maxParallel = 1, builderName = None, cacheFrom = None, cacheTo = None):
     """Build each service in the compose file with `docker buildx build`
     using `push-by-digest=true,push=true`. Captures the resulting digest
     from the buildx metadata file and writes a JSON map keyed by service
     name to `digestsFile`.
 
+    Up to `maxParallel` services are built at the same time, each writing
+    its own metadata file, and the digests file is written atomically once
+    all builds are done. All services are built with the named buildx
+    builder, which is created or reused through BuildxTools.EnsureBuilder.
+    The build cache is imported from and exported to the `build.cache_from`
+    and `build.cache_to` entries of each service, plus `cacheFrom` and
+    `cacheTo` for all services (see BuildxTools.GetCacheCommand).
+
     The output JSON is a dictionary like:
         {
           "myService": {
@@ -26,74 +35,88 @@ def MultiBuildPushByDigest(composeFile, platforms, digestsFile):
     """
     yamlData = YamlTools.GetYamlData([composeFile])
     services = yamlData.get('services', {})
-    digests = {}
+    builderName = BuildxTools.EnsureBuilder(builderName or BuildxTools.DEFAULT_BUILDER_NAME)
 
+    buildTasks = []
     for service in services:
-        svc = services[service]
-        if 'build' not in svc:
+        if 'build' not in services[service]:
             continue
-
-        image = svc['image']
-        repo, tag = DockerImageTools.SplitImageRepoAndTag(image)
-
-        buildCfg = svc['build']
-        context = buildCfg.get('context', '.')
-        dockerfile = buildCfg.get('dockerfile', 'Dockerfile')
-        args = buildCfg.get('args', []) or []
-        if isinstance(args, dict):
-            args = ['{0}={1}'.format(k, v) for k, v in args.items()]
-
-        argsCommand = ''
-        for arg in args:
-            argsCommand += ' --build-arg ' + arg
-
-        metaFile = '.dbm-meta-{0}.json'.format(service)
-        if os.path.isfile(metaFile):
-            os.remove(metaFile)
-
-        createBuildDriverCommand = 'docker buildx create --use'
-        TerminalTools.ExecuteTerminalCommands([createBuildDriverCommand], True)
-
-        platformsCsv = ','.join(platforms)
-        fullPathDockerfile = os.path.join(context, dockerfile)
-        outputArg = (
-            '--output type=image,'
-            '"name={0}",'
-            'push-by-digest=true,'
-            'name-canonical=true,'
-            'push=true'
-        ).format(repo)
-
-        dockerCommand = (
-            'docker buildx build '
-            + '--platform ' + platformsCsv + ' '
-            + '-f ' + fullPathDockerfile
-            + argsCommand + ' '
-            + outputArg + ' '
-            + '--metadata-file ' + metaFile + ' '
-            + context
-        )
-        TerminalTools.ExecuteTerminalCommands([dockerCommand], True)
-
-        digest = ReadDigestFromMetadataFile(metaFile)
-        digests[service] = {
-            'image': image,
-            'repo': repo,
-            'tag': tag,
-            'digest': digest,
-            'platforms': list(platforms),
-        }
-
-        try:
-            os.remove(metaFile)
-        except OSError:
-            pass
+        outputPrefix = '[{0}] '.format(service) if not(maxParallel is None) and maxParallel > 1 else ''
+        buildTasks.append((service, functools.partial(
+            BuildPushServiceByDigest, service, services[service], platforms, builderName, outputPrefix, cacheFrom, cacheTo)))
+    digests = ParallelTools.ExecuteInParallel(buildTasks, maxParallel)
 
     WriteDigestsFile(digestsFile, digests)
     log.info('Wrote {0} digest entries to {1}'.format(len(digests), digestsFile))
     return digests
 
 
+def BuildPushServiceByDigest(service, svc, platforms, builderName = BuildxTools.DEFAULT_BUILDER_NAME, outputPrefix = '', cacheFrom = None, cacheTo = None):
+    image = svc['image']
+    repo, tag = DockerImageTools.SplitImageRepoAndTag(image)
+
+    buildCfg = svc['build']
+    context = buildCfg.get('context', '.')
+    dockerfile = buildCfg.get('dockerfile', 'Dockerfile')
+    args = buildCfg.get('args', []) or []
+    if isinstance(args, dict):
+        args = ['{0}={1}'.format(k, v) for k, v in args.items()]
+
+    argsCommand = ''
+    for arg in args:
+        argsCommand += ' --build-arg ' + arg
+    cacheCommand = BuildxTools.GetCacheCommand(
+        buildCfg.get('cache_from', []) + list(cacheFrom or []),
+        buildCfg.get('cache_to', []) + list(cacheTo or []))
+
+    metaFile = '.dbm-meta-{0}.json'.format(service)
+    if os.path.isfile(metaFile):
+        os.remove(metaFile)
+
+    platformsCsv = ','.join(platforms)
+    fullPathDockerfile = os.path.join(context, dockerfile)
+    outputArg = (
+        '--output type=image,'
+        '"name={0}",'
+        'push-by-digest=true,'
+        'name-canonical=true,'
+        'push=true'
+    ).format(repo)
+
+    dockerCommand = (
+        'docker buildx build '
+        + '--builder ' + builderName + ' '
+        + '--platform ' + platformsCsv + ' '
+        + '--progress=plain '
+        + '-f ' + fullPathDockerfile
+        + argsCommand
+        + cacheCommand + ' '
+        + outputArg + ' '
+        + '--metadata-file ' + metaFile + ' '
+        + context
+    )
+    outputLines = []
+    with InstrumentationTools.Operation('build', service):
+        TerminalTools.ExecuteTerminalCommands([dockerCommand], True, outputPrefix=outputPrefix,
+                                              outputLineCallback=outputLines.append)
+    BuildxTools.LogBuildCacheStatistics(BuildxTools.ParseBuildCacheStatistics(outputLines), outputPrefix)
+
+    digest = ReadDigestFromMetadataFile(metaFile)
+
+    try:
+        os.remove(metaFile)
+    except OSError:
+        pass
+
+    return {
+        'image': image,
+        'repo': repo,
+        'tag': tag,
+        'digest': digest,
+        'platforms': list(platforms),
+    }
+
+
 def ReadDigestFromMetadataFile(metaFile):
     if not os.path.isfile(metaFile):
         raise Exception(
@@ -112,8 +135,10 @@ def WriteDigestsFile(digestsFile, digests):
     parent = os.path.dirname(os.path.abspath(digestsFile))
     if parent and not os.path.isdir(parent):
         os.makedirs(parent)
-    with open(digestsFile, 'w') as f:
+    temporaryDigestsFile = digestsFile + '.tmp'
+    with open(temporaryDigestsFile, 'w') as f:
         json.dump(digests, f, indent=2)
+    os.replace(temporaryDigestsFile, digestsFile)
 
 
 def LoadDigestsFiles(digestFiles):
@@ -133,12 +158,13 @@ def LoadDigestsFiles(digestFiles):
     return grouped
 
 
-def CreateMultiArchManifest(repo, tags, digests):
+def CreateMultiArchManifest(repo, tags, digests, retryPolicy = None):
     """Run `docker buildx imagetools create` to combine per-arch digests into
     a single multi-arch manifest list, tagging it with all `tags`.
 
     `digests` is a list of digest strings (sha256:...). `tags` is a list of
-    tag strings (e.g. ['1.2.3', 'latest']).
+    tag strings (e.g. ['1.2.3', 'latest']). An optional
+    `TerminalTools.RetryPolicy` retries the command on transient errors.
     """
     if not tags:
         raise Exception("CreateMultiArchManifest requires at least one tag for repo '{0}'".format(repo))
@@ -154,4 +180,26 @@ def CreateMultiArchManifest(repo, tags, digests):
         sourcesCommand += ' ' + repo + '@' + digest
 
     dockerCommand = 'docker buildx imagetools create' + tagsCommand + sourcesCommand
-    TerminalTools.ExecuteTerminalCommands([dockerCommand], True)
+    TerminalTools.ExecuteTerminalCommands([dockerCommand], True, retryPolicy=retryPolicy)
+
+
+def CopyImageOnRegistry(sourceImage, targetImages, dryRun = False):
+    """Run `docker buildx imagetools create` to copy the manifest of
+    `sourceImage` to each image in `targetImages`, without pulling or
+    pushing any layers through the local docker daemon.
+
+    The target images may be in another repository or registry, in which case
+    the registry copies the blobs itself.
+    """
+    if not targetImages:
+        raise Exception("CopyImageOnRegistry requires at least one target image for '{0}'".format(sourceImage))
+
+    tagsCommand = ''
+    for targetImage in targetImages:
+        tagsCommand += ' -t ' + targetImage
+
+    dockerCommand = 'docker buildx imagetools create' + tagsCommand + ' ' + sourceImage
+    if dryRun:
+        log.info('Would have called {0}'.format(dockerCommand))
+    else:
+        TerminalTools.ExecuteTerminalCommands([dockerCommand], True)
@@ -0,0 +1,174 @@
+import concurrent.futures
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def ExecuteInParallel(tasks, maxParallel = 1):
+    """Execute named tasks with a bounded pool of worker threads.
+
+    `tasks` is a list of `(name, callable)` tuples (or a dict of the same).
+    Returns a dict with the result of each task keyed by its name, in the
+    order the tasks were given.
+
+    When a task fails, no more tasks are started. Tasks which are already
+    running are allowed to finish, so no build or push is left orphaned,
+    before an exception describing the first failure is raised.
+    """
+    if isinstance(tasks, dict):
+        tasks = list(tasks.items())
+    results = {}
+    if maxParallel is None or maxParallel <= 1 or len(tasks) <= 1:
+        for name, task in tasks:
+            results[name] = task()
+        return results
+
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=maxParallel) as executor:
+        futures = {}
+        for name, task in tasks:
+            futures[executor.submit(task)] = name
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is None:
+                continue
+            if len(failures) == 0:
+                log.info("Task '{0}' failed, waiting for running tasks to finish.".format(name))
+                for pendingFuture in futures:
+                    pendingFuture.cancel()
+            failures.append((name, error))
+
+    if len(failures) > 0:
+        firstName, firstError = failures[0]
+        errorMsg = "Task '{0}' failed: {1}".format(firstName, firstError)
+        if len(failures) > 1:
+            errorMsg += "\r\nOther failed tasks: " + ', '.join([name for name, _ in failures[1:]])
+        raise Exception(errorMsg) from firstError
+
+    for future, name in futures.items():
+        results[name] = future.result()
+    return {name: results[name] for name, _ in tasks}
+
+
+def GetTopologicalWaves(dependencies):
+    """Group the nodes of a dependency graph in waves, where every node only
+    depends on nodes in earlier waves. `dependencies` is a dict with the
+    list of nodes each node depends on. Raises an exception describing a
+    cycle if the graph has one.
+    """
+    remaining = {node: set(nodeDependencies) & set(dependencies) for node, nodeDependencies in dependencies.items()}
+    waves = []
+    while len(remaining) > 0:
+        wave = [node for node in remaining if len(remaining[node]) == 0]
+        if len(wave) == 0:
+            raise Exception("Dependency cycle detected: " + ' -> '.join(FindCycle(remaining)))
+        for node in wave:
+            del remaining[node]
+        for node in remaining:
+            remaining[node].difference_update(wave)
+        waves.append(wave)
+    return waves
+
+
+def FindCycle(dependencies):
+    path = []
+    node = next(iter(dependencies))
+    while not(node in path):
+        path.append(node)
+        node = next(iter(sorted(dependencies[node])))
+    return path[path.index(node):] + [node]
+
+
+def GetCriticalPath(dependencies, durations):
+    """Returns the chain of dependent nodes with the longest total duration,
+    and that duration, as a `(path, seconds)` tuple.
+    """
+    finishTimes = {}
+    previousNodes = {}
+    for wave in GetTopologicalWaves(dependencies):
+        for node in wave:
+            nodeDependencies = [dependency for dependency in dependencies[node] if dependency in finishTimes]
+            previousNode = max(nodeDependencies, key=lambda dependency: finishTimes[dependency], default=None)
+            previousNodes[node] = previousNode
+            finishTimes[node] = durations.get(node, 0.0) + (0.0 if previousNode is None else finishTimes[previousNode])
+    if len(finishTimes) == 0:
+        return [], 0.0
+    node = max(finishTimes, key=lambda node: finishTimes[node])
+    seconds = finishTimes[node]
+    path = []
+    while not(node is None):
+        path.insert(0, node)
+        node = previousNodes[node]
+    return path, seconds
+
+
+def ExecuteGraphInParallel(tasks, dependencies, maxParallel = 1, durations = None):
+    """Execute named tasks with a bounded pool of worker threads, starting
+    each task once all the tasks it depends on have finished. `dependencies`
+    is a dict with the names of the tasks each task depends on; unknown
+    names are ignored. The duration of each task in seconds is written to
+    the `durations` dict, if given.
+
+    Returns a dict with the result of each task keyed by its name. Failures
+    are handled like in ExecuteInParallel, and tasks depending on a failed
+    task are never started.
+    """
+    if isinstance(tasks, dict):
+        tasks = list(tasks.items())
+    taskByName = dict(tasks)
+    dependencies = {name: [dependency for dependency in dependencies.get(name, []) if dependency in taskByName]
+                    for name in taskByName}
+    waves = GetTopologicalWaves(dependencies)
+    if durations is None:
+        durations = {}
+
+    def RunTask(name):
+        startTime = time.monotonic()
+        try:
+            return taskByName[name]()
+        finally:
+            durations[name] = time.monotonic() - startTime
+
+    results = {}
+    if maxParallel is None or maxParallel <= 1 or len(tasks) <= 1:
+        for wave in waves:
+            for name in wave:
+                results[name] = RunTask(name)
+        return {name: results[name] for name, _ in tasks}
+
+    remaining = {name: set(nodeDependencies) for name, nodeDependencies in dependencies.items()}
+    order = [name for wave in waves for name in wave]
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=maxParallel) as executor:
+        running = {}
+        while True:
+            if len(failures) == 0:
+                for name in [name for name in order if name in remaining and len(remaining[name]) == 0]:
+                    del remaining[name]
+                    running[executor.submit(RunTask, name)] = name
+            if len(running) == 0:
+                break
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    results[name] = future.result()
+                    for nodeDependencies in remaining.values():
+                        nodeDependencies.discard(name)
+                    continue
+                if len(failures) == 0:
+                    log.info("Task '{0}' failed, waiting for running tasks to finish.".format(name))
+                failures.append((name, error))
+
+    if len(failures) > 0:
+        firstName, firstError = failures[0]
+        errorMsg = "Task '{0}' failed: {1}".format(firstName, firstError)
+        if len(failures) > 1:
+            errorMsg += "\r\nOther failed tasks: " + ', '.join([name for name, _ in failures[1:]])
+        raise Exception(errorMsg) from firstError
+    return {name: results[name] for name, _ in tasks}
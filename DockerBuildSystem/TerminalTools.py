@@ -1,11 +1,212 @@
 import subprocess
+import asyncio
+import signal
+import tempfile
+import functools
+import collections
+import threading
+import random
+import time
 import os
 import re
 import logging
 from dotenv import load_dotenv
+from DockerBuildSystem import InstrumentationTools
 
 log = logging.getLogger(__name__)
 
+ASYNC_STREAM_LIMIT = 1024 * 1024
+OUTPUT_CHUNK_SIZE = 64 * 1024
+OUTPUT_SPILL_SIZE = 64 * 1024 * 1024
+OUTPUT_MAX_LINE_SIZE = 1024 * 1024
+ERROR_OUTPUT_SIZE = 64 * 1024
+MAX_TRANSIENT_ERROR_MATCHES = 100
+
+INLINE_FLAGS_PATTERN = re.compile(r'^(?:\(\?[aiLmsux]+\))+')
+
+TransientErrorMatch = collections.namedtuple('TransientErrorMatch', ['lineNumber', 'pattern', 'line'])
+
+
+class TerminalCommandError(Exception):
+    """Raised when a terminal command fails. Carries the return code and the
+    transient error matches found in the output, so callers can classify the
+    failure without scanning the output again.
+    """
+
+    def __init__(self, message, terminalCommand = None, returnCode = None, transientErrors = None):
+        super().__init__(message)
+        self.terminalCommand = terminalCommand
+        self.returnCode = returnCode
+        self.transientErrors = transientErrors if transientErrors is not None else []
+
+
+class TransientErrorMatcher(object):
+    """Matches a set of transient error patterns with one combined regex.
+
+    String patterns are matched literally and case insensitively, as they
+    always have been. Compiled regex patterns (`re.compile(...)`) are matched
+    as regexes, keeping their own flags.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        groups = []
+        for index, pattern in enumerate(self.patterns):
+            groups.append('(?P<transientError{0}>{1})'.format(index, GetScopedPatternSource(pattern)))
+        source = '|'.join(groups)
+        self.regex = re.compile(source, re.MULTILINE)
+        self.bytesRegex = re.compile(source.encode('utf-8'), re.MULTILINE)
+
+    def MatchLine(self, line):
+        """Returns the first pattern found in `line` (str or bytes), or None."""
+        regex = self.regex if isinstance(line, str) else self.bytesRegex
+        match = regex.search(line)
+        if match is None:
+            return None
+        return self.GetMatchedPattern(match)
+
+    def FindMatches(self, text, firstLineNumber = 1):
+        """Returns a TransientErrorMatch for each pattern match in the lines
+        of `text` (str or bytes), numbered from `firstLineNumber`.
+        """
+        regex = self.regex if isinstance(text, str) else self.bytesRegex
+        newLine = '\n' if isinstance(text, str) else b'\n'
+        matches = []
+        lineNumber = firstLineNumber
+        lineNumberOffset = 0
+        for match in regex.finditer(text):
+            lineNumber += text.count(newLine, lineNumberOffset, match.start())
+            lineNumberOffset = match.start()
+            lineStart = text.rfind(newLine, 0, match.start()) + 1
+            lineEnd = text.find(newLine, match.end())
+            line = text[lineStart:lineEnd if lineEnd >= 0 else len(text)]
+            if not isinstance(line, str):
+                line = bytes(line).decode('utf-8', errors='replace')
+            matches.append(TransientErrorMatch(lineNumber, self.GetMatchedPattern(match), line.rstrip()))
+        return matches
+
+    def GetMatchedPattern(self, match):
+        return self.patterns[int(match.lastgroup[len('transientError'):])]
+
+
+class RetryPolicy(object):
+    """Retry policy for a single failing terminal command.
+
+    A failure is retried if transient error patterns were found in the output
+    of the command, or on any non-zero return code if `retryOnErrorCode` is
+    True. The command is attempted at most `maxAttempts` times, waiting an
+    exponentially growing delay between attempts, from
+    `initialDelayInSeconds` up to `maxDelayInSeconds`, with a random jitter of
+    +/- `jitterFraction` of the delay.
+
+    `transientErrorPatterns` are used to detect transient errors when the
+    command is not given patterns of its own. The number of retries, the time
+    spent retrying and which patterns triggered the retries are recorded, and
+    can be read with GetStatistics. A policy may be shared between threads.
+    """
+
+    def __init__(self, maxAttempts = 3, initialDelayInSeconds = 1.0, maxDelayInSeconds = 30.0, backoffFactor = 2.0,
+                 jitterFraction = 0.2, transientErrorPatterns = None, retryOnErrorCode = False):
+        self.maxAttempts = maxAttempts
+        self.initialDelayInSeconds = initialDelayInSeconds
+        self.maxDelayInSeconds = maxDelayInSeconds
+        self.backoffFactor = backoffFactor
+        self.jitterFraction = jitterFraction
+        self.transientErrorPatterns = transientErrorPatterns
+        self.retryOnErrorCode = retryOnErrorCode
+        self.lock = threading.Lock()
+        self.retryCount = 0
+        self.retryTimeInSeconds = 0.0
+        self.retriesByPattern = collections.Counter()
+        self.commandStatistics = {}
+
+    def ClassifyFailure(self, error):
+        """Returns the patterns of the transient errors found in the output of
+        a failed command, or an empty list if it failed on its return code only.
+        """
+        return list(dict.fromkeys([transientError.pattern for transientError in getattr(error, 'transientErrors', [])]))
+
+    def ShouldRetry(self, error, attempt):
+        if attempt >= self.maxAttempts:
+            return False
+        if len(self.ClassifyFailure(error)) > 0:
+            return True
+        return self.retryOnErrorCode
+
+    def GetDelayInSeconds(self, attempt):
+        delayInSeconds = min(self.initialDelayInSeconds * self.backoffFactor ** (attempt - 1), self.maxDelayInSeconds)
+        jitterInSeconds = delayInSeconds * self.jitterFraction
+        return max(delayInSeconds + random.uniform(-jitterInSeconds, jitterInSeconds), 0.0)
+
+    def RecordAttempts(self, terminalCommand, attempts, error, retryTimeInSeconds):
+        with self.lock:
+            self.retryCount += attempts - 1
+            self.retryTimeInSeconds += retryTimeInSeconds
+            statistics = self.commandStatistics.setdefault(terminalCommand, {'attempts': 0, 'retryTimeInSeconds': 0.0, 'failed': False})
+            statistics['attempts'] += attempts
+            statistics['retryTimeInSeconds'] += retryTimeInSeconds
+            statistics['failed'] = not(error is None)
+        if attempts > 1:
+            log.info("Command needed {0} attempts, spending {1:.1f} seconds retrying: {2}".format(attempts, retryTimeInSeconds, terminalCommand))
+
+    def RecordRetry(self, error):
+        with self.lock:
+            for pattern in self.ClassifyFailure(error) or ['return code']:
+                self.retriesByPattern[str(getattr(pattern, 'pattern', pattern))] += 1
+
+    def GetCommandStatistics(self, terminalCommand):
+        with self.lock:
+            return dict(self.commandStatistics.get(terminalCommand, {'attempts': 0, 'retryTimeInSeconds': 0.0, 'failed': False}))
+
+    def GetStatistics(self):
+        with self.lock:
+            return {
+                'retryCount': self.retryCount,
+                'retryTimeInSeconds': self.retryTimeInSeconds,
+                'retriesByPattern': dict(self.retriesByPattern),
+                'commands': {terminalCommand: dict(statistics) for terminalCommand, statistics in self.commandStatistics.items()},
+            }
+
+def GetScopedPatternSource(pattern):
+    """Returns the source of `pattern` as a group with its own flags, so it
+    can be combined with other patterns. Leading inline flags like `(?i)` are
+    already part of `pattern.flags` and are removed from the source.
+    """
+    if hasattr(pattern, 'pattern'):
+        source = pattern.pattern
+        if not isinstance(source, str):
+            source = source.decode('utf-8')
+        source = INLINE_FLAGS_PATTERN.sub('', source)
+        flags = ''
+        for flag, value in [('i', re.IGNORECASE), ('m', re.MULTILINE), ('s', re.DOTALL), ('x', re.VERBOSE)]:
+            if pattern.flags & value:
+                flags += flag
+        return '(?{0}:{1})'.format(flags, source) if flags else '(?:{0})'.format(source)
+    return '(?i:{0})'.format(re.escape(pattern))
+
+
+def GetTransientErrorMatcher(transientErrorPatterns):
+    """Returns a TransientErrorMatcher for the given patterns, compiled once
+    per distinct set of patterns, or None if there are no patterns."""
+    if transientErrorPatterns is None or isinstance(transientErrorPatterns, TransientErrorMatcher):
+        return transientErrorPatterns
+    patterns = tuple(transientErrorPatterns)
+    if len(patterns) == 0:
+        return None
+    return CompileTransientErrorPatterns(patterns)
+
+
+@functools.lru_cache(maxsize=64)
+def CompileTransientErrorPatterns(patterns):
+    return TransientErrorMatcher(patterns)
+
+
+def GetTransientErrorMessage(transientErrors):
+    errorMsg = "\nTransient error detected in output."
+    for transientError in transientErrors[:10]:
+        errorMsg += "\n  line {0}: {1}".format(transientError.lineNumber, transientError.line)
+    return errorMsg
+
 
 def LoadEnvironmentVariables(environmentVariablesFile):
     load_dotenv(environmentVariablesFile)
@@ -21,75 +222,396 @@ def PrintAvailableCommands(availableCommands):
         log.info(availableCommand)
 
 
-def ExecuteTerminalCommands(terminalCommands, raiseExceptionWithErrorCode=False, printCommand=False, transientErrorPatterns=None):
-    transientErrorPatterns = transientErrorPatterns if transientErrorPatterns is not None else []
+def ExecuteTerminalCommands(terminalCommands, raiseExceptionWithErrorCode=False, printCommand=False, transientErrorPatterns=None, outputPrefix='', retryPolicy=None, outputLineCallback=None):
+    if transientErrorPatterns is None and not(retryPolicy is None):
+        transientErrorPatterns = retryPolicy.transientErrorPatterns
+    transientErrorMatcher = GetTransientErrorMatcher(transientErrorPatterns)
     for terminalCommand in terminalCommands:
         if printCommand:
-            log.info(f"Executing: {terminalCommand}")
+            log.info(f"{outputPrefix}Executing: {terminalCommand}")
         try:
-            with subprocess.Popen(
-                terminalCommand,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True
-            ) as process:
-                errorDetected = False
-                outputLines = []
-                for line in process.stdout:
-                    line = line.rstrip()
-                    log.info(line)
-                    outputLines.append(line)
-                    for pattern in transientErrorPatterns:
-                        if pattern.lower() in line.lower():
-                            errorDetected = True
-                returnCode = process.wait()
-                if returnCode != 0 or errorDetected:
-                    errorMsg = f"Command failed: {terminalCommand}\nReturn code: {returnCode}"
-                    if errorDetected:
-                        errorMsg += "\nTransient error detected in output."
+            with InstrumentationTools.CommandSpan(terminalCommand) as span:
+                attempt = 1
+                firstFailureTime = None
+                while True:
+                    error = ExecuteTerminalCommandWithTransientErrorMatcher(terminalCommand, transientErrorMatcher, outputPrefix, outputLineCallback, span)
+                    if error is None or retryPolicy is None or not retryPolicy.ShouldRetry(error, attempt):
+                        break
+                    if firstFailureTime is None:
+                        firstFailureTime = time.time()
+                    retryPolicy.RecordRetry(error)
+                    delayInSeconds = retryPolicy.GetDelayInSeconds(attempt)
+                    log.info(f"{outputPrefix}{error}\nRetrying in {delayInSeconds:.1f} seconds (attempt {attempt + 1} of {retryPolicy.maxAttempts}).")
+                    time.sleep(delayInSeconds)
+                    attempt += 1
+                span.SetResult(0 if error is None else error.returnCode, attempt - 1, not(error is None))
+                if not(retryPolicy is None):
+                    retryPolicy.RecordAttempts(terminalCommand, attempt, error,
+                                               0.0 if firstFailureTime is None else time.time() - firstFailureTime)
+                if not(error is None):
                     if raiseExceptionWithErrorCode:
-                        raise Exception(errorMsg)
+                        raise error
                     else:
-                        log.info(errorMsg)
+                        log.info(str(error))
         except KeyboardInterrupt:
             if raiseExceptionWithErrorCode:
                 raise Exception("Command interrupted by user (KeyboardInterrupt)")
 
 
-def ExecuteTerminalCommandAndGetOutput(terminalCommand, includeErrorOutput=False, printCommand=False, transientErrorPatterns=None):
-    transientErrorPatterns = transientErrorPatterns if transientErrorPatterns is not None else []
+def ExecuteTerminalCommandWithTransientErrorMatcher(terminalCommand, transientErrorMatcher, outputPrefix='', outputLineCallback=None, span=None):
+    """Run a shell command, logging its output line by line and passing
+    each line to `outputLineCallback` if given. The raw output bytes are
+    counted on `span` if given. Returns a TerminalCommandError if the
+    command failed, or None if it succeeded.
+    """
+    with subprocess.Popen(
+        terminalCommand,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT
+    ) as process:
+        transientErrors = []
+        for lineNumber, rawLine in enumerate(process.stdout, 1):
+            if not(span is None):
+                span.AddOutputBytes(len(rawLine))
+            line = rawLine.decode("utf-8", errors="replace").rstrip()
+            log.info(outputPrefix + line)
+            if not(outputLineCallback is None):
+                outputLineCallback(line)
+            AddTransientErrorMatch(transientErrors, transientErrorMatcher, line, lineNumber)
+        returnCode = process.wait()
+    if returnCode != 0 or len(transientErrors) > 0:
+        errorMsg = f"Command failed: {terminalCommand}\nReturn code: {returnCode}"
+        if len(transientErrors) > 0:
+            errorMsg += GetTransientErrorMessage(transientErrors)
+        return TerminalCommandError(errorMsg, terminalCommand, returnCode, transientErrors)
+    return None
+
+
+def ExecuteTerminalCommandAndGetOutput(terminalCommand, includeErrorOutput=False, printCommand=False, transientErrorPatterns=None, outputType='bytes', spillToFileAboveBytes=OUTPUT_SPILL_SIZE):
+    """Run a shell command and return its output.
+
+    The output is read in chunks into a single buffer, and the complete
+    lines of each chunk are searched once for all `transientErrorPatterns`.
+    `outputType` selects what is returned: 'bytes', a 'memoryview' over the
+    buffer (no copy), or a binary 'file' positioned at the start, which
+    spills to a temporary file on disk above `spillToFileAboveBytes`.
+    """
+    transientErrorMatcher = GetTransientErrorMatcher(transientErrorPatterns)
     if printCommand:
         log.info(f"Executing: {terminalCommand}")
+    if outputType == 'file':
+        output = tempfile.SpooledTemporaryFile(max_size=spillToFileAboveBytes)
+    elif outputType in ['bytes', 'memoryview']:
+        output = bytearray()
+    else:
+        raise Exception(f"Unknown output type: {outputType}")
     try:
-        with subprocess.Popen(
+        with InstrumentationTools.CommandSpan(terminalCommand) as span, subprocess.Popen(
             terminalCommand,
             shell=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT if includeErrorOutput else subprocess.DEVNULL
         ) as process:
-            outputBytes = b""
-            errorDetected = False
-            for line in process.stdout:
+            transientErrors = []
+            linesScanned = 0
+            partialLine = b""
+            while True:
+                chunk = process.stdout.read1(OUTPUT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if isinstance(output, bytearray):
+                    output += chunk
+                else:
+                    output.write(chunk)
+                span.AddOutputBytes(len(chunk))
+                if not(transientErrorMatcher is None):
+                    data = partialLine + chunk
+                    lastNewLine = data.rfind(b"\n")
+                    if lastNewLine < 0:
+                        if len(data) < OUTPUT_MAX_LINE_SIZE:
+                            partialLine = data
+                            continue
+                        lastNewLine = len(data) - 1
+                    lines = data[:lastNewLine + 1]
+                    partialLine = data[lastNewLine + 1:]
+                    AddTransientErrorMatches(transientErrors, transientErrorMatcher, lines, linesScanned + 1)
+                    linesScanned += lines.count(b"\n")
+            if not(transientErrorMatcher is None) and len(partialLine) > 0:
+                AddTransientErrorMatches(transientErrors, transientErrorMatcher, partialLine, linesScanned + 1)
+            returnCode = process.wait()
+            span.SetResult(returnCode)
+            if returnCode != 0 or len(transientErrors) > 0:
+                errorMsg = f"Command failed with return code {returnCode}"
+                if len(transientErrors) > 0:
+                    errorMsg += GetTransientErrorMessage(transientErrors)
+                raise TerminalCommandError(f"{errorMsg}\n\nOutput:\n{GetErrorOutputText(output)}", terminalCommand, returnCode, transientErrors)
+            if outputType == 'file':
+                output.seek(0)
+                return output
+            if outputType == 'memoryview':
+                return memoryview(output)
+            return bytes(output)
+    except KeyboardInterrupt:
+        raise Exception("Command interrupted by user (KeyboardInterrupt)")
+
+
+def GetOutputText(output):
+    if isinstance(output, bytearray):
+        return output.decode('utf-8', errors='replace')
+    output.seek(0, os.SEEK_END)
+    size = output.tell()
+    output.seek(max(size - OUTPUT_SPILL_SIZE, 0))
+    return output.read().decode('utf-8', errors='replace')
+
+
+def GetErrorOutputText(output):
+    """Returns the last ERROR_OUTPUT_SIZE bytes of a command output, from
+    bytes or a binary file, as text for an error message.
+    """
+    if isinstance(output, (bytes, bytearray)):
+        size = len(output)
+        tail = bytes(output[-ERROR_OUTPUT_SIZE:])
+    else:
+        output.seek(0, os.SEEK_END)
+        size = output.tell()
+        output.seek(max(size - ERROR_OUTPUT_SIZE, 0))
+        tail = output.read()
+    text = tail.decode('utf-8', errors='replace')
+    if size > ERROR_OUTPUT_SIZE:
+        text = f"[{size - ERROR_OUTPUT_SIZE} bytes of output truncated]\n" + text
+    return text
+
+
+def ExecuteTerminalCommandAndWriteOutput(terminalCommand, outputFile, printCommand=False):
+    """Run a shell command and stream its output in chunks to the binary
+    `outputFile`, without holding it in memory. The error output is kept
+    apart and raised with a TerminalCommandError if the command fails.
+    Returns the number of bytes written.
+    """
+    if printCommand:
+        log.info(f"Executing: {terminalCommand}")
+    bytesWritten = 0
+    try:
+        with InstrumentationTools.CommandSpan(terminalCommand) as span, tempfile.TemporaryFile() as errorOutput, subprocess.Popen(
+            terminalCommand,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=errorOutput
+        ) as process:
+            while True:
+                chunk = process.stdout.read1(OUTPUT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                outputFile.write(chunk)
+                bytesWritten += len(chunk)
+            returnCode = process.wait()
+            span.AddOutputBytes(bytesWritten)
+            span.SetResult(returnCode)
+            if returnCode != 0:
+                errorOutput.seek(0)
+                raise TerminalCommandError(f"Command failed with return code {returnCode}\n\nOutput:\n{GetErrorOutputText(errorOutput)}",
+                                           terminalCommand, returnCode)
+    except KeyboardInterrupt:
+        raise Exception("Command interrupted by user (KeyboardInterrupt)")
+    return bytesWritten
+
+
+def ExecuteTerminalCommandWithInput(terminalCommand, inputFile, printCommand=False):
+    """Run a shell command with the binary `inputFile` streamed in chunks to
+    its input, and return its output (including the error output) as text.
+    Raises a TerminalCommandError if the command fails.
+    """
+    if printCommand:
+        log.info(f"Executing: {terminalCommand}")
+    try:
+        with InstrumentationTools.CommandSpan(terminalCommand) as span, tempfile.TemporaryFile() as output, subprocess.Popen(
+            terminalCommand,
+            shell=True,
+            stdin=subprocess.PIPE,
+            stdout=output,
+            stderr=subprocess.STDOUT
+        ) as process:
+            try:
+                for chunk in iter(lambda: inputFile.read(OUTPUT_CHUNK_SIZE), b''):
+                    process.stdin.write(chunk)
+                process.stdin.close()
+            except BrokenPipeError:
                 try:
-                    log.info(line.decode("utf-8", errors="replace"), end="")
-                except Exception:
+                    process.stdin.close()
+                except BrokenPipeError:
                     pass
-                outputBytes += line
-                for pattern in transientErrorPatterns:
-                    if pattern.encode("utf-8") in line.lower():
-                        errorDetected = True
             returnCode = process.wait()
-            if returnCode != 0 or errorDetected:
-                errorMsg = f"Command failed with return code {returnCode}"
-                if errorDetected:
-                    errorMsg += "\nTransient error detected in output."
-                raise Exception(f"{errorMsg}\n\nOutput:\n{outputBytes.decode('utf-8', errors='replace')}")
-            return outputBytes
+            span.AddOutputBytes(output.tell())
+            span.SetResult(returnCode)
+            if returnCode != 0:
+                raise TerminalCommandError(f"Command failed with return code {returnCode}\n\nOutput:\n{GetErrorOutputText(output)}",
+                                           terminalCommand, returnCode)
+            output.seek(0)
+            return GetOutputText(output)
     except KeyboardInterrupt:
         raise Exception("Command interrupted by user (KeyboardInterrupt)")
 
 
+def AddTransientErrorMatch(transientErrors, transientErrorMatcher, line, lineNumber):
+    if transientErrorMatcher is None or len(transientErrors) >= MAX_TRANSIENT_ERROR_MATCHES:
+        return
+    pattern = transientErrorMatcher.MatchLine(line)
+    if not(pattern is None):
+        if not isinstance(line, str):
+            line = line.decode("utf-8", errors="replace")
+        transientErrors.append(TransientErrorMatch(lineNumber, pattern, line.rstrip()))
+
+
+def AddTransientErrorMatches(transientErrors, transientErrorMatcher, lines, firstLineNumber):
+    if len(transientErrors) >= MAX_TRANSIENT_ERROR_MATCHES:
+        return
+    matches = transientErrorMatcher.FindMatches(lines, firstLineNumber)
+    transientErrors.extend(matches[:MAX_TRANSIENT_ERROR_MATCHES - len(transientErrors)])
+
+
+async def ExecuteTerminalCommandsAsync(terminalCommands, raiseExceptionWithErrorCode=False, printCommand=False, transientErrorPatterns=None, outputPrefix='', timeoutInSeconds=None):
+    """Asyncio counterpart of ExecuteTerminalCommands. The output of each
+    command is logged line by line as it arrives. A command running longer
+    than `timeoutInSeconds` is killed and raises an exception, and a
+    cancelled command is killed before the cancellation propagates.
+    """
+    for terminalCommand in terminalCommands:
+        if printCommand:
+            log.info(f"{outputPrefix}Executing: {terminalCommand}")
+        returnCode, transientErrors = await ExecuteTerminalCommandWithLineCallbackAsync(
+            terminalCommand,
+            lambda line: log.info(outputPrefix + line.decode("utf-8", errors="replace").rstrip()),
+            True, transientErrorPatterns, timeoutInSeconds)
+        if returnCode != 0 or len(transientErrors) > 0:
+            errorMsg = f"Command failed: {terminalCommand}\nReturn code: {returnCode}"
+            if len(transientErrors) > 0:
+                errorMsg += GetTransientErrorMessage(transientErrors)
+            if raiseExceptionWithErrorCode:
+                raise TerminalCommandError(errorMsg, terminalCommand, returnCode, transientErrors)
+            else:
+                log.info(errorMsg)
+
+
+async def ExecuteTerminalCommandAndGetOutputAsync(terminalCommand, includeErrorOutput=False, printCommand=False, transientErrorPatterns=None, timeoutInSeconds=None):
+    """Asyncio counterpart of ExecuteTerminalCommandAndGetOutput."""
+    if printCommand:
+        log.info(f"Executing: {terminalCommand}")
+    outputLines = []
+    returnCode, transientErrors = await ExecuteTerminalCommandWithLineCallbackAsync(
+        terminalCommand, outputLines.append, includeErrorOutput, transientErrorPatterns, timeoutInSeconds)
+    output = b"".join(outputLines)
+    if returnCode != 0 or len(transientErrors) > 0:
+        errorMsg = f"Command failed with return code {returnCode}"
+        if len(transientErrors) > 0:
+            errorMsg += GetTransientErrorMessage(transientErrors)
+        raise TerminalCommandError(f"{errorMsg}\n\nOutput:\n{GetErrorOutputText(output)}", terminalCommand, returnCode, transientErrors)
+    return output
+
+
+async def ExecuteTerminalCommandWithLineCallbackAsync(terminalCommand, lineCallback, includeErrorOutput=True, transientErrorPatterns=None, timeoutInSeconds=None):
+    """Run a shell command with asyncio, pass each output line (as bytes) to
+    `lineCallback`, and return the return code together with the matches of
+    `transientErrorPatterns` in the output.
+    """
+    transientErrorMatcher = GetTransientErrorMatcher(transientErrorPatterns)
+    with InstrumentationTools.CommandSpan(terminalCommand) as span:
+        returnCode, transientErrors = await ExecuteTerminalCommandWithSpanAsync(
+            terminalCommand, lineCallback, includeErrorOutput, transientErrorMatcher, timeoutInSeconds, span)
+        span.SetResult(returnCode, failed=returnCode != 0 or len(transientErrors) > 0)
+        return returnCode, transientErrors
+
+
+async def ExecuteTerminalCommandWithSpanAsync(terminalCommand, lineCallback, includeErrorOutput, transientErrorMatcher, timeoutInSeconds, span):
+    process = await asyncio.create_subprocess_shell(
+        terminalCommand,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT if includeErrorOutput else asyncio.subprocess.DEVNULL,
+        limit=ASYNC_STREAM_LIMIT,
+        start_new_session=True
+    )
+
+    async def ReadOutput():
+        transientErrors = []
+        lineNumber = 0
+        async for line in ReadLinesAsync(process.stdout):
+            lineNumber += 1
+            span.AddOutputBytes(len(line))
+            lineCallback(line)
+            AddTransientErrorMatch(transientErrors, transientErrorMatcher, line, lineNumber)
+        returnCode = await process.wait()
+        return returnCode, transientErrors
+
+    try:
+        return await asyncio.wait_for(ReadOutput(), timeoutInSeconds)
+    except asyncio.TimeoutError:
+        raise Exception(f"Command timed out after {timeoutInSeconds} seconds: {terminalCommand}")
+    finally:
+        if process.returncode is None:
+            KillProcessGroup(process)
+            await process.wait()
+
+
+async def ReadLinesAsync(stream):
+    """Yield the lines of an asyncio stream. A line longer than the stream
+    limit is yielded in pieces instead of raising a LimitOverrunError.
+    """
+    while True:
+        try:
+            line = await stream.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            if len(e.partial) > 0:
+                yield e.partial
+            return
+        except asyncio.LimitOverrunError as e:
+            line = await stream.readexactly(e.consumed)
+        yield line
+
+
+async def GatherAsync(coroutines, maxParallel=None):
+    """Await the given coroutines concurrently, with at most `maxParallel`
+    running at the same time, and return their results in order. If one of
+    them fails, the others are cancelled before the exception is raised.
+    """
+    semaphore = asyncio.Semaphore(maxParallel) if maxParallel else None
+
+    async def Run(coroutine):
+        try:
+            if semaphore is None:
+                return await coroutine
+            async with semaphore:
+                return await coroutine
+        finally:
+            coroutine.close()
+
+    tasks = [asyncio.ensure_future(Run(coroutine)) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def ExecuteTerminalCommandsConcurrentlyAsync(terminalCommands, maxParallel=None, raiseExceptionWithErrorCode=True, printCommand=False, transientErrorPatterns=None, timeoutInSeconds=None):
+    await GatherAsync([
+        ExecuteTerminalCommandsAsync([terminalCommand], raiseExceptionWithErrorCode, printCommand, transientErrorPatterns, timeoutInSeconds=timeoutInSeconds)
+        for terminalCommand in terminalCommands], maxParallel)
+
+
+def KillProcessGroup(process):
+    """Kill a process started in its own session together with its children,
+    so a shell command does not leave processes holding its output open."""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
 def GetNumbersFromString(string):
     strNumbers = re.findall(r'\d+', str(string))
     numbers = [int(i) for i in strNumbers]
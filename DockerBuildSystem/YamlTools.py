@@ -1,21 +1,61 @@
 import yaml
 import re
 import os
+import copy
+import hashlib
+import threading
 
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CDumper', yaml.Dumper)
+INTERPOLATION_PATTERN = re.compile(
+    r'\$(?:(?P<escaped>\$)|\{(?P<name>[A-Za-z_][A-Za-z0-9_]*)'
+    r'(?:(?P<operator>:?[-?+])(?P<argument>(?:[^{}]|\{[^{}]*\})*))?\}'
+    r'|(?P<bare>[A-Za-z_][A-Za-z0-9_]*))')
 
-def GetYamlData(yamlFiles, ignoreEmptyYamlData = False, infoMsgOnError = None, replaceEnvironmentVariablesMatches = True):
+MERGE = 'merge'
+REPLACE = 'replace'
+APPEND = 'append'
+MERGE_BY_NAME = 'merge-by-name'
+COMPOSE_MERGE_STRATEGIES = {
+    'services.*.command': REPLACE,
+    'services.*.entrypoint': REPLACE,
+    'services.*.healthcheck.test': REPLACE,
+    'services.*.ports': APPEND,
+    'services.*.expose': APPEND,
+    'services.*.external_links': APPEND,
+    'services.*.dns': APPEND,
+    'services.*.dns_search': APPEND,
+    'services.*.tmpfs': APPEND,
+    'services.*.environment': MERGE_BY_NAME,
+    'services.*.labels': MERGE_BY_NAME,
+    'services.*.volumes': MERGE_BY_NAME,
+    'services.*.devices': MERGE_BY_NAME,
+    'services.*.secrets': MERGE_BY_NAME,
+    'services.*.configs': MERGE_BY_NAME,
+    'services.*.build.args': MERGE_BY_NAME,
+}
+
+_yamlCacheLock = threading.Lock()
+_yamlCache = {}
+_yamlCacheSettings = {'enabled': True}
+_yamlCacheStatistics = {'hits': 0, 'misses': 0}
+
+
+def GetYamlData(yamlFiles, ignoreEmptyYamlData = False, infoMsgOnError = None, replaceEnvironmentVariablesMatches = True,
+                mergeStrategies = None, provenance = None):
+    """Load and merge yaml files, see MergeYamlData for `mergeStrategies`.
+    If a `provenance` dict is given, it is filled with the file each value
+    of the merged data came from.
+    """
     yamlData = {}
     for yamlFile in yamlFiles:
         newYamlData = GetSingleYamlData(yamlFile, ignoreEmptyYamlData, infoMsgOnError, replaceEnvironmentVariablesMatches)
-        yamlData = MergeYamlData(yamlData, newYamlData)
+        yamlData = MergeYamlData(yamlData, newYamlData, mergeStrategies, provenance, yamlFile)
     return yamlData
 
 
 def GetSingleYamlData(yamlFile, ignoreEmptyYamlData = False, infoMsgOnError = None, replaceEnvironmentVariablesMatches = True):
-    yamlStrings = GetYamlString(yamlFile)
-    if replaceEnvironmentVariablesMatches:
-        yamlStrings = ReplaceEnvironmentVariablesMatches(yamlStrings)
-    yamlData = yaml.safe_load(yamlStrings)
+    yamlData = LoadYamlFile(yamlFile, replaceEnvironmentVariablesMatches)
     if yamlData == None:
         if ignoreEmptyYamlData:
             yamlData = {}
@@ -27,37 +67,263 @@ def GetSingleYamlData(yamlFile, ignoreEmptyYamlData = False, infoMsgOnError = No
     return yamlData
 
 
-def MergeYamlData(yamlData1, yamlData2):
+def LoadYamlFile(yamlFile, replaceEnvironmentVariablesMatches = True):
+    """Parse a yaml file with the libyaml loader if available. Parsed files
+    are cached by path, a hash of their content, and the values of the
+    environment variables they reference, and a copy of the cached data is
+    returned as long as none of them change. The content is hashed instead
+    of trusting the modification time, which may not change when a file is
+    rewritten quickly.
+    """
+    yamlString = GetYamlString(yamlFile)
+    if not _yamlCacheSettings['enabled']:
+        return ParseYamlString(yamlString, replaceEnvironmentVariablesMatches)[0]
+    cacheKey = (os.path.abspath(yamlFile), replaceEnvironmentVariablesMatches)
+    fileKey = hashlib.sha256(yamlString.encode('utf-8')).hexdigest()
+    with _yamlCacheLock:
+        cacheEntry = _yamlCache.get(cacheKey)
+        if not(cacheEntry is None) and cacheEntry['fileKey'] == fileKey \
+                and cacheEntry['environment'] == GetEnvironmentValues(cacheEntry['environment']):
+            _yamlCacheStatistics['hits'] += 1
+            return copy.deepcopy(cacheEntry['yamlData'])
+        _yamlCacheStatistics['misses'] += 1
+    yamlData, variableNames = ParseYamlString(yamlString, replaceEnvironmentVariablesMatches)
+    with _yamlCacheLock:
+        _yamlCache[cacheKey] = {'fileKey': fileKey, 'environment': GetEnvironmentValues(variableNames), 'yamlData': yamlData}
+    return copy.deepcopy(yamlData)
+
+
+def ParseYamlString(yamlString, replaceEnvironmentVariablesMatches = True):
+    variableNames = []
+    if replaceEnvironmentVariablesMatches:
+        variableNames = GetEnvironmentVariableNames(yamlString)
+        yamlString = ReplaceEnvironmentVariablesMatches(yamlString)
+    return yaml.load(yamlString, Loader=YAML_LOADER), variableNames
+
+
+def GetEnvironmentValues(variableNames):
+    return {variableName: os.environ.get(variableName) for variableName in variableNames}
+
+
+def EnableYamlCache():
+    _yamlCacheSettings['enabled'] = True
+
+
+def DisableYamlCache():
+    _yamlCacheSettings['enabled'] = False
+    ClearYamlCache()
+
+
+def ClearYamlCache(yamlFile = None):
+    """Clear the cached data of `yamlFile`, or of all files if None."""
+    with _yamlCacheLock:
+        if yamlFile is None:
+            _yamlCache.clear()
+            return
+        for cacheKey in [cacheKey for cacheKey in _yamlCache if cacheKey[0] == os.path.abspath(yamlFile)]:
+            del _yamlCache[cacheKey]
+
+
+def GetYamlCacheStatistics():
+    with _yamlCacheLock:
+        return dict(_yamlCacheStatistics, entries=len(_yamlCache))
+
+
+def MergeYamlData(yamlData1, yamlData2, mergeStrategies = None, provenance = None, source = None):
+    """Merge yamlData2 into yamlData1. By default dicts are merged, lists
+    are appended without duplicates and other values are replaced.
+
+    `mergeStrategies` changes this per key, with a dict of dotted key paths
+    (`*` matches any key) to MERGE, REPLACE, APPEND or MERGE_BY_NAME, which
+    replaces list items with the same name (like the key of `KEY=value` or
+    the target of a volume) and appends the others. COMPOSE_MERGE_STRATEGIES
+    follows the docker compose override rules.
+
+    If a `provenance` dict is given, the `source` of each merged value is
+    recorded in it, keyed by the tuple of keys (and list indexes) leading
+    to the value.
+    """
+    strategies = {}
+    for keyPath, strategy in (mergeStrategies or {}).items():
+        keys = tuple(keyPath.split('.'))
+        strategies.setdefault(len(keys), []).append((keys, strategy))
+    MergeYamlDictionary(yamlData1, yamlData2, (), strategies, provenance, source)
+    return yamlData1
+
+
+def MergeYamlDictionary(yamlData1, yamlData2, keyPath, strategies, provenance, source):
     for key in yamlData2:
-        if key in yamlData1:
-            if isinstance(yamlData1[key], dict) and isinstance(yamlData2[key], dict):
-                MergeYamlData(yamlData1[key], yamlData2[key])
-            elif isinstance(yamlData1[key], list) and isinstance(yamlData2[key], list):
-                for listValue in yamlData2[key]:
-                    if not(listValue in yamlData1[key]):
-                        yamlData1[key].append(listValue)
-            else:
-                yamlData1[key] = yamlData2[key]
+        valueKeyPath = keyPath + (key,)
+        strategy = GetMergeStrategy(valueKeyPath, strategies)
+        value1 = yamlData1.get(key)
+        value2 = yamlData2[key]
+        if key in yamlData1 and strategy != REPLACE:
+            if isinstance(value1, dict) and isinstance(value2, dict):
+                MergeYamlDictionary(value1, value2, valueKeyPath, strategies, provenance, source)
+                continue
+            if isinstance(value1, list) and isinstance(value2, list):
+                if strategy == MERGE_BY_NAME:
+                    MergeYamlListByName(value1, value2, valueKeyPath, provenance, source)
+                else:
+                    MergeYamlList(value1, value2, valueKeyPath, provenance, source)
+                continue
+        if not(provenance is None) and isinstance(value1, (dict, list)):
+            RemoveProvenance(provenance, valueKeyPath)
+        yamlData1[key] = value2
+        RecordProvenance(provenance, valueKeyPath, value2, source)
+
+
+def MergeYamlList(list1, list2, keyPath, provenance, source):
+    existingValues = set(GetCanonicalValue(value) for value in list1)
+    for value in list2:
+        canonicalValue = GetCanonicalValue(value)
+        if canonicalValue in existingValues:
+            continue
+        existingValues.add(canonicalValue)
+        list1.append(value)
+        RecordProvenance(provenance, keyPath + (len(list1) - 1,), value, source)
+
+
+def MergeYamlListByName(list1, list2, keyPath, provenance, source):
+    indexByName = {}
+    for index, value in enumerate(list1):
+        indexByName[GetCanonicalValue(GetMergeName(value))] = index
+    for value in list2:
+        name = GetCanonicalValue(GetMergeName(value))
+        index = indexByName.get(name)
+        if index is None:
+            index = len(list1)
+            indexByName[name] = index
+            list1.append(value)
         else:
-            yamlData1[key] = yamlData2[key]
-    return yamlData1
+            if not(provenance is None) and isinstance(list1[index], (dict, list)):
+                RemoveProvenance(provenance, keyPath + (index,))
+            list1[index] = value
+        RecordProvenance(provenance, keyPath + (index,), value, source)
+
+
+def GetMergeStrategy(keyPath, strategies):
+    for keys, strategy in strategies.get(len(keyPath), []):
+        if all(key == '*' or key == str(pathKey) for key, pathKey in zip(keys, keyPath)):
+            return strategy
+    return MERGE
+
+
+def GetMergeName(value):
+    """Returns the name list items are merged by with MERGE_BY_NAME: the
+    key of `KEY=value` strings, the target of `source:target[:mode]`
+    strings, or the target, source or name of dicts.
+    """
+    if isinstance(value, dict):
+        for key in ['target', 'source', 'name']:
+            if key in value:
+                return value[key]
+        return value
+    if isinstance(value, str):
+        if '=' in value:
+            return value.split('=', 1)[0]
+        if ':' in value:
+            return value.split(':')[1]
+    return value
+
+
+def GetCanonicalValue(value):
+    """Returns a hashable value which is equal for equal yaml values, also
+    for dicts and lists.
+    """
+    if isinstance(value, dict):
+        return ('__dict__', frozenset((key, GetCanonicalValue(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return ('__list__', tuple(GetCanonicalValue(item) for item in value))
+    return value
+
+
+def RecordProvenance(provenance, keyPath, value, source):
+    if provenance is None:
+        return
+    if isinstance(value, dict):
+        for key in value:
+            RecordProvenance(provenance, keyPath + (key,), value[key], source)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            RecordProvenance(provenance, keyPath + (index,), item, source)
+    elif len(keyPath) > 0:
+        provenance[keyPath] = source
+
+
+def RemoveProvenance(provenance, keyPath):
+    for valueKeyPath in [valueKeyPath for valueKeyPath in provenance if valueKeyPath[:len(keyPath)] == keyPath]:
+        del provenance[valueKeyPath]
+
+
+def GetEnvironmentVariableNames(yamlString):
+    variableNames = []
+    for match in INTERPOLATION_PATTERN.finditer(yamlString):
+        name = match.group('name') or match.group('bare')
+        if name is None:
+            continue
+        variableNames.append(name)
+        if not(match.group('argument') is None):
+            variableNames += GetEnvironmentVariableNames(match.group('argument'))
+    return list(dict.fromkeys(variableNames))
 
 
 def ReplaceEnvironmentVariablesMatches(yamlString):
-    pattern = r'\$\{([^}^{]+)\}'
-    matches = re.finditer(pattern, yamlString)
-    for match in matches:
-        envVar = match.group()[2:-1]
-        defaultValue = ''
-        defaultValuePatternMatch = ':-'
-        if envVar.find(defaultValuePatternMatch) >= 0:
-            defaultValue = envVar[envVar.find(defaultValuePatternMatch)+len(defaultValuePatternMatch):]
-            envVar = envVar[:envVar.find(defaultValuePatternMatch)]
-        envValue = os.environ.get(envVar)
-        if envValue == None:
-            envValue = defaultValue
-        yamlString = yamlString.replace(match.group(), envValue)
-    return yamlString
+    """Interpolate a yaml string before it is parsed. `$$` escapes are kept,
+    so the loaded data can be dumped to a compose file again.
+    """
+    return InterpolateString(yamlString, keepEscapes=True)
+
+
+def InterpolateString(value, environment = None, keepEscapes = False):
+    """Replace the environment variables in a string in a single pass, with
+    the compose interpolation grammar:
+        $VAR, ${VAR}    value of VAR, or an empty string if it is not set
+        ${VAR:-default} default if VAR is not set or empty
+        ${VAR-default}  default if VAR is not set
+        ${VAR:?error}   raise an exception with error if VAR is not set or empty
+        ${VAR?error}    raise an exception with error if VAR is not set
+        ${VAR:+other}   other if VAR is set and not empty, else an empty string
+        ${VAR+other}    other if VAR is set, else an empty string
+        $$              a literal $
+    Defaults may contain variables themselves, like ${VAR:-${OTHER_VAR}}.
+    With `keepEscapes`, `$$` is left as it is.
+    """
+    if environment is None:
+        environment = os.environ
+    return INTERPOLATION_PATTERN.sub(lambda match: InterpolateMatch(match, environment, keepEscapes), value)
+
+
+def InterpolateYamlData(yamlData, environment = None):
+    """Returns a copy of parsed yaml data with InterpolateString applied
+    to all string values, but not to keys.
+    """
+    if isinstance(yamlData, dict):
+        return {key: InterpolateYamlData(value, environment) for key, value in yamlData.items()}
+    if isinstance(yamlData, list):
+        return [InterpolateYamlData(value, environment) for value in yamlData]
+    if isinstance(yamlData, str):
+        return InterpolateString(yamlData, environment)
+    return yamlData
+
+
+def InterpolateMatch(match, environment, keepEscapes = False):
+    if not(match.group('escaped') is None):
+        return '$$' if keepEscapes else '$'
+    name = match.group('name') or match.group('bare')
+    operator = match.group('operator')
+    envValue = environment.get(name)
+    if operator is None:
+        return '' if envValue is None else envValue
+    isSet = not(envValue is None) and (not operator.startswith(':') or envValue != '')
+    argument = match.group('argument')
+    if operator.endswith('-'):
+        return envValue if isSet else InterpolateString(argument, environment, keepEscapes)
+    if operator.endswith('+'):
+        return InterpolateString(argument, environment, keepEscapes) if isSet else ''
+    if not isSet:
+        raise Exception("Required environment variable {0} is not set: {1}".format(name, InterpolateString(argument, environment)))
+    return envValue
 
 
 def GetYamlString(yamlFile):
@@ -67,10 +333,11 @@ def GetYamlString(yamlFile):
 
 
 def DumpYamlDataToFile(yamlData, yamlFile):
-    yamlDump = yaml.dump(yamlData)
+    yamlDump = yaml.dump(yamlData, Dumper=YAML_DUMPER)
     CreateFoldersInPath(yamlFile)
     with open(yamlFile, 'w') as f:
         f.write(yamlDump)
+    ClearYamlCache(yamlFile)
 
 
 def CreateFoldersInPath(filename):
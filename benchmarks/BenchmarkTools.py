@@ -0,0 +1,112 @@
+import contextlib
+import statistics
+import tempfile
+import shutil
+import json
+import time
+import sys
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+FAKE_DOCKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'FakeDocker.py')
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+@contextlib.contextmanager
+def FakeDocker(latencyInSeconds = 0.0, outputLines = 1, outputLineSize = 80, failureRate = 0.0):
+    """Put a fake `docker` executable (see FakeDocker.py) first on PATH for
+    the duration of the context.
+    """
+    binFolder = tempfile.mkdtemp(prefix='fake-docker-')
+    dockerExecutable = os.path.join(binFolder, 'docker')
+    with open(dockerExecutable, 'w') as f:
+        f.write('#!/bin/sh\nexec "{0}" "{1}" "$@"\n'.format(sys.executable, FAKE_DOCKER_SCRIPT))
+    os.chmod(dockerExecutable, 0o755)
+    environment = {
+        'PATH': binFolder + os.pathsep + os.environ.get('PATH', ''),
+        'FAKE_DOCKER_LATENCY': str(latencyInSeconds),
+        'FAKE_DOCKER_OUTPUT_LINES': str(outputLines),
+        'FAKE_DOCKER_OUTPUT_LINE_SIZE': str(outputLineSize),
+        'FAKE_DOCKER_FAILURE_RATE': str(failureRate),
+    }
+    previousEnvironment = {key: os.environ.get(key) for key in environment}
+    os.environ.update(environment)
+    try:
+        yield dockerExecutable
+    finally:
+        for key, value in previousEnvironment.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(binFolder, ignore_errors=True)
+
+
+def MeasureBenchmark(name, function, repeat = 5, operations = 1, unit = 'ops', setup = None):
+    """Run `function` `repeat` times and return the median, min and max
+    duration in seconds, and the throughput of `operations` per run in
+    `unit` per second. `setup` is called before each run, untimed.
+    """
+    durations = []
+    for _ in range(repeat):
+        if not(setup is None):
+            setup()
+        startTime = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - startTime)
+    median = statistics.median(durations)
+    result = {
+        'seconds': median,
+        'minSeconds': min(durations),
+        'maxSeconds': max(durations),
+        'throughput': operations / median if median > 0 else 0.0,
+        'unit': unit,
+        'repeat': repeat,
+    }
+    log.info("{0}: {1:.4f}s median, {2:.1f} {3}/s".format(name, median, result['throughput'], unit))
+    return result
+
+
+def LoadBaseline(baselineFile = DEFAULT_BASELINE_FILE):
+    if not os.path.isfile(baselineFile):
+        return None
+    with open(baselineFile, 'r') as f:
+        return json.load(f)
+
+
+def SaveBaseline(results, baselineFile = DEFAULT_BASELINE_FILE):
+    tmpFile = baselineFile + '.tmp'
+    with open(tmpFile, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    os.replace(tmpFile, baselineFile)
+
+
+def CompareWithBaseline(results, baseline, tolerance = 0.25):
+    """Returns the benchmarks whose median duration is more than `tolerance`
+    (a fraction) slower than in the baseline, as a dict with the baseline
+    and current duration and the relative change of each.
+    """
+    regressions = {}
+    for name, result in results.items():
+        if not(name in baseline):
+            continue
+        baselineSeconds = baseline[name]['seconds']
+        if baselineSeconds > 0 and result['seconds'] > baselineSeconds * (1.0 + tolerance):
+            regressions[name] = {
+                'baselineSeconds': baselineSeconds,
+                'seconds': result['seconds'],
+                'change': result['seconds'] / baselineSeconds - 1.0,
+            }
+    return regressions
+
+
+def PrintBenchmarkResults(results, baseline = None):
+    log.info("{0:<45} {1:>10} {2:>16} {3:>9}".format('benchmark', 'median', 'throughput', 'change'))
+    for name, result in results.items():
+        change = ''
+        if not(baseline is None) and name in baseline and baseline[name]['seconds'] > 0:
+            change = '{0:+.0%}'.format(result['seconds'] / baseline[name]['seconds'] - 1.0)
+        log.info("{0:<45} {1:>9.4f}s {2:>10.1f} {3:<5} {4:>9}".format(
+            name, result['seconds'], result['throughput'], result['unit'] + '/s', change))
@@ -0,0 +1,52 @@
+"""Fake docker executable for the benchmarks. Every call sleeps for
+FAKE_DOCKER_LATENCY seconds, writes FAKE_DOCKER_OUTPUT_LINES lines of
+FAKE_DOCKER_OUTPUT_LINE_SIZE characters, and fails with a transient registry
+error with probability FAKE_DOCKER_FAILURE_RATE. `inspect` and `images`
+answer with fake image info.
+"""
+import hashlib
+import random
+import json
+import time
+import sys
+import os
+
+
+def GetImageId(name):
+    return 'sha256:' + hashlib.sha256(name.encode('utf-8')).hexdigest()
+
+
+def GetImageInfo(name):
+    repo = name.rsplit(':', 1)[0] if name.rfind(':') > name.rfind('/') else name
+    return {
+        'Id': GetImageId(name),
+        'RepoTags': [name],
+        'RepoDigests': [repo + '@' + GetImageId(repo)],
+        'Config': {'Labels': {}},
+        'State': {'ExitCode': 0, 'Running': False},
+    }
+
+
+def Main(args):
+    time.sleep(float(os.environ.get('FAKE_DOCKER_LATENCY', '0')))
+    if random.random() < float(os.environ.get('FAKE_DOCKER_FAILURE_RATE', '0')):
+        sys.stderr.write('error: net/http: TLS handshake timeout\n')
+        return 1
+
+    words = [arg for arg in args if not arg.startswith('-')]
+    command = words[0] if len(words) > 0 else ''
+    if command == 'inspect':
+        sys.stdout.write(json.dumps([GetImageInfo(name) for name in words[1:]]))
+        return 0
+    if command == 'images':
+        sys.stdout.write('\n'.join([GetImageId(str(i)) for i in range(10)]) + '\n')
+        return 0
+
+    outputLines = int(os.environ.get('FAKE_DOCKER_OUTPUT_LINES', '1'))
+    outputLine = 'x' * int(os.environ.get('FAKE_DOCKER_OUTPUT_LINE_SIZE', '80')) + '\n'
+    sys.stdout.write(outputLine * outputLines)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,158 @@
+"""Benchmarks of the pipeline helpers, run against a fake docker executable:
+
+    python -m benchmarks.RunBenchmarks [--update-baseline] [--tolerance 0.25]
+
+The results are compared with benchmarks/baseline.json, which is written on
+the first run (or with --update-baseline), and the run fails if a benchmark
+is slower than the baseline by more than the tolerance.
+The baseline is machine specific and is therefore not committed.
+"""
+import argparse
+import tempfile
+import shutil
+import copy
+import sys
+import os
+import logging
+from benchmarks import BenchmarkTools
+from DockerBuildSystem import TerminalTools, YamlTools, DockerComposeTools
+
+log = logging.getLogger(__name__)
+
+SERVICE_COUNT = 500
+PUBLISH_SERVICE_COUNT = 50
+ENVIRONMENT_VARIABLE_COUNT = 20
+
+
+def GenerateComposeFiles(outputFolder, serviceCount = SERVICE_COUNT):
+    """Write a synthetic compose file with `serviceCount` services, and an
+    override file changing their environment, volumes and ports.
+    """
+    services = {}
+    overrideServices = {}
+    for i in range(serviceCount):
+        service = 'service-{0}'.format(i)
+        services[service] = {
+            'image': '${REPO:-my_repo/}' + service + ':${VERSION:-1.0.0}',
+            'build': {'context': '.', 'dockerfile': 'Dockerfile', 'args': ['INDEX={0}'.format(i)]},
+            'environment': ['VARIABLE_{0}=${{VARIABLE_{0}:-default_{0}}}'.format(j) for j in range(ENVIRONMENT_VARIABLE_COUNT)],
+            'ports': ['{0}:80'.format(8000 + i)],
+            'volumes': ['data-{0}:/data'.format(i), './config:/config:ro'],
+            'networks': ['backend_network'],
+            'depends_on': ['service-{0}'.format(i - 1)] if i > 0 else [],
+        }
+        overrideServices[service] = {
+            'environment': ['VARIABLE_{0}=override'.format(j) for j in range(0, ENVIRONMENT_VARIABLE_COUNT, 2)],
+            'volumes': ['other-data-{0}:/data'.format(i), './logs:/logs'],
+            'ports': ['{0}:80'.format(8000 + i), '{0}:443'.format(9000 + i)],
+            'networks': ['backend_network', 'frontend_network'],
+        }
+    composeFile = os.path.join(outputFolder, 'docker-compose.{0}.yml'.format(serviceCount))
+    overrideFile = os.path.join(outputFolder, 'docker-compose.{0}.override.yml'.format(serviceCount))
+    YamlTools.DumpYamlDataToFile({'services': services, 'networks': {'backend_network': None}}, composeFile)
+    YamlTools.DumpYamlDataToFile({'services': overrideServices, 'networks': {'frontend_network': None}}, overrideFile)
+    return composeFile, overrideFile
+
+
+def RunBenchmarks(outputFolder, repeat = 5):
+    results = {}
+    composeFile, overrideFile = GenerateComposeFiles(outputFolder)
+    publishComposeFile, _ = GenerateComposeFiles(outputFolder, PUBLISH_SERVICE_COUNT)
+
+    with BenchmarkTools.FakeDocker():
+        commands = ['docker push my_repo/my.service:1.0.0'] * 50
+        results['ExecuteTerminalCommands 50 commands'] = BenchmarkTools.MeasureBenchmark(
+            'ExecuteTerminalCommands 50 commands', lambda: TerminalTools.ExecuteTerminalCommands(commands, True),
+            repeat, len(commands), 'commands')
+
+    with BenchmarkTools.FakeDocker(failureRate=0.2):
+        retryPolicy = TerminalTools.RetryPolicy(maxAttempts=20, initialDelayInSeconds=0.0, jitterFraction=0.0, retryOnErrorCode=True)
+        results['ExecuteTerminalCommands 50 commands 20% failures'] = BenchmarkTools.MeasureBenchmark(
+            'ExecuteTerminalCommands 50 commands 20% failures',
+            lambda: TerminalTools.ExecuteTerminalCommands(commands, True, retryPolicy=retryPolicy),
+            repeat, len(commands), 'commands')
+
+    outputLines = 100000
+    outputLineSize = 100
+    outputMegabytes = outputLines * (outputLineSize + 1) / 1e6
+    with BenchmarkTools.FakeDocker(outputLines=outputLines, outputLineSize=outputLineSize):
+        results['ExecuteTerminalCommands 10MB output'] = BenchmarkTools.MeasureBenchmark(
+            'ExecuteTerminalCommands 10MB output', lambda: TerminalTools.ExecuteTerminalCommands(['docker build .'], True),
+            repeat, outputMegabytes, 'MB')
+        results['ExecuteTerminalCommandAndGetOutput 10MB output'] = BenchmarkTools.MeasureBenchmark(
+            'ExecuteTerminalCommandAndGetOutput 10MB output', lambda: TerminalTools.ExecuteTerminalCommandAndGetOutput('docker build .'),
+            repeat, outputMegabytes, 'MB')
+
+    results['GetYamlData 500 services'] = BenchmarkTools.MeasureBenchmark(
+        'GetYamlData 500 services', lambda: YamlTools.GetYamlData([composeFile, overrideFile]),
+        repeat, SERVICE_COUNT, 'services', setup=YamlTools.ClearYamlCache)
+    results['GetYamlData 500 services cached'] = BenchmarkTools.MeasureBenchmark(
+        'GetYamlData 500 services cached', lambda: YamlTools.GetYamlData([composeFile, overrideFile]),
+        repeat, SERVICE_COUNT, 'services')
+
+    yamlData = YamlTools.GetYamlData([composeFile])
+    overrideYamlData = YamlTools.GetYamlData([overrideFile])
+    mergeInputs = []
+    setupMerge = lambda: mergeInputs.insert(0, (copy.deepcopy(yamlData), copy.deepcopy(overrideYamlData)))
+    results['MergeYamlData 500 services'] = BenchmarkTools.MeasureBenchmark(
+        'MergeYamlData 500 services', lambda: YamlTools.MergeYamlData(*mergeInputs[0]),
+        repeat, SERVICE_COUNT, 'services', setup=setupMerge)
+    results['MergeYamlData 500 services compose rules'] = BenchmarkTools.MeasureBenchmark(
+        'MergeYamlData 500 services compose rules',
+        lambda: YamlTools.MergeYamlData(*mergeInputs[0], mergeStrategies=YamlTools.COMPOSE_MERGE_STRATEGIES),
+        repeat, SERVICE_COUNT, 'services', setup=setupMerge)
+
+    yamlString = YamlTools.GetYamlString(composeFile)
+    variableCount = yamlString.count('${')
+    results['ReplaceEnvironmentVariablesMatches 500 services'] = BenchmarkTools.MeasureBenchmark(
+        'ReplaceEnvironmentVariablesMatches 500 services', lambda: YamlTools.ReplaceEnvironmentVariablesMatches(yamlString),
+        repeat, variableCount, 'variables')
+
+    tags = ['1.0.1', 'latest']
+    pushCount = PUBLISH_SERVICE_COUNT * len(tags)
+    with BenchmarkTools.FakeDocker(latencyInSeconds=0.01, outputLines=20):
+        results['PublishDockerImagesWithNewTags 50 services'] = BenchmarkTools.MeasureBenchmark(
+            'PublishDockerImagesWithNewTags 50 services',
+            lambda: DockerComposeTools.PublishDockerImagesWithNewTags(publishComposeFile, tags, maxParallel=8),
+            repeat, pushCount, 'pushes')
+        results['PromoteDockerImages 50 services'] = BenchmarkTools.MeasureBenchmark(
+            'PromoteDockerImages 50 services',
+            lambda: DockerComposeTools.PromoteDockerImages(publishComposeFile, tags, 'my_repo/', 'other_repo/', maxParallel=8),
+            repeat, pushCount, 'pushes')
+        results['PromoteDockerImages 50 services registry-side'] = BenchmarkTools.MeasureBenchmark(
+            'PromoteDockerImages 50 services registry-side',
+            lambda: DockerComposeTools.PromoteDockerImages(publishComposeFile, tags, 'my_repo/', 'other_repo/', maxParallel=8, registrySideCopy=True),
+            repeat, pushCount, 'pushes')
+    return results
+
+
+def Main(args):
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline helpers against a fake docker executable.')
+    parser.add_argument('--baseline', default=BenchmarkTools.DEFAULT_BASELINE_FILE, help='Baseline results file.')
+    parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown against the baseline, as a fraction.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each benchmark, the median is reported.')
+    options = parser.parse_args(args)
+
+    logging.getLogger('DockerBuildSystem').setLevel(logging.WARNING)
+    outputFolder = tempfile.mkdtemp(prefix='benchmarks-')
+    try:
+        results = RunBenchmarks(outputFolder, options.repeat)
+    finally:
+        shutil.rmtree(outputFolder, ignore_errors=True)
+
+    baseline = BenchmarkTools.LoadBaseline(options.baseline)
+    BenchmarkTools.PrintBenchmarkResults(results, baseline)
+    if baseline is None or options.update_baseline:
+        BenchmarkTools.SaveBaseline(results, options.baseline)
+        log.info("Stored the results as baseline in {0}".format(options.baseline))
+        return 0
+    regressions = BenchmarkTools.CompareWithBaseline(results, baseline, options.tolerance)
+    for name, regression in regressions.items():
+        log.info("Regression in {0}: {1:.4f}s -> {2:.4f}s ({3:+.0%})".format(
+            name, regression['baselineSeconds'], regression['seconds'], regression['change']))
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(Main(sys.argv[1:]))
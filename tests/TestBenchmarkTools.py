@@ -0,0 +1,37 @@
+import unittest
+import shutil
+import logging
+from benchmarks import BenchmarkTools
+from DockerBuildSystem import TerminalTools
+
+log = logging.getLogger(__name__)
+
+class TestBenchmarkTools(unittest.TestCase):
+
+    def test_FakeDocker(self):
+        with BenchmarkTools.FakeDocker(outputLines=3, outputLineSize=10) as dockerExecutable:
+            self.assertEqual(shutil.which('docker'), dockerExecutable)
+            output = TerminalTools.ExecuteTerminalCommandAndGetOutput('docker build .')
+            self.assertEqual(output.decode('utf-8'), ('x' * 10 + '\n') * 3)
+        self.assertNotEqual(shutil.which('docker'), dockerExecutable)
+
+
+    def test_MeasureBenchmark(self):
+        calls = []
+        result = BenchmarkTools.MeasureBenchmark('test', lambda: calls.append(1), repeat=3, operations=10, setup=lambda: calls.append(0))
+        self.assertEqual(calls, [0, 1, 0, 1, 0, 1])
+        self.assertLessEqual(result['minSeconds'], result['seconds'])
+        self.assertLessEqual(result['seconds'], result['maxSeconds'])
+        self.assertEqual(result['unit'], 'ops')
+
+
+    def test_CompareWithBaseline(self):
+        baseline = {'fast': {'seconds': 1.0}, 'slow': {'seconds': 1.0}}
+        results = {'fast': {'seconds': 1.2}, 'slow': {'seconds': 1.5}, 'new': {'seconds': 9.0}}
+        regressions = BenchmarkTools.CompareWithBaseline(results, baseline, tolerance=0.25)
+        self.assertEqual(list(regressions.keys()), ['slow'])
+        self.assertAlmostEqual(regressions['slow']['change'], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
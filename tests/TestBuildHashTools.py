@@ -0,0 +1,66 @@
+import unittest
+import os
+import shutil
+import logging
+from tests import TestTools
+from DockerBuildSystem import BuildHashTools
+
+log = logging.getLogger(__name__)
+
+class TestBuildHashTools(unittest.TestCase):
+
+    def setUp(self):
+        self.context = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output', 'hashContext')
+        shutil.rmtree(self.context, ignore_errors=True)
+        for relativePath in ['Dockerfile', 'src/app.py', 'src/app.pyc', 'logs/build.log', 'logs/keep.log']:
+            self.WriteFile(relativePath, relativePath)
+        self.WriteFile('.dockerignore', '# comment\n**/*.pyc\nlogs\n!logs/keep.log\n')
+        self.dockerfile = os.path.join(self.context, 'Dockerfile')
+
+    def tearDown(self):
+        shutil.rmtree(self.context, ignore_errors=True)
+
+    def WriteFile(self, relativePath, content):
+        filePath = os.path.join(self.context, relativePath)
+        os.makedirs(os.path.dirname(filePath), exist_ok=True)
+        with open(filePath, 'w') as f:
+            f.write(content)
+
+    def test_a_IsPathIgnored(self):
+        ignorePatterns = BuildHashTools.GetDockerignorePatterns(self.context, self.dockerfile)
+        self.assertTrue(BuildHashTools.IsPathIgnored('src/app.pyc', ignorePatterns))
+        self.assertTrue(BuildHashTools.IsPathIgnored('logs/build.log', ignorePatterns))
+        self.assertFalse(BuildHashTools.IsPathIgnored('logs/keep.log', ignorePatterns))
+        self.assertFalse(BuildHashTools.IsPathIgnored('src/app.py', ignorePatterns))
+
+    def test_b_GetServiceContentHash(self):
+        contentHash = BuildHashTools.GetServiceContentHash(self.context, self.dockerfile, ['VERSION=1'])
+        self.assertTrue(contentHash.startswith('sha256:'))
+        self.assertEqual(contentHash, BuildHashTools.GetServiceContentHash(self.context, self.dockerfile, {'VERSION': 1}))
+
+        self.WriteFile('src/app.pyc', 'ignored change')
+        self.WriteFile('logs/build.log', 'ignored change')
+        self.assertEqual(contentHash, BuildHashTools.GetServiceContentHash(self.context, self.dockerfile, ['VERSION=1']))
+        self.assertNotEqual(contentHash, BuildHashTools.GetServiceContentHash(self.context, self.dockerfile, ['VERSION=2']))
+
+        self.WriteFile('logs/keep.log', 'included change')
+        self.assertNotEqual(contentHash, BuildHashTools.GetServiceContentHash(self.context, self.dockerfile, ['VERSION=1']))
+
+    def test_c_SaveAndLoadBuildIndex(self):
+        indexFile = os.path.join(self.context, 'index.json')
+        self.assertEqual(BuildHashTools.LoadBuildIndex(indexFile), {})
+        BuildHashTools.SaveBuildIndex({'my_repo/my.service': 'sha256:abc'}, indexFile)
+        self.assertEqual(BuildHashTools.LoadBuildIndex(indexFile), {'my_repo/my.service': 'sha256:abc'})
+        self.assertFalse(BuildHashTools.IsImageUpToDate('my_repo/my.service', 'sha256:def', {'my_repo/my.service': 'sha256:abc'}))
+
+    def test_d_GetServiceContentHashOfPlatformsAndDependencies(self):
+        contentHash = BuildHashTools.GetServiceContentHash(self.context, self.dockerfile, platforms=['linux/amd64'])
+        self.assertEqual(contentHash, BuildHashTools.GetServiceContentHash(self.context, self.dockerfile, platforms=['linux/amd64', 'linux/amd64']))
+        self.assertNotEqual(contentHash, BuildHashTools.GetServiceContentHash(self.context, self.dockerfile, platforms=['linux/arm64']))
+        self.assertNotEqual(contentHash, BuildHashTools.GetServiceContentHash(self.context, self.dockerfile))
+        self.assertNotEqual(BuildHashTools.GetServiceContentHash(self.context, self.dockerfile, dependencyHashes=['sha256:abc']),
+                            BuildHashTools.GetServiceContentHash(self.context, self.dockerfile, dependencyHashes=['sha256:def']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import random
+import logging
+from DockerBuildSystem import BuildxTools
+
+log = logging.getLogger(__name__)
+
+TEST_BUILDER_NAME = 'test-builder-' + str(random.randint(0, 100000))
+
+class TestBuildxTools(unittest.TestCase):
+
+    def test_a_EnsureBuilder(self):
+        log.info('ENSURE BUILDER')
+        self.assertFalse(BuildxTools.BuilderExists(TEST_BUILDER_NAME))
+        BuildxTools.EnsureBuilder(TEST_BUILDER_NAME)
+        self.assertTrue(BuildxTools.BuilderExists(TEST_BUILDER_NAME))
+        BuildxTools.EnsureBuilder(TEST_BUILDER_NAME)
+        log.info('DONE ENSURE BUILDER')
+
+    def test_b_PruneBuilder(self):
+        log.info('PRUNE BUILDER')
+        BuildxTools.PruneBuilder(TEST_BUILDER_NAME, pruneAll=True)
+        log.info('DONE PRUNE BUILDER')
+
+    def test_c_RemoveBuilder(self):
+        log.info('REMOVE BUILDER')
+        BuildxTools.RemoveBuilder(TEST_BUILDER_NAME)
+        self.assertFalse(BuildxTools.BuilderExists(TEST_BUILDER_NAME))
+        log.info('DONE REMOVE BUILDER')
+
+    def test_d_GetCacheCommand(self):
+        log.info('GET CACHE COMMAND')
+        cacheFrom = [BuildxTools.RegistryCache('my_repo/my.service:cache', mode='max'),
+                     BuildxTools.LocalCache('/tmp/cache'), BuildxTools.InlineCache(), 'my_repo/my.service:latest']
+        cacheTo = [BuildxTools.RegistryCache('my_repo/my.service:cache', mode='max'),
+                   BuildxTools.LocalCache('/tmp/cache'), BuildxTools.InlineCache(), BuildxTools.GhaCache('my.service')]
+        cacheCommand = BuildxTools.GetCacheCommand(cacheFrom, cacheTo)
+        self.assertEqual(cacheCommand,
+                         ' --cache-from type=registry,ref=my_repo/my.service:cache'
+                         ' --cache-from type=local,src=/tmp/cache'
+                         ' --cache-from my_repo/my.service:latest'
+                         ' --cache-to type=registry,ref=my_repo/my.service:cache,mode=max'
+                         ' --cache-to type=local,dest=/tmp/cache'
+                         ' --cache-to type=inline'
+                         ' --cache-to type=gha,scope=my.service')
+        self.assertEqual(BuildxTools.GetCacheCommand(), '')
+        log.info('DONE GET CACHE COMMAND')
+
+    def test_e_ParseBuildCacheStatistics(self):
+        log.info('PARSE BUILD CACHE STATISTICS')
+        outputLines = [
+            '#1 [internal] load build definition from Dockerfile',
+            '#1 DONE 0.0s',
+            '#2 [internal] load .dockerignore',
+            '#2 CACHED',
+            '#3 [auth] library/alpine:pull token for registry-1.docker.io',
+            '#5 [1/3] FROM docker.io/library/alpine',
+            '#6 [2/3] COPY . /app',
+            '#6 CACHED',
+            '#7 [3/3] RUN make',
+            '#7 0.512 make: Nothing to be done.',
+            '#7 DONE 0.6s',
+        ]
+        cacheStatistics = BuildxTools.ParseBuildCacheStatistics(outputLines)
+        self.assertEqual(cacheStatistics['steps'], 3)
+        self.assertEqual(cacheStatistics['cached'], 1)
+        self.assertAlmostEqual(cacheStatistics['hitRate'], 1.0 / 3)
+        multiPlatformOutputLines = [
+            '#1 [internal] load build definition from Dockerfile',
+            '#2 [linux/arm64 internal] load metadata for docker.io/library/alpine:latest',
+            '#3 [linux/amd64 internal] load metadata for docker.io/library/alpine:latest',
+            '#4 [linux/amd64 auth] library/alpine:pull token for registry-1.docker.io',
+            '#5 [linux/amd64 1/2] FROM docker.io/library/alpine',
+            '#5 CACHED',
+            '#6 [linux/arm64 1/2] FROM docker.io/library/alpine',
+            '#6 CACHED',
+            '#7 [linux/amd64 2/2] COPY . /app',
+            '#7 CACHED',
+            '#8 [linux/arm64 2/2] COPY . /app',
+            '#8 CACHED',
+        ]
+        cacheStatistics = BuildxTools.ParseBuildCacheStatistics(multiPlatformOutputLines)
+        self.assertEqual(cacheStatistics['steps'], 4)
+        self.assertEqual(cacheStatistics['hitRate'], 1.0)
+        log.info('DONE PARSE BUILD CACHE STATISTICS')
+
+
+if __name__ == '__main__':
+    unittest.main()
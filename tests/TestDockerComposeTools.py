@@ -4,6 +4,7 @@ import os
 import logging
 from tests import TestTools
 from DockerBuildSystem import DockerComposeTools, YamlTools, DockerImageTools, TerminalTools
+from benchmarks import BenchmarkTools
 
 log = logging.getLogger(__name__)
 
@@ -43,6 +44,18 @@ class TestDockerComposeTools(unittest.TestCase):
         TerminalTools.LoadEnvironmentVariables(os.path.join(TestTools.TEST_SAMPLE_FOLDER, '.env'))
         DockerComposeTools.SaveImages(os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.yml'), folder)
         self.assertTrue(os.path.isfile(os.path.join(folder, 'my.service-1.0.0.tar')))
+        results = DockerComposeTools.SaveImages(os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.yml'), folder,
+                                                maxParallel=2, compression='gzip', combinedArchiveName='images')
+        self.assertTrue(os.path.isfile(os.path.join(folder, 'images.tar.gz')))
+        self.assertTrue(os.path.isfile(os.path.join(folder, 'images.tar.gz.manifest.json')))
+        self.assertFalse(results[os.path.join(folder, 'images.tar.gz')]['skipped'])
+        results = DockerComposeTools.SaveImages(os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.yml'), folder,
+                                                compression='gzip', combinedArchiveName='images')
+        self.assertTrue(results[os.path.join(folder, 'images.tar.gz')]['skipped'])
+        results = DockerComposeTools.LoadImages(os.path.join(folder, 'images.tar.gz'))
+        self.assertTrue(results[os.path.join(folder, 'images.tar.gz')]['skipped'])
+        results = DockerComposeTools.LoadImages(os.path.join(folder, 'images.tar.gz'), skipExisting=False)
+        self.assertFalse(results[os.path.join(folder, 'images.tar.gz')]['skipped'])
         log.info('DONE COMPOSE SAVE')
 
     def test_f_ComposeTest(self):
@@ -81,6 +94,165 @@ class TestDockerComposeTools(unittest.TestCase):
         DockerComposeTools.MultiBuildDockerImages(os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.test.publish.yml'), ['linux/amd64', 'linux/arm64'], ['tag2', 'tag3'])
         log.info('DONE COMPOSE MULTI BUILD')
 
+    def test_j_MultiBuildImagesInParallel(self):
+        log.info('COMPOSE PARALLEL MULTI BUILD')
+        TerminalTools.LoadEnvironmentVariables(os.path.join(TestTools.TEST_SAMPLE_FOLDER, '.env'))
+        DockerComposeTools.MergeComposeFiles([os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.yml')], os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.test.publish.yml'))
+        DockerComposeTools.MultiBuildDockerImages(os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.test.publish.yml'), ['linux/amd64'], maxParallel=4)
+        log.info('DONE COMPOSE PARALLEL MULTI BUILD')
+
+    def test_j_MultiBuildImagesSequentially(self):
+        log.info('COMPOSE SEQUENTIAL MULTI BUILD')
+        TerminalTools.LoadEnvironmentVariables(os.path.join(TestTools.TEST_SAMPLE_FOLDER, '.env'))
+        with BenchmarkTools.FakeDocker():
+            results = DockerComposeTools.MultiBuildDockerImages(os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.yml'), ['linux/amd64'], maxParallel=None)
+        self.assertTrue('my-service' in results)
+        log.info('DONE COMPOSE SEQUENTIAL MULTI BUILD')
+
+    def test_k_PublishDockerImagesWithNewTags(self):
+        log.info('COMPOSE PUBLISH WITH NEW TAGS')
+        TerminalTools.LoadEnvironmentVariables(os.path.join(TestTools.TEST_SAMPLE_FOLDER, '.env'))
+        composeFile = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.yml')
+        DockerComposeTools.PublishDockerImagesWithNewTags(composeFile, ['1.0.1', 'latest'], 'my_repo/', 'other_repo/', dryRun=True)
+        self.assertEqual('other_repo/my.service:latest', DockerComposeTools.GetPublishTargetImage('my_repo/my.service:1.0.0', 'latest', 'my_repo/', 'other_repo/'))
+        DockerComposeTools.PromoteDockerImages(composeFile, ['1.0.1', 'latest'], dryRun=True, maxParallel=4, pushRetries=2)
+        with self.assertRaises(Exception):
+            DockerComposeTools.PublishDockerImagesWithNewTags(composeFile, ['latest'], pushRetries=2, retryPolicy=TerminalTools.RetryPolicy())
+        log.info('DONE COMPOSE PUBLISH WITH NEW TAGS')
+
+    def test_l_PromoteDockerImagesOnRegistry(self):
+        log.info('COMPOSE PROMOTE ON REGISTRY')
+        TerminalTools.LoadEnvironmentVariables(os.path.join(TestTools.TEST_SAMPLE_FOLDER, '.env'))
+        composeFile = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.yml')
+        DockerComposeTools.PromoteDockerImages(composeFile, ['1.0.1', 'latest'], 'my_repo/', 'other_repo/', dryRun=True, registrySideCopy=True)
+        log.info('DONE COMPOSE PROMOTE ON REGISTRY')
+
+    def test_m_GetServiceBuildDependencies(self):
+        log.info('COMPOSE BUILD DEPENDENCIES')
+        outputFolder = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output', 'buildDependencies')
+        os.makedirs(outputFolder, exist_ok=True)
+        with open(os.path.join(outputFolder, 'Dockerfile.app'), 'w') as f:
+            f.write('ARG BASE_TAG=latest\nFROM my_repo/base:${BASE_TAG} AS build\nFROM build\n')
+        with open(os.path.join(outputFolder, 'Dockerfile.base'), 'w') as f:
+            f.write('FROM python:3-slim\n')
+        dockerComposeMap = {'services': {
+            'app': {'image': 'my_repo/app:1.0.0', 'build': {'context': outputFolder, 'dockerfile': 'Dockerfile.app'}},
+            'base': {'image': 'my_repo/base:1.0.0', 'build': {'context': outputFolder, 'dockerfile': 'Dockerfile.base'}},
+            'tests': {'image': 'my_repo/tests:1.0.0', 'build': {'context': outputFolder, 'dockerfile': 'Dockerfile.base'}, 'depends_on': ['app', 'db']},
+            'db': {'image': 'postgres'},
+        }}
+        dependencies = DockerComposeTools.GetServiceBuildDependencies(dockerComposeMap, ['latest'])
+        self.assertEqual(dependencies, {'app': ['base'], 'base': [], 'tests': ['app']})
+        log.info('DONE COMPOSE BUILD DEPENDENCIES')
+
+    def test_n_MergeComposeFilesInProcess(self):
+        log.info('COMPOSE MERGE IN PROCESS')
+        outputFolder = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output', 'mergeCompose')
+        os.makedirs(outputFolder, exist_ok=True)
+        with open(os.path.join(outputFolder, 'docker-compose.yml'), 'w') as f:
+            f.write('version: "3"\nservices:\n  my-service:\n    image: my_repo/my.service:${TEST_MERGE_TAG:-latest}\n'
+                    '    build: ./src\n    environment:\n      - KEY_1=value\n      - KEY_2=value\n    volumes:\n      - ./data:/data\n')
+        with open(os.path.join(outputFolder, 'docker-compose.override.yml'), 'w') as f:
+            f.write('services:\n  my-service:\n    build:\n      dockerfile: Dockerfile.dev\n    environment:\n      KEY_2: $${escaped}\n'
+                    '    env_file:\n      - ./a.env\n      - path: ./b.env\n        required: false\n'
+                    'secrets:\n  my-secret:\n    file: ./secret.txt\nconfigs:\n  my-config:\n    file: ./config.txt\n')
+        composeFiles = [os.path.join(outputFolder, 'docker-compose.yml'), os.path.join(outputFolder, 'docker-compose.override.yml')]
+        mergedComposeFile = os.path.join(outputFolder, 'docker-compose.merged.yml')
+        DockerComposeTools.MergeComposeFiles(composeFiles, mergedComposeFile)
+        yamlData = YamlTools.GetYamlData([mergedComposeFile])
+        service = yamlData['services']['my-service']
+        self.assertFalse('version' in yamlData)
+        self.assertEqual(service['image'], 'my_repo/my.service:latest')
+        self.assertEqual(service['build'], {'context': os.path.abspath(os.path.join(outputFolder, 'src')), 'dockerfile': 'Dockerfile.dev'})
+        self.assertEqual(service['environment'], {'KEY_1': 'value', 'KEY_2': '$${escaped}'})
+        self.assertEqual(service['volumes'], [os.path.abspath(os.path.join(outputFolder, 'data')) + ':/data'])
+        self.assertEqual(service['env_file'], [os.path.abspath(os.path.join(outputFolder, 'a.env')),
+                                               {'path': os.path.abspath(os.path.join(outputFolder, 'b.env')), 'required': False}])
+        self.assertEqual(yamlData['secrets']['my-secret']['file'], os.path.abspath(os.path.join(outputFolder, 'secret.txt')))
+        self.assertEqual(yamlData['configs']['my-config']['file'], os.path.abspath(os.path.join(outputFolder, 'config.txt')))
+        log.info('DONE COMPOSE MERGE IN PROCESS')
+
+    def test_o_PrepareComposeTestSuite(self):
+        log.info('COMPOSE PREPARE TEST SUITE')
+        yamlData = {
+            'services': {'my-service': {'container_name': 'my-service'}, 'nginx-service': {}},
+            'networks': {'backend_network': None, 'named_network': {'name': 'named'}, 'shared_network': {'name': 'shared', 'external': True}},
+            'volumes': {'data': {'name': 'data'}},
+        }
+        projectName = DockerComposeTools.GetComposeProjectName('My Suite!')
+        self.assertRegex(projectName, '^my-suite_[0-9a-f]{8}$')
+        self.assertNotEqual(projectName, DockerComposeTools.GetComposeProjectName('My Suite!'))
+        testContainerNames = DockerComposeTools.PrepareComposeTestSuite(yamlData, projectName)
+        self.assertEqual(testContainerNames, ['my-service_' + projectName])
+        self.assertEqual(DockerComposeTools.GetContainerNames(yamlData), ['my-service_' + projectName, 'nginx-service_' + projectName])
+        self.assertEqual(yamlData['networks']['backend_network'], None)
+        self.assertEqual(yamlData['networks']['named_network']['name'], 'named_' + projectName)
+        self.assertEqual(yamlData['networks']['shared_network']['name'], 'shared')
+        self.assertEqual(yamlData['volumes']['data']['name'], 'data_' + projectName)
+        log.info('DONE COMPOSE PREPARE TEST SUITE')
+
+    def test_p_ComposeTestSuitesInParallel(self):
+        log.info('COMPOSE TEST SUITES IN PARALLEL')
+        TerminalTools.LoadEnvironmentVariables(os.path.join(TestTools.TEST_SAMPLE_FOLDER, '.env'))
+        outputFolder = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output', 'testSuites')
+        os.makedirs(outputFolder, exist_ok=True)
+        junitFile = os.path.join(outputFolder, 'junit.xml')
+        testSuites = {
+            'suite-1': [os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.yml')],
+            'suite-2': [os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.yml')],
+        }
+        results = DockerComposeTools.ExecuteComposeTestSuites(testSuites, maxParallel=2, junitFile=junitFile, assertSuites=False)
+        self.assertEqual(list(results.keys()), ['suite-1', 'suite-2'])
+        self.assertNotEqual(results['suite-1']['projectName'], results['suite-2']['projectName'])
+        self.assertTrue(os.path.isfile(junitFile))
+        log.info('DONE COMPOSE TEST SUITES IN PARALLEL')
+
+    def test_q_MergeComposeFilesLikeDockerCompose(self):
+        log.info('COMPOSE MERGE LIKE DOCKER COMPOSE')
+        os.environ['TEST_MERGE_HOME'] = '/home/test'
+        outputFolder = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output', 'mergeComposeVariables')
+        os.makedirs(outputFolder, exist_ok=True)
+        composeFile = os.path.join(outputFolder, 'docker-compose.yml')
+        with open(composeFile, 'w') as f:
+            f.write('services:\n  my-service:\n    image: my_repo/my.service:latest\n'
+                    '    command: echo $TEST_MERGE_HOME $$HOME\n    environment:\n      - USER_HOME=$TEST_MERGE_HOME\n')
+        mergedComposeFiles = {}
+        for useDockerCompose in [False, True]:
+            mergedComposeFiles[useDockerCompose] = os.path.join(outputFolder, 'docker-compose.merged.{0}.yml'.format(useDockerCompose))
+            DockerComposeTools.MergeComposeFiles([composeFile], mergedComposeFiles[useDockerCompose], useDockerCompose)
+        services = {useDockerCompose: YamlTools.GetSingleYamlData(mergedComposeFile, replaceEnvironmentVariablesMatches=False)['services']['my-service']
+                    for useDockerCompose, mergedComposeFile in mergedComposeFiles.items()}
+        self.assertEqual(services[False]['environment'], {'USER_HOME': '/home/test'})
+        self.assertEqual(services[False]['environment'], services[True]['environment'])
+        self.assertEqual(services[False]['command'], 'echo /home/test $$HOME')
+        self.assertEqual(services[False]['command'].split(), services[True]['command'])
+        log.info('DONE COMPOSE MERGE LIKE DOCKER COMPOSE')
+
+    def test_r_GetServiceContentHashes(self):
+        log.info('COMPOSE SERVICE CONTENT HASHES')
+        outputFolder = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output', 'contentHashes')
+        for service, dockerfile in [('base', 'FROM python:3-slim\n'), ('app', 'FROM my_repo/base:1.0.0\n')]:
+            os.makedirs(os.path.join(outputFolder, service), exist_ok=True)
+            with open(os.path.join(outputFolder, service, 'Dockerfile'), 'w') as f:
+                f.write(dockerfile)
+        dockerComposeMap = {'services': {
+            'app': {'image': 'my_repo/app:1.0.0', 'build': {'context': 'app'}},
+            'base': {'image': 'my_repo/base:1.0.0', 'build': 'base'},
+        }}
+        contentHashes = DockerComposeTools.GetServiceContentHashes(dockerComposeMap, composeFolder=outputFolder)
+        self.assertEqual(list(contentHashes), ['app', 'base'])
+        armContentHashes = DockerComposeTools.GetServiceContentHashes(dockerComposeMap, ['linux/arm64'], composeFolder=outputFolder)
+        self.assertNotEqual(contentHashes['app'], armContentHashes['app'])
+        dockerComposeMap['services']['app']['build']['platforms'] = ['linux/arm64']
+        self.assertNotEqual(DockerComposeTools.GetServiceContentHashes(dockerComposeMap, composeFolder=outputFolder)['app'], contentHashes['app'])
+        del dockerComposeMap['services']['app']['build']['platforms']
+        with open(os.path.join(outputFolder, 'base', 'requirements.txt'), 'w') as f:
+            f.write('pyyaml\n')
+        changedContentHashes = DockerComposeTools.GetServiceContentHashes(dockerComposeMap, composeFolder=outputFolder)
+        self.assertNotEqual(contentHashes['base'], changedContentHashes['base'])
+        self.assertNotEqual(contentHashes['app'], changedContentHashes['app'])
+        log.info('DONE COMPOSE SERVICE CONTENT HASHES')
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -4,6 +4,7 @@ import os
 import logging
 from tests import TestTools
 from DockerBuildSystem import DockerImageTools
+from benchmarks import BenchmarkTools
 
 TEST_IMAGE = 'test.image'
 TEST_CONTAINER_NAME = 'test-container-' + str(random.randint(0, 100000))
@@ -111,5 +112,56 @@ class TestDockerImageTools(unittest.TestCase):
         self.assertTrue(len(logs) > 0)
         log.info('DONE GET CONTAINER LOGS')
 
+    def test_n_GetImagesInfo(self):
+        log.info('GET IMAGES INFO')
+        DockerImageTools.PullImage('nginx')
+        imagesInfo = DockerImageTools.GetImagesInfo([TEST_IMAGE, 'nginx', TEST_IMAGE])
+        self.assertEqual(len(imagesInfo), 2)
+        self.assertTrue('sha256:' in imagesInfo[TEST_IMAGE]['Id'])
+        self.assertTrue('nginx@sha256:' in imagesInfo['nginx']['RepoDigests'][0])
+        labelValues = DockerImageTools.GetImagesLabel([TEST_IMAGE, 'nginx'], 'owner')
+        self.assertEqual('example owner', labelValues[TEST_IMAGE])
+        self.assertEqual('<no value>', labelValues['nginx'])
+        log.info('DONE GET IMAGES INFO')
+
+    def test_o_VerifyContainerExitCode(self):
+        log.info('VERIFY CONTAINER EXIT CODE')
+        sumExitCodes, sumErrorMsgs = DockerImageTools.VerifyContainerExitCode([TEST_CONTAINER_NAME])
+        self.assertEqual(sumExitCodes, 0)
+        self.assertEqual(sumErrorMsgs, '')
+        log.info('DONE VERIFY CONTAINER EXIT CODE')
+
+    def test_p_InspectCache(self):
+        log.info('INSPECT CACHE')
+        DockerImageTools.EnableInspectCache(ttlInSeconds=60)
+        DockerImageTools.ResetInspectCacheStatistics()
+        try:
+            imageId = DockerImageTools.GetImageId(TEST_IMAGE)
+            self.assertEqual(imageId, DockerImageTools.GetImageInfo(TEST_IMAGE + ':latest')['Id'])
+            statistics = DockerImageTools.GetInspectCacheStatistics()
+            self.assertEqual(statistics['hits'], 1)
+            self.assertEqual(statistics['misses'], 1)
+            DockerImageTools.TagImage(TEST_IMAGE, TEST_IMAGE + ':1.0.0')
+            self.assertEqual(DockerImageTools.GetInspectCacheStatistics()['entries'], 0)
+        finally:
+            DockerImageTools.DisableInspectCache()
+        log.info('DONE INSPECT CACHE')
+
+    def test_q_InspectCacheReturnsCopies(self):
+        log.info('INSPECT CACHE COPIES')
+        DockerImageTools.EnableInspectCache()
+        DockerImageTools.ResetInspectCacheStatistics()
+        try:
+            with BenchmarkTools.FakeDocker():
+                DockerImageTools.GetImageInfo(TEST_IMAGE)['RepoDigests'].clear()
+                DockerImageTools.GetImageInfo(TEST_IMAGE)['Config']['Labels']['changed'] = 'true'
+                imageInfo = DockerImageTools.GetImageInfo(TEST_IMAGE)
+            self.assertEqual(len(imageInfo['RepoDigests']), 1)
+            self.assertEqual(imageInfo['Config']['Labels'], {})
+            self.assertEqual(DockerImageTools.GetInspectCacheStatistics()['misses'], 1)
+        finally:
+            DockerImageTools.DisableInspectCache()
+        log.info('DONE INSPECT CACHE COPIES')
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
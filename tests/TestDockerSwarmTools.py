@@ -63,6 +63,18 @@ class TestDockerSwarmTools(unittest.TestCase):
         DockerSwarmTools.RemoveStack(stack)
         log.info('DONE CREATE STACK')
 
+    def test_g_WaitForStackWithEvents(self):
+        log.info('WAIT FOR STACK WITH EVENTS')
+        stack = 'test-stack-' + str(random.randint(0, 10000))
+        TerminalTools.LoadEnvironmentVariables(os.path.join(TestTools.TEST_SAMPLE_FOLDER, '.env'))
+        DockerComposeTools.DockerComposeBuild([os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.yml')])
+        DockerSwarmTools.DeployStack(os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.yml'), stack)
+        serviceName = stack + '_nginx-service'
+        convergenceTimes = DockerSwarmTools.WaitUntilSwarmServicesAreRunning(30, 1, [serviceName], useEvents=True)
+        self.assertTrue(serviceName in convergenceTimes)
+        DockerSwarmTools.RemoveStack(stack)
+        log.info('DONE WAIT FOR STACK WITH EVENTS')
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
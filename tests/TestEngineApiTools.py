@@ -0,0 +1,165 @@
+import unittest
+import io
+import os
+import json
+import struct
+import tempfile
+import time
+import threading
+import socketserver
+import http.server
+import logging
+from DockerBuildSystem import EngineApiTools, DockerImageTools, DockerSwarmTools
+
+log = logging.getLogger(__name__)
+
+FAKE_IMAGE_INFO = {'Id': 'sha256:1234', 'RepoDigests': ['my_repo/my.service@sha256:5678'], 'Config': {'Labels': {'owner': 'example owner'}}}
+
+
+class FakeEngineApiHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.getPaths.append(self.path)
+        if self.path == '/_ping':
+            self.Respond(200, b'OK')
+        elif self.path == '/images/my_repo/my.service:1.0.0/json':
+            self.Respond(200, json.dumps(FAKE_IMAGE_INFO).encode('utf-8'))
+        elif self.path.startswith('/containers/my-container/logs'):
+            frames = struct.pack('>BxxxI', 1, 6) + b'hello\n' + struct.pack('>BxxxI', 2, 6) + b'error\n'
+            self.Respond(200, frames)
+        elif self.path in ['/images/json?all=true', '/images/json']:
+            images = [{'Id': 'sha256:abc', 'RepoTags': ['my_repo/a:1.0.0', 'my_repo/a:latest']}, {'Id': 'sha256:def', 'RepoTags': ['<none>:<none>']}]
+            self.Respond(200, json.dumps(images).encode('utf-8'))
+        elif self.path == '/services?status=true':
+            services = [{'Spec': {'Name': 'my-stack_my-service'}, 'ServiceStatus': {'RunningTasks': 1, 'DesiredTasks': 2}}]
+            self.Respond(200, json.dumps(services).encode('utf-8'))
+        elif self.path == '/slow':
+            time.sleep(0.5)
+            self.Respond(200, b'OK')
+        else:
+            self.Respond(404, b'{"message": "No such object"}')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((self.path, body))
+        if self.path == '/images/my_repo/my.service:1.0.0/tag?repo=my_repo%2Fmy.service&tag=latest':
+            self.Respond(201, b'')
+        elif self.path == '/networks/create':
+            self.Respond(201, b'{"Id": "abc"}')
+        elif self.path == '/volumes/create':
+            self.Respond(201, b'{"Name": "my-volume"}')
+        else:
+            self.Respond(404, b'{"message": "No such object"}')
+
+    def Respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeEngineApiServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socketPath):
+        super().__init__(socketPath, FakeEngineApiHandler)
+        self.requests = []
+        self.getPaths = []
+        self.connections = 0
+
+    def get_request(self):
+        self.connections += 1
+        request, _ = super().get_request()
+        return request, ('fake', 0)
+
+
+class TestEngineApiTools(unittest.TestCase):
+
+    def setUp(self):
+        self.tempFolder = tempfile.mkdtemp()
+        self.socketPath = os.path.join(self.tempFolder, 'docker.sock')
+        self.server = FakeEngineApiServer(self.socketPath)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        EngineApiTools.EnableEngineApi(self.socketPath)
+
+    def tearDown(self):
+        EngineApiTools.DisableEngineApi()
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.socketPath)
+        os.rmdir(self.tempFolder)
+
+    def test_InspectImage(self):
+        self.assertTrue(EngineApiTools.IsEngineApiAvailable())
+        imageInfo = DockerImageTools.GetImageInfo('my_repo/my.service:1.0.0')
+        self.assertEqual(imageInfo['Id'], 'sha256:1234')
+        self.assertEqual(DockerImageTools.GetImageLabel('my_repo/my.service:1.0.0', 'owner'), 'example owner')
+        self.assertEqual(self.server.connections, 1)
+        self.assertFalse(any(path.startswith('/containers/') for path in self.server.getPaths))
+
+    def test_InspectMissingImage(self):
+        with self.assertRaises(Exception) as context:
+            EngineApiTools.InspectImage('missing')
+        self.assertTrue('No such object' in str(context.exception))
+
+    def test_TagImage(self):
+        DockerImageTools.TagImage('my_repo/my.service:1.0.0', 'my_repo/my.service:latest')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_GetContainerLogs(self):
+        logs = DockerImageTools.GetLogsFromContainer('my-container')
+        self.assertEqual(logs, 'hello\nerror\n')
+        with DockerImageTools.GetLogsFromContainer('my-container', asFile=True) as logsFile:
+            self.assertIsInstance(logsFile, tempfile.SpooledTemporaryFile)
+            self.assertEqual(logsFile.read(), b'hello\nerror\n')
+
+    def test_DemultiplexingWriter(self):
+        frames = struct.pack('>BxxxI', 1, 6) + b'hello\n' + struct.pack('>BxxxI', 2, 0) + struct.pack('>BxxxI', 2, 6) + b'error\n'
+        for data in [frames, b'tty output\n', b'short']:
+            output = io.BytesIO()
+            writer = EngineApiTools.DemultiplexingWriter(output)
+            for i in range(len(data)):
+                writer.write(data[i:i + 1])
+            writer.Finish()
+            self.assertEqual(output.getvalue(), EngineApiTools.DemultiplexStream(data))
+
+    def test_ListImageIds(self):
+        self.assertEqual(EngineApiTools.ListImageIds(), ['sha256:abc', 'sha256:def'])
+        self.assertEqual(EngineApiTools.ListImageTags(), {'my_repo/a:1.0.0': 'sha256:abc', 'my_repo/a:latest': 'sha256:abc'})
+
+    def test_ListServices(self):
+        self.assertEqual(EngineApiTools.ListServices(), [{'Name': 'my-stack_my-service', 'Replicas': '1/2'}])
+        self.assertFalse(DockerSwarmTools.CheckIfSwarmServiceIsRunning(['my-stack_my-service']))
+
+    def test_WaitUntilSwarmServicesAreRunningTimesOut(self):
+        with self.assertRaises(Exception) as context:
+            DockerSwarmTools.WaitUntilSwarmServicesAreRunning(0.3, 0.05, ['my-stack_my-service'], useEvents=True)
+        self.assertTrue('my-stack_my-service' in str(context.exception))
+
+    def test_CreateNetwork(self):
+        DockerSwarmTools.CreateSwarmNetwork('my-network', encrypted=True)
+        path, body = self.server.requests[0]
+        self.assertEqual(json.loads(body.decode('utf-8'))['Options'], {'encrypted': ''})
+
+    def test_CreateVolumeWithFlagOptions(self):
+        DockerSwarmTools.CreateSwarmVolume('my-volume', driverOptions=['o=bind', 'nocopy'])
+        path, body = self.server.requests[0]
+        self.assertEqual(json.loads(body.decode('utf-8'))['DriverOpts'], {'o': 'bind', 'nocopy': ''})
+
+    def test_ConnectionIsResetAfterTimeout(self):
+        EngineApiTools.EnableEngineApi(self.socketPath, timeoutInSeconds=0.1)
+        with self.assertRaises(OSError):
+            EngineApiTools.Request('GET', '/slow')
+        self.assertEqual(EngineApiTools.Request('GET', '/_ping'), b'OK')
+
+    def test_FallbackWhenSocketIsMissing(self):
+        EngineApiTools.EnableEngineApi(os.path.join(self.tempFolder, 'missing.sock'))
+        self.assertFalse(EngineApiTools.IsEngineApiAvailable())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import os
+import logging
+from tests import TestTools
+from DockerBuildSystem import ImageArchiveTools, DockerImageTools, TerminalTools
+from benchmarks import BenchmarkTools
+
+log = logging.getLogger(__name__)
+
+class TestImageArchiveTools(unittest.TestCase):
+
+    def test_OpenCompressedFile(self):
+        outputFolder = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output')
+        os.makedirs(outputFolder, exist_ok=True)
+        archivePath = ImageArchiveTools.GetArchivePath(outputFolder, 'compressed', 'gzip')
+        self.assertTrue(archivePath.endswith('compressed.tar.gz'))
+        self.assertEqual(ImageArchiveTools.GetCompressionFromPath(archivePath), 'gzip')
+        self.assertIsNone(ImageArchiveTools.GetCompressionFromPath('images.tar'))
+        data = b'layer' * 100000
+        with ImageArchiveTools.OpenCompressedFile(archivePath, 'wb', 'gzip') as f:
+            f.write(data)
+        self.assertLess(os.path.getsize(archivePath), len(data))
+        with ImageArchiveTools.OpenCompressedFile(archivePath, 'rb', 'gzip') as f:
+            self.assertEqual(f.read(), data)
+
+
+    def test_WriteAndReadManifest(self):
+        archivePath = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output', 'manifest.tar')
+        os.makedirs(os.path.dirname(archivePath), exist_ok=True)
+        self.assertIsNone(ImageArchiveTools.ReadManifest(archivePath + '.missing'))
+        manifest = {'images': {'my_repo/my.service:1.0.0': 'sha256:abc'}, 'compression': None}
+        ImageArchiveTools.WriteManifest(archivePath, manifest)
+        self.assertEqual(ImageArchiveTools.ReadManifest(archivePath), manifest)
+
+
+    def test_SaveImageArchiveRemovesTemporaryFileOnFailure(self):
+        archivePath = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output', 'failedSave.tar.gz')
+        os.makedirs(os.path.dirname(archivePath), exist_ok=True)
+        DockerImageTools.EnableInspectCache()
+        try:
+            with BenchmarkTools.FakeDocker():
+                ImageArchiveTools.SaveImageArchive(['my_repo/a:1.0.0'], archivePath, 'gzip')
+            archiveBytes = os.path.getsize(archivePath)
+            with BenchmarkTools.FakeDocker(failureRate=1.0):
+                with self.assertRaises(TerminalTools.TerminalCommandError):
+                    ImageArchiveTools.SaveImageArchive(['my_repo/a:1.0.0'], archivePath, 'gzip', skipUnchanged=False)
+        finally:
+            DockerImageTools.DisableInspectCache()
+        self.assertFalse(os.path.exists(archivePath + '.tmp'))
+        self.assertEqual(os.path.getsize(archivePath), archiveBytes)
+
+
+    def test_LoadImageArchiveSkipsExistingImages(self):
+        outputFolder = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output', 'loadImages')
+        os.makedirs(outputFolder, exist_ok=True)
+        archivePaths = [os.path.join(outputFolder, 'a.tar'), os.path.join(outputFolder, 'b.tar.gz')]
+        for archivePath in archivePaths:
+            with open(archivePath, 'wb') as f:
+                f.write(b'archive')
+        ImageArchiveTools.WriteManifest(archivePaths[0], {'images': {'my_repo/a:1.0.0': 'sha256:abc'}, 'compression': None})
+        self.assertEqual(ImageArchiveTools.GetArchivePaths(outputFolder), archivePaths)
+        self.assertEqual(ImageArchiveTools.GetArchivePaths(archivePaths[1]), [archivePaths[1]])
+        result = ImageArchiveTools.LoadImageArchive(archivePaths[0], {'my_repo/a:1.0.0': 'sha256:abc', 'my_repo/b:latest': 'sha256:def'})
+        self.assertTrue(result['skipped'])
+        self.assertEqual(result['bytes'], len(b'archive'))
+        manifest = {'images': {'my_repo/a': 'sha256:abc'}}
+        self.assertTrue(ImageArchiveTools.IsArchiveLoaded(manifest, {'my_repo/a:latest': 'sha256:abc'}))
+        self.assertFalse(ImageArchiveTools.IsArchiveLoaded(manifest, {'my_repo/a:latest': 'sha256:def', 'my_repo/b:latest': 'sha256:abc'}))
+        self.assertFalse(ImageArchiveTools.IsArchiveLoaded(manifest, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
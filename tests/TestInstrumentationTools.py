@@ -0,0 +1,101 @@
+import unittest
+import asyncio
+import threading
+import os
+import json
+import logging
+from tests import TestTools
+from DockerBuildSystem import InstrumentationTools, TerminalTools
+
+log = logging.getLogger(__name__)
+
+class TestInstrumentationTools(unittest.TestCase):
+
+    def test_RecordSpans(self):
+        with InstrumentationTools.RecordSpans() as spans:
+            with InstrumentationTools.Operation('build', 'my_repo/my.service:1.0.0'):
+                TerminalTools.ExecuteTerminalCommands(['echo hello'])
+            TerminalTools.ExecuteTerminalCommandAndGetOutput('echo hello world')
+            TerminalTools.ExecuteTerminalCommands(['exit 3'])
+        TerminalTools.ExecuteTerminalCommands(['echo not recorded'])
+        self.assertEqual(len(spans), 3)
+        self.assertEqual(spans[0]['operation'], 'build')
+        self.assertEqual(spans[0]['target'], 'my_repo/my.service:1.0.0')
+        self.assertEqual(spans[0]['outputBytes'], len('hello\n'))
+        self.assertEqual(spans[1]['operation'], 'echo')
+        self.assertEqual(spans[1]['outputBytes'], len('hello world\n'))
+        self.assertIsNone(spans[1]['target'])
+        self.assertTrue(spans[2]['failed'])
+        self.assertEqual(spans[2]['returnCode'], 3)
+
+
+    def test_RecordOutputBytes(self):
+        with InstrumentationTools.RecordSpans() as spans:
+            TerminalTools.ExecuteTerminalCommands(['printf "caf\\303\\251  \\r\\nend"'])
+        self.assertEqual(spans[0]['outputBytes'], len('café  \r\nend'.encode('utf-8')))
+
+
+    def test_RecordRetries(self):
+        retryPolicy = TerminalTools.RetryPolicy(maxAttempts=3, initialDelayInSeconds=0.0, jitterFraction=0.0, retryOnErrorCode=True)
+        with InstrumentationTools.RecordSpans() as spans:
+            with self.assertRaises(TerminalTools.TerminalCommandError):
+                TerminalTools.ExecuteTerminalCommands(['exit 1'], True, retryPolicy=retryPolicy)
+        self.assertEqual(spans[0]['retries'], 2)
+        self.assertTrue(spans[0]['failed'])
+
+
+    def test_RecordSpansOfCurrentContext(self):
+        results = {}
+        def RunCommands(name, count):
+            with InstrumentationTools.RecordSpans(currentContextOnly=True) as spans:
+                TerminalTools.ExecuteTerminalCommands(['echo ' + name] * count)
+            results[name] = spans
+        threads = [threading.Thread(target=RunCommands, args=(name, count)) for name, count in [('a', 2), ('b', 3)]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([span['command'] for span in results['a']], ['echo a'] * 2)
+        self.assertEqual([span['command'] for span in results['b']], ['echo b'] * 3)
+
+
+    def test_RecordAsyncSpans(self):
+        with InstrumentationTools.RecordSpans() as spans:
+            with InstrumentationTools.Operation('pull', 'nginx'):
+                asyncio.run(TerminalTools.ExecuteTerminalCommandAndGetOutputAsync('echo hello'))
+        self.assertEqual(len(spans), 1)
+        self.assertEqual((spans[0]['operation'], spans[0]['target'], spans[0]['outputBytes']), ('pull', 'nginx', len('hello\n')))
+
+
+    def test_GetOperationFromCommand(self):
+        self.assertEqual(InstrumentationTools.GetOperationFromCommand('docker push my_repo/my.service:1.0.0'), 'push')
+        self.assertEqual(InstrumentationTools.GetOperationFromCommand('docker compose -f a.yml -f b.yml up -d'), 'compose up')
+        self.assertEqual(InstrumentationTools.GetOperationFromCommand('docker buildx build --builder x .'), 'buildx build')
+
+
+    def test_JsonLinesExporterAndSummary(self):
+        outputFile = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output', 'spans.jsonl')
+        os.makedirs(os.path.dirname(outputFile), exist_ok=True)
+        if os.path.isfile(outputFile):
+            os.remove(outputFile)
+        exporter = InstrumentationTools.JsonLinesExporter(outputFile)
+        InstrumentationTools.AddSpanCallback(exporter)
+        try:
+            with InstrumentationTools.RecordSpans() as spans:
+                with InstrumentationTools.Operation('push', 'a'):
+                    TerminalTools.ExecuteTerminalCommands(['echo a', 'echo a'])
+                with InstrumentationTools.Operation('push', 'b'):
+                    TerminalTools.ExecuteTerminalCommands(['echo b'])
+        finally:
+            InstrumentationTools.RemoveSpanCallback(exporter)
+            exporter.Close()
+        with open(outputFile, 'r') as f:
+            exportedSpans = [json.loads(line) for line in f]
+        self.assertEqual([span['target'] for span in exportedSpans], ['a', 'a', 'b'])
+        summary = InstrumentationTools.GetSpanSummary(spans)
+        self.assertEqual(sorted([(row['target'], row['count']) for row in summary]), [('a', 2), ('b', 1)])
+        InstrumentationTools.PrintSpanSummary(spans)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import os
+import logging
+import xml.etree.ElementTree as ElementTree
+from tests import TestTools
+from DockerBuildSystem import JUnitTools
+
+log = logging.getLogger(__name__)
+
+RESULTS = {
+    'suite-1': {'projectName': 'suite-1_0001', 'seconds': 12.5, 'timings': {'build': 2.0, 'up': 10.0, 'down': 0.5},
+                'containers': {'tests_suite-1_0001': 0, 'db_suite-1_0001': 0}, 'passed': True, 'error': None},
+    'suite-2': {'projectName': 'suite-2_0002', 'seconds': 8.0, 'timings': {'build': 2.0, 'up': 6.0},
+                'containers': {'tests_suite-2_0002': 1}, 'passed': False, 'error': None},
+    'suite-3': {'projectName': 'suite-3_0003', 'seconds': 1.0, 'timings': {'build': 1.0},
+                'containers': {}, 'passed': False, 'error': 'build failed\nstep 3'},
+}
+
+class TestJUnitTools(unittest.TestCase):
+
+    def test_GetJUnitXml(self):
+        testSuites = JUnitTools.GetJUnitXml(RESULTS).getroot()
+        self.assertEqual(testSuites.get('tests'), '4')
+        self.assertEqual(testSuites.get('failures'), '1')
+        self.assertEqual(testSuites.get('errors'), '1')
+        self.assertEqual(testSuites.get('time'), '21.500')
+        suites = {testSuite.get('name'): testSuite for testSuite in testSuites.findall('testsuite')}
+        self.assertEqual(suites['suite-1'].get('tests'), '2')
+        self.assertEqual(suites['suite-1'].findall('testcase/failure'), [])
+        self.assertEqual(suites['suite-2'].find('testcase/failure').get('message'), "Container 'tests_suite-2_0002' exited with code 1")
+        error = suites['suite-3'].find('testcase/error')
+        self.assertEqual(error.get('message'), 'build failed')
+        self.assertEqual(error.text, 'build failed\nstep 3')
+        properties = {p.get('name'): p.get('value') for p in suites['suite-1'].findall('properties/property')}
+        self.assertEqual(properties, {'projectName': 'suite-1_0001', 'buildSeconds': '2.000', 'upSeconds': '10.000', 'downSeconds': '0.500'})
+
+
+    def test_WriteJUnitReport(self):
+        outputFolder = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output')
+        os.makedirs(outputFolder, exist_ok=True)
+        junitFile = os.path.join(outputFolder, 'junit.xml')
+        JUnitTools.WriteJUnitReport(RESULTS, junitFile)
+        self.assertEqual(len(ElementTree.parse(junitFile).getroot().findall('testsuite')), 3)
+        JUnitTools.PrintTestReport(RESULTS)
+
+
+if __name__ == '__main__':
+    unittest.main()
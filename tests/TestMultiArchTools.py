@@ -0,0 +1,24 @@
+import unittest
+import os
+import logging
+from tests import TestTools
+from DockerBuildSystem import MultiArchTools
+
+log = logging.getLogger(__name__)
+
+class TestMultiArchTools(unittest.TestCase):
+
+    def test_WriteAndLoadDigestsFiles(self):
+        outputFolder = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output')
+        digestsFiles = [os.path.join(outputFolder, 'digests-amd64.json'), os.path.join(outputFolder, 'digests-arm64.json')]
+        for digestsFile, platform in zip(digestsFiles, ['linux/amd64', 'linux/arm64']):
+            MultiArchTools.WriteDigestsFile(digestsFile, {
+                'my-service': {'image': 'my_repo/my.service:1.0.0', 'repo': 'my_repo/my.service', 'tag': '1.0.0', 'digest': 'sha256:' + platform, 'platforms': [platform]}
+            })
+            self.assertFalse(os.path.isfile(digestsFile + '.tmp'))
+        grouped = MultiArchTools.LoadDigestsFiles(digestsFiles)
+        self.assertEqual([entry['digest'] for entry in grouped['my-service']], ['sha256:linux/amd64', 'sha256:linux/arm64'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import time
+import threading
+import logging
+from DockerBuildSystem import ParallelTools
+
+log = logging.getLogger(__name__)
+
+class TestParallelTools(unittest.TestCase):
+
+    def test_ExecuteInParallel(self):
+        tasks = [('task-' + str(i), lambda i=i: i * 2) for i in range(5)]
+        results = ParallelTools.ExecuteInParallel(tasks, 3)
+        self.assertEqual(list(results.keys()), ['task-' + str(i) for i in range(5)])
+        self.assertEqual(results['task-4'], 8)
+
+
+    def test_ExecuteInParallelIsBounded(self):
+        lock = threading.Lock()
+        running = [0]
+        maxRunning = [0]
+        def Task():
+            with lock:
+                running[0] += 1
+                maxRunning[0] = max(maxRunning[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+        ParallelTools.ExecuteInParallel([(str(i), Task) for i in range(8)], 2)
+        self.assertEqual(maxRunning[0], 2)
+
+
+    def test_ExecuteInParallelStopsOnFirstFailure(self):
+        finished = []
+        def FailingTask():
+            raise Exception('build failed')
+        def SlowTask():
+            time.sleep(0.1)
+            finished.append('slow')
+        tasks = [('failing', FailingTask), ('slow', SlowTask)] + [('pending-' + str(i), SlowTask) for i in range(10)]
+        with self.assertRaises(Exception) as context:
+            ParallelTools.ExecuteInParallel(tasks, 2)
+        self.assertTrue("'failing'" in str(context.exception))
+        self.assertTrue('slow' in finished)
+        self.assertLess(len(finished), 11)
+
+
+    def test_ExecuteGraphInParallel(self):
+        dependencies = {'app': ['base'], 'tests': ['app', 'base'], 'base': [], 'docs': []}
+        self.assertEqual(ParallelTools.GetTopologicalWaves(dependencies), [['base', 'docs'], ['app'], ['tests']])
+        lock = threading.Lock()
+        finished = []
+        def Task(name):
+            time.sleep(0.02)
+            with lock:
+                finished.append(name)
+            return name
+        tasks = [(name, lambda name=name: Task(name)) for name in dependencies]
+        durations = {}
+        results = ParallelTools.ExecuteGraphInParallel(tasks, dependencies, 4, durations)
+        self.assertEqual(results, {name: name for name in dependencies})
+        self.assertLess(finished.index('base'), finished.index('app'))
+        self.assertLess(finished.index('app'), finished.index('tests'))
+        path, seconds = ParallelTools.GetCriticalPath(dependencies, durations)
+        self.assertEqual(path, ['base', 'app', 'tests'])
+        self.assertAlmostEqual(seconds, durations['base'] + durations['app'] + durations['tests'])
+
+
+    def test_ExecuteGraphInParallelDetectsCycles(self):
+        dependencies = {'a': ['c'], 'b': ['a'], 'c': ['b']}
+        with self.assertRaises(Exception) as context:
+            ParallelTools.ExecuteGraphInParallel([(name, lambda: None) for name in dependencies], dependencies, 2)
+        self.assertTrue('a -> c -> b -> a' in str(context.exception))
+
+
+    def test_ExecuteGraphInParallelSkipsDependentsOfFailures(self):
+        started = []
+        def FailingTask():
+            raise Exception('build failed')
+        tasks = [('base', FailingTask), ('app', lambda: started.append('app'))]
+        with self.assertRaises(Exception) as context:
+            ParallelTools.ExecuteGraphInParallel(tasks, {'app': ['base']}, 2)
+        self.assertTrue("'base'" in str(context.exception))
+        self.assertEqual(started, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,10 @@
 import unittest
+import sys
+import asyncio
+import time
+import re
 import os
+import tempfile
 import logging
 from tests import TestTools
 from DockerBuildSystem import TerminalTools
@@ -27,6 +32,118 @@ class TestTerminalTools(unittest.TestCase):
         self.assertTrue('version' in str(version).lower())
 
 
+    def test_ExecuteTerminalCommandAndGetOutputTypes(self):
+        cmd = 'head -c 200000 /dev/zero'
+        output = TerminalTools.ExecuteTerminalCommandAndGetOutput(cmd, outputType='memoryview')
+        self.assertEqual(len(output), 200000)
+        with TerminalTools.ExecuteTerminalCommandAndGetOutput(cmd, outputType='file', spillToFileAboveBytes=1000) as f:
+            self.assertEqual(len(f.read()), 200000)
+
+
+    def test_ErrorOutputIsTruncated(self):
+        outputSize = TerminalTools.ERROR_OUTPUT_SIZE + 1000
+        with self.assertRaises(TerminalTools.TerminalCommandError) as context:
+            TerminalTools.ExecuteTerminalCommandAndGetOutput('head -c {0} /dev/zero | tr "\\0" x; echo end; exit 1'.format(outputSize), outputType='file')
+        message = str(context.exception)
+        self.assertTrue('[1004 bytes of output truncated]' in message)
+        self.assertTrue(message.endswith('xend\n'))
+        self.assertLess(len(message), TerminalTools.ERROR_OUTPUT_SIZE + 1000)
+
+
+    def test_ExecuteTerminalCommandAndGetOutputTransientErrorAcrossChunks(self):
+        chunkSize = TerminalTools.OUTPUT_CHUNK_SIZE
+        TerminalTools.OUTPUT_CHUNK_SIZE = 4
+        try:
+            with self.assertRaises(Exception) as context:
+                TerminalTools.ExecuteTerminalCommandAndGetOutput('echo abc; echo Connection RESET by peer', transientErrorPatterns=['connection reset'])
+            self.assertTrue('Transient error detected' in str(context.exception))
+        finally:
+            TerminalTools.OUTPUT_CHUNK_SIZE = chunkSize
+
+
+    def test_TransientErrorMatcher(self):
+        timeoutPattern = re.compile(r'i/o timeout after \d+s')
+        matcher = TerminalTools.GetTransientErrorMatcher(['Connection Reset', timeoutPattern])
+        self.assertIs(matcher, TerminalTools.GetTransientErrorMatcher(['Connection Reset', timeoutPattern]))
+        self.assertEqual(matcher.MatchLine('read: connection reset by peer'), 'Connection Reset')
+        self.assertEqual(matcher.MatchLine(b'dial tcp: i/o timeout after 30s'), timeoutPattern)
+        self.assertIsNone(matcher.MatchLine('i/o timeout after s'))
+        matches = matcher.FindMatches('ok\nconnection reset\nok\ni/o timeout after 5s\n')
+        self.assertEqual([match.lineNumber for match in matches], [2, 4])
+        self.assertEqual(matches[1].line, 'i/o timeout after 5s')
+        inlineFlagsPattern = re.compile(r'(?i)(?s)TLS handshake.timeout')
+        matcher = TerminalTools.GetTransientErrorMatcher([inlineFlagsPattern, re.compile(b'(?m)^EOF$')])
+        self.assertEqual(matcher.MatchLine('net/http: tls HANDSHAKE timeout'), inlineFlagsPattern)
+        self.assertIsNotNone(matcher.MatchLine(b'read\nEOF'))
+        self.assertIsNone(matcher.MatchLine(b'read: EOF'))
+
+
+    def test_ExecuteTerminalCommandsReportsTransientErrors(self):
+        with self.assertRaises(TerminalTools.TerminalCommandError) as context:
+            TerminalTools.ExecuteTerminalCommands(['echo ok; echo TLS handshake timeout'], True, transientErrorPatterns=['tls handshake timeout'])
+        self.assertEqual(context.exception.returnCode, 0)
+        self.assertEqual(context.exception.transientErrors[0].lineNumber, 2)
+        self.assertEqual(context.exception.transientErrors[0].pattern, 'tls handshake timeout')
+
+
+    def test_ExecuteTerminalCommandsWithRetryPolicy(self):
+        marker = os.path.join(tempfile.mkdtemp(), 'failed-once')
+        cmd = 'test -f {0} || (touch {0}; echo connection reset by peer; exit 1)'.format(marker)
+        retryPolicy = TerminalTools.RetryPolicy(maxAttempts=3, initialDelayInSeconds=0.01, transientErrorPatterns=['connection reset'])
+        TerminalTools.ExecuteTerminalCommands([cmd], True, retryPolicy=retryPolicy)
+        statistics = retryPolicy.GetStatistics()
+        self.assertEqual(statistics['retryCount'], 1)
+        self.assertEqual(statistics['retriesByPattern'], {'connection reset': 1})
+        self.assertEqual(retryPolicy.GetCommandStatistics(cmd)['attempts'], 2)
+        os.remove(marker)
+        os.rmdir(os.path.dirname(marker))
+
+
+    def test_ExecuteTerminalCommandsWithRetryPolicyDoesNotRetryPermanentErrors(self):
+        retryPolicy = TerminalTools.RetryPolicy(maxAttempts=3, initialDelayInSeconds=0.01, transientErrorPatterns=['connection reset'])
+        with self.assertRaises(TerminalTools.TerminalCommandError):
+            TerminalTools.ExecuteTerminalCommands(['exit 1'], True, retryPolicy=retryPolicy)
+        self.assertEqual(retryPolicy.GetCommandStatistics('exit 1')['attempts'], 1)
+
+        retryPolicy = TerminalTools.RetryPolicy(maxAttempts=3, initialDelayInSeconds=0.01, retryOnErrorCode=True)
+        with self.assertRaises(TerminalTools.TerminalCommandError):
+            TerminalTools.ExecuteTerminalCommands(['exit 1'], True, retryPolicy=retryPolicy)
+        self.assertEqual(retryPolicy.GetCommandStatistics('exit 1')['attempts'], 3)
+
+
+    def test_ExecuteTerminalCommandsAsync(self):
+        asyncio.run(TerminalTools.ExecuteTerminalCommandsAsync(['echo first', 'echo second'], True))
+        with self.assertRaises(Exception):
+            asyncio.run(TerminalTools.ExecuteTerminalCommandsAsync(['echo connection reset by peer'], True, transientErrorPatterns=['Connection Reset']))
+
+
+    def test_ExecuteTerminalCommandAndGetOutputAsync(self):
+        output = asyncio.run(TerminalTools.ExecuteTerminalCommandAndGetOutputAsync('echo first && echo second'))
+        self.assertEqual(output, b'first\nsecond\n')
+        lineSize = 3 * TerminalTools.ASYNC_STREAM_LIMIT + 10
+        command = '{0} -c "import sys; sys.stdout.write(\'x\' * {1} + \'\\nlast\')"'.format(sys.executable, lineSize)
+        output = asyncio.run(TerminalTools.ExecuteTerminalCommandAndGetOutputAsync(command))
+        self.assertEqual(output, b'x' * lineSize + b'\nlast')
+
+
+    def test_ExecuteTerminalCommandsAsyncTimeout(self):
+        startTime = time.time()
+        with self.assertRaises(Exception) as context:
+            asyncio.run(TerminalTools.ExecuteTerminalCommandsAsync(['sleep 10'], True, timeoutInSeconds=0.2))
+        self.assertTrue('timed out' in str(context.exception))
+        self.assertLess(time.time() - startTime, 5)
+
+
+    def test_ExecuteTerminalCommandsConcurrentlyAsync(self):
+        startTime = time.time()
+        asyncio.run(TerminalTools.ExecuteTerminalCommandsConcurrentlyAsync(['sleep 0.3'] * 4, maxParallel=4))
+        self.assertLess(time.time() - startTime, 1.0)
+        startTime = time.time()
+        with self.assertRaises(Exception):
+            asyncio.run(TerminalTools.ExecuteTerminalCommandsConcurrentlyAsync(['exit 1', 'sleep 10'], maxParallel=2))
+        self.assertLess(time.time() - startTime, 5)
+
+
     def test_ExportVariableToEnvironment(self):
         variable = 'variable'
         variableName = 'variableName'
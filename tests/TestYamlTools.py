@@ -35,5 +35,114 @@ class TestYamlTools(unittest.TestCase):
         self.assertTrue('test-value' in yamlString)
 
 
+    def test_InterpolateString(self):
+        environment = {'SET': 'value', 'EMPTY': ''}
+        self.assertEqual(YamlTools.InterpolateString('${SET} ${UNSET} $${SET} $$SET', environment), 'value  ${SET} $SET')
+        self.assertEqual(YamlTools.InterpolateString('${UNSET:-a} ${EMPTY:-b} ${EMPTY-c} ${UNSET-d}', environment), 'a b  d')
+        self.assertEqual(YamlTools.InterpolateString('${SET:+alt} ${EMPTY:+alt} ${EMPTY+alt}', environment), 'alt  alt')
+        self.assertEqual(YamlTools.InterpolateString('${UNSET:-${SET}-default}', environment), 'value-default')
+        self.assertEqual(YamlTools.InterpolateString('${SET:?missing}', environment), 'value')
+        with self.assertRaises(Exception) as context:
+            YamlTools.InterpolateString('${EMPTY:?EMPTY must be set}', environment)
+        self.assertTrue('EMPTY must be set' in str(context.exception))
+        self.assertEqual(YamlTools.InterpolateString('${EMPTY?unused}', environment), '')
+        self.assertEqual(YamlTools.InterpolateString('$SET $SET_suffix $UNSET-x $1 $$SET', environment), 'value  -x $1 $SET')
+        self.assertEqual(YamlTools.GetEnvironmentVariableNames('${A} $${B} ${C:-${D}} $E $$F'), ['A', 'C', 'D', 'E'])
+        self.assertEqual(YamlTools.InterpolateString('${SET} $$SET ${UNSET:-$$x}', environment, keepEscapes=True), 'value $$SET $$x')
+
+
+    def test_DumpYamlDataKeepsEscapes(self):
+        os.environ['TEST_ESCAPE_KEY'] = 'test-value'
+        outputFolder = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output')
+        yamlFile = os.path.join(outputFolder, 'docker-compose.escapes.yml')
+        YamlTools.CreateFoldersInPath(yamlFile)
+        with open(yamlFile, 'w') as f:
+            f.write('services:\n  my-service:\n    command: echo $$HOME ${TEST_ESCAPE_KEY}\n')
+        yamlData = YamlTools.GetYamlData([yamlFile])
+        self.assertEqual(yamlData['services']['my-service']['command'], 'echo $$HOME test-value')
+        dumpedYamlFile = os.path.join(outputFolder, 'docker-compose.escapes.dumped.yml')
+        YamlTools.DumpYamlDataToFile(yamlData, dumpedYamlFile)
+        self.assertEqual(YamlTools.GetYamlData([dumpedYamlFile]), yamlData)
+
+
+    def test_GetYamlDataFromCache(self):
+        yamlFile = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output', 'docker-compose.cache.yml')
+        YamlTools.CreateFoldersInPath(yamlFile)
+        with open(yamlFile, 'w') as f:
+            f.write('services:\n  my-service:\n    image: ${TEST_CACHE_IMAGE:-default.image}\n')
+        YamlTools.ClearYamlCache()
+        os.environ.pop('TEST_CACHE_IMAGE', None)
+        misses = YamlTools.GetYamlCacheStatistics()['misses']
+
+        yamlData = YamlTools.GetYamlData([yamlFile])
+        self.assertEqual(yamlData['services']['my-service']['image'], 'default.image')
+        yamlData['services']['my-service']['image'] = 'changed.image'
+        yamlData = YamlTools.GetYamlData([yamlFile])
+        self.assertEqual(yamlData['services']['my-service']['image'], 'default.image')
+        self.assertEqual(YamlTools.GetYamlCacheStatistics()['misses'], misses + 1)
+
+        os.environ['TEST_CACHE_IMAGE'] = 'env.image'
+        yamlData = YamlTools.GetYamlData([yamlFile])
+        self.assertEqual(yamlData['services']['my-service']['image'], 'env.image')
+        self.assertEqual(YamlTools.GetYamlCacheStatistics()['misses'], misses + 2)
+
+        with open(yamlFile, 'w') as f:
+            f.write('services:\n  my-other-service:\n    image: other.image\n')
+        yamlData = YamlTools.GetYamlData([yamlFile])
+        self.assertTrue('my-other-service' in yamlData['services'])
+        del os.environ['TEST_CACHE_IMAGE']
+
+
+    def test_GetYamlDataFromCacheAfterSameSizeRewrite(self):
+        yamlFile = os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'output', 'docker-compose.rewrite.yml')
+        YamlTools.DumpYamlDataToFile({'services': {'my-service': {'image': 'repo/svc:1.0.1'}}}, yamlFile)
+        self.assertEqual(YamlTools.GetYamlData([yamlFile])['services']['my-service']['image'], 'repo/svc:1.0.1')
+        fileStat = os.stat(yamlFile)
+        YamlTools.DumpYamlDataToFile({'services': {'my-service': {'image': 'repo/svc:1.0.2'}}}, yamlFile)
+        os.utime(yamlFile, ns=(fileStat.st_atime_ns, fileStat.st_mtime_ns))
+        self.assertEqual(YamlTools.GetYamlData([yamlFile])['services']['my-service']['image'], 'repo/svc:1.0.2')
+        with open(yamlFile, 'w') as f:
+            f.write('services:\n  my-service:\n    image: repo/svc:1.0.3\n')
+        os.utime(yamlFile, ns=(fileStat.st_atime_ns, fileStat.st_mtime_ns))
+        self.assertEqual(os.path.getsize(yamlFile), fileStat.st_size)
+        self.assertEqual(YamlTools.GetYamlData([yamlFile])['services']['my-service']['image'], 'repo/svc:1.0.3')
+
+
+    def test_MergeYamlDataWithComposeStrategies(self):
+        yamlData1 = {'services': {'my-service': {
+            'command': ['run', '--fast'],
+            'environment': ['KEY_1=value', 'KEY_2=value'],
+            'ports': ['80:80'],
+            'volumes': ['data:/data', {'type': 'bind', 'source': './logs', 'target': '/logs'}],
+        }}}
+        yamlData2 = {'services': {'my-service': {
+            'command': ['run'],
+            'environment': ['KEY_2=new_value', 'KEY_3=value'],
+            'ports': ['80:80', '443:443'],
+            'volumes': ['other_data:/data', {'type': 'bind', 'source': './logs', 'target': '/logs'}],
+        }}}
+        provenance = {}
+        yamlData = YamlTools.MergeYamlData({}, yamlData1, YamlTools.COMPOSE_MERGE_STRATEGIES, provenance, 'docker-compose.yml')
+        self.assertEqual(provenance[('services', 'my-service', 'command', 1)], 'docker-compose.yml')
+        yamlData = YamlTools.MergeYamlData(yamlData, yamlData2, YamlTools.COMPOSE_MERGE_STRATEGIES, provenance, 'docker-compose.override.yml')
+        service = yamlData['services']['my-service']
+        self.assertEqual(service['command'], ['run'])
+        self.assertEqual(service['environment'], ['KEY_1=value', 'KEY_2=new_value', 'KEY_3=value'])
+        self.assertEqual(service['ports'], ['80:80', '443:443'])
+        self.assertEqual(service['volumes'], ['other_data:/data', {'type': 'bind', 'source': './logs', 'target': '/logs'}])
+        self.assertEqual(provenance[('services', 'my-service', 'environment', 1)], 'docker-compose.override.yml')
+        self.assertEqual(provenance[('services', 'my-service', 'command', 0)], 'docker-compose.override.yml')
+        self.assertFalse(('services', 'my-service', 'command', 1) in provenance)
+
+
+    def test_GetMergedYamlDataProvenance(self):
+        TerminalTools.LoadEnvironmentVariables(os.path.join(TestTools.TEST_SAMPLE_FOLDER, '.env'))
+        files = [os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.yml'), os.path.join(TestTools.TEST_SAMPLE_FOLDER, 'docker-compose.override.yml')]
+        provenance = {}
+        YamlTools.GetYamlData(files, provenance=provenance)
+        self.assertEqual(provenance[('services', 'my-service', 'image')], files[0])
+        self.assertEqual(provenance[('services', 'my-service', 'container_name')], files[1])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file